@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Time the client-side cost of Api.request() for a large list GET and a large bulk POST,
+against an in-process stand-in session (no network), with debug logging off:
+the earlier pipeline (eager debug formatting, bodies decoded to str, stdlib json)
+against the current one with the json and orjson codecs.
+"""
+
+import sys
+import json
+import time
+import argparse
+
+import opalstack
+from opalstack.codec import orjson
+from standin import make_items
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Request pipeline codec benchmark')
+    parser.add_argument('-n', '--rows', type=int, default=20000, help='items in the list response and the POST body')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='requests per case; the best is reported')
+    return parser.parse_args(sys.argv[1:])
+
+class CannedResponse():
+    def __init__(self, content):
+        self.status_code = 200
+        self.headers = {}
+        self.content = content
+
+class CannedSession():
+    """
+    Answers every GET with the same list body and echoes POSTed bodies back, as the API does for creates.
+    """
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, url):
+        return CannedResponse(self.body)
+
+    def post(self, url, data=None, **kwargs):
+        # requests encodes json= bodies with the stdlib
+        if 'json' in kwargs: data = json.dumps(kwargs['json']).encode()
+        return CannedResponse(data)
+
+def eager_request(opalapi, urlpath, method, dataObj):
+    # Api.request() before codecs: every debug string was built whether or not it was logged
+    log = opalstack.api.log
+    if method == 'GET':
+        log.debug(f'Performing GET {urlpath}')
+        resp = opalapi.session.get(opalapi.url + urlpath)
+    else:
+        log.debug(f'Performing POST {urlpath} with {repr(dataObj)}')
+        resp = opalapi.session.post(opalapi.url + urlpath, json=dataObj)
+    log.debug(resp.content.decode())
+    result = json.loads(resp.content.decode())
+    log.debug(f'Got resp: {repr(resp)} and result {repr(result)}')
+    return result
+
+def best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main(args):
+    items = make_items('dnsrecord', args.rows, domain='domain-00000001', type='A', content='10.0.0.1', ttl=3600)
+    body = json.dumps(items).encode()
+    tocreate = [{'domain': 'domain-00000001', 'type': 'TXT', 'content': f'v=spf1 include:{i}.example.com ~all'} for i in range(args.rows)]
+    print(f'{"pipeline":<16} {"GET list":>10} {"POST bulk":>10}')
+    pipelines = {'eager, json': None, 'lazy, json': 'json'}
+    if orjson is not None: pipelines['lazy, orjson'] = 'orjson'
+    for name, codec in pipelines.items():
+        opalapi = opalstack.Api('benchmark', codec=codec or 'json', coalesce=False, retry=opalstack.RetryPolicy(retries=0))
+        opalapi.session = CannedSession(body)
+        if codec is None:
+            get = lambda: eager_request(opalapi, '/dnsrecord/list/', 'GET', None)
+            post = lambda: eager_request(opalapi, '/dnsrecord/create/', 'POST', tocreate)
+        else:
+            get = lambda: opalapi.request('/dnsrecord/list/', 'GET', None)
+            post = lambda: opalapi.request('/dnsrecord/create/', 'POST', tocreate)
+        print(f'{name:<16} {best(get, args.repeat) * 1000:>8.1f}ms {best(post, args.repeat) * 1000:>8.1f}ms')
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
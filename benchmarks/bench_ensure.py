@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Time ensure() planning (plan_ensure(), which makes no API calls) over synthetic dnsrecords,
+with the hash-keyed planner and with the pairwise planner used for overridden check_* policies.
+"""
+
+import sys
+import time
+import types
+import random
+import argparse
+
+from opalstack.dnsrecords import DnsrecordsManager
+
+def get_args():
+    parser = argparse.ArgumentParser(description='ensure() planning benchmark')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='number of existing records')
+    parser.add_argument('--pairwise-max', type=int, default=2000, help='largest size to also run through the pairwise planner')
+    return parser.parse_args(sys.argv[1:])
+
+def make_records(n, rng):
+    return [
+        { 'id': f'dns{i}',
+          'domain': f'domain{i % 500}',
+          'type': 'TXT',
+          'content': f'v={rng.randrange(n)}',
+          'priority': 10,
+          'ttl': 3600 }
+        for i in range(n)
+    ]
+
+def measure(manager, existing, needed):
+    started = time.perf_counter()
+    toretain, todelete, tocreate = manager.plan_ensure(existing, needed, purge=True)
+    elapsed = time.perf_counter() - started
+    return elapsed, (len(toretain), len(todelete), len(tocreate))
+
+def main(args):
+    rng = random.Random(0)
+    hashed = DnsrecordsManager(None)
+    pairwise = DnsrecordsManager(None)
+    pairwise.check_equals = types.MethodType(DnsrecordsManager.check_equals, pairwise)
+
+    print(f'{"items":>8} {"hashed":>10} {"pairwise":>10}   retain/delete/create')
+    for n in args.sizes:
+        existing = make_records(n, rng)
+        # Keep 90% of the records and ask for 10% new ones
+        needed = [{k: v for k, v in item.items() if k != 'id'} for item in existing[: n * 9 // 10]]
+        needed += [dict(item, content='new') for item in needed[: n // 10]]
+
+        hashed_elapsed, counts = measure(hashed, existing, needed)
+        if n <= args.pairwise_max:
+            pairwise_elapsed, pairwise_counts = measure(pairwise, existing, needed)
+            assert pairwise_counts == counts
+            pairwise_str = f'{pairwise_elapsed:>9.3f}s'
+        else:
+            pairwise_str = f'{"skipped":>10}'
+        print(f'{n:>8} {hashed_elapsed:>9.3f}s {pairwise_str}   {counts}')
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
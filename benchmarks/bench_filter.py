@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Filter a large dnsrecords-like collection with typical keymaps and report rows/sec,
+for the compiled filters behind util.filt() and util.ifilt(), against the earlier
+implementation, which copied every item once per keypath and re-split keypaths per item.
+Then time a loop of filt_one_or_none() lookups, as scripts resolving many records do,
+over a plain list and over an IndexedList.
+"""
+
+import sys
+import time
+import argparse
+
+from opalstack.util import filt, ifilt, filt_one_or_none, IndexedList
+from opalstack.filters import In, Regex, Ge
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Filter throughput benchmark')
+    parser.add_argument('-n', '--rows', type=int, default=50000, help='rows in the collection')
+    parser.add_argument('-l', '--lookups', type=int, default=300, help='lookups in the lookup loop')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='runs per case; the best is reported')
+    return parser.parse_args(sys.argv[1:])
+
+def copying_filt(items, keymap, sep='.'):
+    filtered = []
+    for item in items:
+        for keypath in keymap:
+            val = item.copy()
+            for key in keypath.split(sep):
+                val = val[key]
+            if val != keymap[keypath]: break
+        else:
+            filtered.append(item)
+    return filtered
+
+def make_rows(count):
+    types = ['A', 'AAAA', 'CNAME', 'MX', 'TXT']
+    return [{
+        'id': f'dnsrecord-{i:08d}',
+        'domain': {'id': f'domain-{i % 500:08d}', 'name': f'example{i % 500}.com'},
+        'type': types[i % len(types)],
+        'content': f'10.0.{i // 256 % 256}.{i % 256}',
+        'priority': 10,
+        'ttl': 300 * (1 + i % 12),
+    } for i in range(count)]
+
+def best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main(args):
+    rows = make_rows(args.rows)
+    keymaps = {
+        'one key':          {'type': 'A'},
+        'nested keys':      {'domain.name': 'example7.com', 'type': 'MX'},
+        'operators':        {'type': In(['A', 'AAAA']), 'ttl': Ge(1800), 'content': Regex(r'\.1\d$')},
+    }
+    print(f'{"keymap":<14} {"implementation":<16} {"rows/sec":>12}')
+    for label, keymap in keymaps.items():
+        cases = {
+            'filt':      lambda: filt(rows, keymap),
+            'ifilt':     lambda: sum(1 for _ in ifilt(rows, keymap)),
+        }
+        if label != 'operators': cases['copying filt'] = lambda: copying_filt(rows, keymap)
+        for name, fn in cases.items():
+            elapsed = best(fn, args.repeat)
+            print(f'{label:<14} {name:<16} {len(rows) / elapsed:>12,.0f}')
+
+    wanted = [{'domain.name': row['domain']['name'], 'type': row['type'], 'content': row['content']}
+              for row in rows[::max(1, len(rows) // args.lookups)][:args.lookups]]
+    print()
+    print(f'{"lookups":>8} {"collection":<12} {"elapsed":>9}')
+    for name, collection in (('list', rows), ('IndexedList', None)):
+        def lookups():
+            items = collection if collection is not None else IndexedList(rows)
+            for keymap in wanted: assert filt_one_or_none(items, keymap)
+        elapsed = best(lookups, 1 if collection is not None else args.repeat)
+        print(f'{len(wanted):>8} {name:<12} {elapsed:>8.3f}s')
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
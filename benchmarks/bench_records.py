@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Measure the memory held by a large osusers collection with the server embedded into every row,
+as decoded from JSON (plain dicts) and as compact records (opalstack.records), and the time
+taken to convert and to filter it.
+"""
+
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+from opalstack.records import compact
+from opalstack.util import filt
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compact records memory benchmark')
+    parser.add_argument('-n', '--rows', type=int, nargs='+', default=[10000, 100000], help='rows in the collection')
+    parser.add_argument('-s', '--servers', type=int, default=8, help='distinct servers embedded into the rows')
+    return parser.parse_args(sys.argv[1:])
+
+def make_body(count, nservers):
+    servers = [{'id': f'server-{i:08d}', 'hostname': f'opal{i}.opalstack.com', 'type': 'web', 'ready': True} for i in range(nservers)]
+    return json.dumps([{
+        'id': f'osuser-{i:08d}',
+        'name': f'user{i}',
+        'state': 'READY',
+        'ready': True,
+        'default_shell': '/bin/bash',
+        'server': servers[i % nservers],
+    } for i in range(count)]).encode()
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, held, peak, elapsed
+
+def main(args):
+    print(f'{"rows":>8} {"representation":<15} {"held":>10} {"peak":>10} {"build":>8} {"filter":>8}')
+    for count in args.rows:
+        body = make_body(count, args.servers)
+        cases = {
+            'dicts':   lambda: json.loads(body),
+            'records': lambda: compact(json.loads(body), 'osuser'),
+        }
+        for name, fn in cases.items():
+            items, held, peak, elapsed = measure(fn)
+            started = time.perf_counter()
+            filt(items, {'server.hostname': 'opal1.opalstack.com', 'state': 'READY'})
+            filtered = time.perf_counter() - started
+            print(f'{count:>8} {name:<15} {held / 2**20:>8.1f}MB {peak / 2**20:>8.1f}MB {elapsed:>7.2f}s {filtered:>7.3f}s')
+            del items
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
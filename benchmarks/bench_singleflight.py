@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Release many callers at once, as at the start of a parallel provisioning job, each asking for
+servers.list_all() and ips.list_all(embed=['server']), and count the GETs that reach a local
+stand-in server with and without single-flight coalescing of identical in-flight GETs.
+"""
+
+import sys
+import time
+import argparse
+import threading
+
+import opalstack
+from standin import StandinServer, make_items
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Single-flight coalescing benchmark')
+    parser.add_argument('-c', '--callers', type=int, nargs='+', default=[32, 64, 128], help='concurrent callers')
+    parser.add_argument('-l', '--latency', type=float, default=0.05, help='stand-in server latency, in seconds')
+    return parser.parse_args(sys.argv[1:])
+
+def burst(opalapi, ncallers):
+    barrier = threading.Barrier(ncallers)
+    def caller():
+        barrier.wait()
+        opalapi.servers.list_all()
+        opalapi.ips.list_all(embed=['server'])
+    threads = [threading.Thread(target=caller) for _ in range(ncallers)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+def main(args):
+    servers = [dict(server, hostname=f'opal{i}.opalstack.com') for i, server in enumerate(make_items('server', 3))]
+    ips = [dict(ip, server=servers[i % 3]['id'], primary=i < 3) for i, ip in enumerate(make_items('ip', 20))]
+    items = {'server': servers, 'ip': ips}
+    with StandinServer(items, latency=args.latency) as server:
+        print(f'{"callers":>8} {"coalesce":>9} {"GETs":>6} {"elapsed":>9}')
+        for ncallers in args.callers:
+            for coalesce in (False, True):
+                opalapi = opalstack.Api('benchmark', url=server.url, transport=opalstack.make_session(pool_maxsize=ncallers), coalesce=coalesce)
+                server.reset_counts()
+                started = time.perf_counter()
+                burst(opalapi, ncallers)
+                elapsed = time.perf_counter() - started
+                print(f'{ncallers:>8} {str(coalesce):>9} {server.request_count:>6} {elapsed:>8.3f}s')
+                opalapi.close()
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
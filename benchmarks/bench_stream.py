@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Count the rows of a large dnsrecords collection served by a local stand-in server,
+with list_all() (whole body decoded at once) and with iter_all() (decoded incrementally
+from the response stream), and report the peak RSS of a fresh client process for each.
+"""
+
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+
+import opalstack
+from standin import StandinServer, make_items
+
+MODES = ['baseline', 'list_all', 'iter_all', 'iter_all compact']
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Streaming list decoding benchmark')
+    parser.add_argument('-n', '--rows', type=int, nargs='+', default=[20000, 100000], help='rows in the collection')
+    parser.add_argument('--client', nargs=2, metavar=('MODE', 'URL'), help=argparse.SUPPRESS)
+    return parser.parse_args(sys.argv[1:])
+
+def peak_rss():
+    # ru_maxrss survives exec(), so it would include the forking parent's; VmHWM does not
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def client(mode, url):
+    opalapi = opalstack.Api('benchmark', url=url)
+    started = time.perf_counter()
+    if mode == 'baseline': count = 0
+    elif mode == 'list_all': count = len(opalapi.dnsrecords.list_all())
+    elif mode == 'iter_all': count = sum(1 for _ in opalapi.dnsrecords.iter_all())
+    else: count = sum(1 for _ in opalapi.dnsrecords.iter_all(compact=True))
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'count': count, 'elapsed': elapsed, 'maxrss': peak_rss()}))
+    opalapi.close()
+
+def main(args):
+    print(f'{"rows":>8} {"mode":<17} {"peak RSS":>10} {"elapsed":>9}')
+    for count in args.rows:
+        items = {'dnsrecord': make_items('dnsrecord', count, domain='domain-00000001', type='A', content='10.0.0.1', ttl=3600)}
+        with StandinServer(items) as server:
+            for mode in MODES:
+                out = subprocess.run([sys.executable, __file__, '--client', mode, server.url], check=True, stdout=subprocess.PIPE).stdout
+                result = json.loads(out)
+                print(f'{count:>8} {mode:<17} {result["maxrss"] / 2**20:>8.1f}MB {result["elapsed"]:>8.2f}s')
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.client: client(*args.client)
+    else: main(args)
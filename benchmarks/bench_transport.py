@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Compare per-call connections (module-level requests.get, as Api.request used to do)
+with the pooled keep-alive session owned by Api, against a local stand-in server.
+
+Every new connection costs a TCP handshake (plus a TLS handshake against the real API),
+so the number of connections the server accepted is the figure to watch.
+"""
+
+import sys
+import time
+import argparse
+import threading
+import requests
+
+import opalstack
+from standin import StandinServer, make_items
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Pooled transport benchmark')
+    parser.add_argument('-n', '--requests', type=int, default=500, help='GET requests per run')
+    parser.add_argument('-t', '--threads', type=int, default=8, help='client threads for the concurrent run')
+    return parser.parse_args(sys.argv[1:])
+
+def run_threads(nthreads, nrequests, fn):
+    per_thread = nrequests // nthreads
+    threads = [threading.Thread(target=lambda: [fn() for _ in range(per_thread)]) for _ in range(nthreads)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+def measure(server, label, fn):
+    server.reset_counts()
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f'{label:<34} {server.request_count:>7} reqs {server.connection_count:>6} conns {elapsed:>8.3f}s')
+
+def main(args):
+    with StandinServer({'server': make_items('server', 3)}) as server:
+        url = server.url + '/server/list/'
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Token benchmark'}
+
+        def unpooled():
+            requests.get(url, headers=headers).json()
+
+        # coalesce=False: concurrent identical GETs must each reach the wire here
+        opalapi = opalstack.Api('benchmark', url=server.url, transport=opalstack.make_session(pool_maxsize=args.threads), coalesce=False)
+
+        def pooled():
+            opalapi.http_get_result('/server/list/')
+
+        measure(server, 'unpooled, sequential', lambda: [unpooled() for _ in range(args.requests)])
+        measure(server, 'pooled, sequential', lambda: [pooled() for _ in range(args.requests)])
+        measure(server, f'unpooled, {args.threads} threads', lambda: run_threads(args.threads, args.requests, unpooled))
+        measure(server, f'pooled, {args.threads} threads', lambda: run_threads(args.threads, args.requests, pooled))
+        opalapi.close()
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
@@ -0,0 +1,93 @@
+"""
+A local stand-in for the Opalstack API, used by the benchmarks.
+
+It serves an opalstack.fake.FakeServer over HTTP/1.1 with keep-alive and counts
+both the requests it serves and the TCP connections it accepts, so client-side
+connection reuse can be measured without touching my.opalstack.com.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from opalstack.fake import API_PREFIX, FakeServer, Reset
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, headers, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items(): self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_any(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        with self.server.lock:
+            self.server.request_count += 1
+        try:
+            status, headers, obj = self.server.fake.handle(method, self.path, body, headers=self.headers)
+        except Reset:
+            self.close_connection = True
+            return
+        self.respond(status, headers, obj)
+
+    def do_GET(self):
+        self.handle_any('GET')
+
+    def do_POST(self):
+        self.handle_any('POST')
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, items=None, latency=0.0, ready_delay=0.0, **kwargs):
+        """
+        Serve `items` (a dict of model_name -> list of dicts) on an ephemeral local port.
+        Created or updated items become ready, and deleted items disappear, `ready_delay` seconds later.
+        Other arguments are passed on to FakeServer, which is available as `fake`.
+        """
+        super().__init__(('127.0.0.1', 0), StandinHandler)
+        self.fake = FakeServer(items or {}, latency=latency, ready_delay=ready_delay, **kwargs)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}{API_PREFIX}'
+
+    def get_request(self):
+        conn = super().get_request()
+        with self.lock:
+            self.connection_count += 1
+        return conn
+
+    def reset_counts(self):
+        with self.lock:
+            self.request_count = 0
+            self.connection_count = 0
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+def make_items(model_name, count, **fields):
+    return [
+        dict({'id': f'{model_name}-{i:08d}', 'name': f'{model_name}{i}', 'ready': True}, **fields)
+        for i in range(count)
+    ]
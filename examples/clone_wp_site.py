@@ -52,6 +52,7 @@ log = logging.getLogger(__name__)
 
 def get_args():
     parser = argparse.ArgumentParser(description='Wordpress Site Cloner')
+    parser.add_argument('--trace', metavar='FILE', help='write a Chrome trace of the API calls, waits and ssh commands to FILE')
     return parser.parse_args(sys.argv[1:])
 
 def main(args):
@@ -73,12 +74,10 @@ def main(args):
 
     # Retrieve web_server and primary IP entries for later use
     log.info(f'Retrieving webserver information for {DST_WEB_SERVER_HOSTNAME}')
-    web_server = filt_one(
-        opalapi.servers.list_all()['web_servers'], {'hostname': DST_WEB_SERVER_HOSTNAME},
-    )
-    webserver_primary_ip = filt_one(
-        opalapi.ips.list_all(embed=['server']), {'server.hostname': web_server['hostname'], 'primary': True},
-    )
+    web_server = opalapi.servers.by_hostname(DST_WEB_SERVER_HOSTNAME)
+    assert web_server
+    webserver_primary_ip = opalapi.ips.primary_for(web_server['id'])
+    assert webserver_primary_ip
 
     # Retrieve existing app information for later use
     log.info(f'Retrieving app information for {SRC_APP_NAME}')
@@ -180,4 +179,8 @@ def main(args):
 
 if __name__ == '__main__':
     args = get_args()
-    main(args)
+    if args.trace:
+        with opalstack.tracing.exporting(args.trace, format='chrome'), opalstack.tracing.span('clone_wp_site'):
+            main(args)
+    else:
+        main(args)
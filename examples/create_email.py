@@ -7,7 +7,7 @@ import argparse
 import opalstack
 opalapi = opalstack.Api(token='0000000000000000000000000000000000000000')
 
-from opalstack.util import filt_one, filt_one_or_none
+from opalstack.util import filt_one_or_none
 
 MAILUSER_PREFIX = 'myservice'  # All created mailusers will be prefixed by this string
                                # (typically your user, service, or website name)
@@ -85,9 +85,8 @@ def main(args):
     mailuser_name = f'{MAILUSER_PREFIX}_{user_part}'
 
     log.info(f'Retrieving imap server information for {IMAP_SERVER_HOSTNAME}')
-    imap_server = filt_one(
-        opalapi.servers.list_all()['imap_servers'], {'hostname': IMAP_SERVER_HOSTNAME},
-    )
+    imap_server = opalapi.servers.by_hostname(IMAP_SERVER_HOSTNAME, kind='imap')
+    assert imap_server
 
     # Create the address if it doesn't exist.
     # If it does exist, then ensure it delivers mail to our required mailuser.
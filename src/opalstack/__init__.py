@@ -1,4 +1,13 @@
 VERSION = '1.0.3'
 __version__ = VERSION
 
-from .api import Api
+from .api import Api, make_session
+from .asyncapi import AsyncApi
+from .pending import PendingResult, PendingItem
+from .apply import Ref, ApplyError
+from .errors import ApiError
+from .bulk import BulkResult
+from .retry import RetryPolicy
+from .ratelimit import RateLimiter
+from .cache import Cache, DiskStore
+from .metrics import Metrics
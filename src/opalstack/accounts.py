@@ -21,3 +21,12 @@ class AccountsManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return False
+
+    def equals_key(self, item):
+        return ( item['id'], )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return None
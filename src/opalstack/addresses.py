@@ -1,4 +1,5 @@
 from .manager import ApiModelManager
+from .util import frozen
 
 class AddressesManager(ApiModelManager):
     def __init__(self, api):
@@ -6,6 +7,8 @@ class AddressesManager(ApiModelManager):
         self.model_name_plural = 'addresses'
         self.is_instantaneous  = False
         self.primary_key       = 'id'
+        self.mutable_fields    = ('destinations', 'forwards')
+        self.relations         = {'destinations': 'mailusers'}
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -27,3 +30,17 @@ class AddressesManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return self.check_equals(new, existing)
+
+    def equals_key(self, item):
+        return ( item['source'],
+                 frozen(item['destinations']),
+                 frozen(item['forwards']) )
+
+    def obstructs_key(self, item):
+        return ( item['source'], )
+
+    def satisfies_key(self, item):
+        return self.equals_key(item)
+
+    def update_key(self, item):
+        return ( item['source'], )
@@ -1,11 +1,25 @@
 import os
 import logging
 import time
-import json
 import requests
+import requests.adapters
 import socket
+import threading
+import concurrent.futures
 
 from .util import filt_one_or_none
+from .errors import ApiError
+from .codec import get_codec
+from .metrics import Metrics, endpoint
+from . import tracing
+from .stream import iter_array
+from .retry import RetryPolicy
+from .cache import cache_scope
+from .singleflight import SingleFlight
+from .reference import ReferenceData
+from .backoff import Backoff, ReadinessStats
+from .pending import ReadinessMultiplexer
+from .apply import apply
 
 from .accounts import AccountsManager
 from .tokens import TokensManager
@@ -32,13 +46,68 @@ API_URL = 'https://my.opalstack.com/api/v1'
 
 log = logging.getLogger(__name__)
 
+def make_session(pool_connections=4, pool_maxsize=16, pool_block=False):
+    """
+    Return a requests.Session keeping connections alive for reuse, the default transport of Api.
+        pool_connections : number of per-host connection pools to keep
+        pool_maxsize     : maximum number of connections kept alive per host
+        pool_block       : if True, block when all connections to a host are in use
+                           instead of opening (and then discarding) extra ones
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 class Api():
-    def __init__(self, token):
+    def __init__(self, token, url=API_URL, transport=None, poll_list_threshold=20, poll_workers=8,
+                 wait_timeout=None, readiness=None, retry=None, rate_limiter=None, cache=None,
+                 coalesce=True, reference_ttl=0, codec=None, metrics=None):
+        """
+        All managers share one transport, by default make_session(); any object with
+        get(url, headers=None, stream=False), post(url, data=None, headers=None) and close()
+        returning requests-like responses will do (see opalstack.fake.FakeTransport).
+            poll_list_threshold : readiness of batches this large is checked with one list/ call per round
+            poll_workers        : smaller batches are checked with this many concurrent read/ calls
+            wait_timeout        : default time limit of each wait, in seconds; None waits forever
+            readiness           : a ReadinessStats pacing the waits
+            retry               : a RetryPolicy for 429s, 5xx and connection errors
+            rate_limiter        : a RateLimiter; None for no limit
+            cache               : a Cache for list_all() and read(); None for no caching
+            coalesce            : if True, concurrent identical GETs share one request
+            reference_ttl       : seconds servers and ips are kept (see ReferenceData); 0 (the default) to always refetch
+            codec               : 'json', 'orjson' or a codec object; None picks orjson when installed
+            metrics             : a Metrics registry; by default a new one
+        readiness, rate_limiter, cache and metrics may be shared between Api objects.
+        """
         self.token = token
+        self.url = url.rstrip('/')
         self.api_headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Token {self.token}',
         }
+        self.session = transport if transport is not None else make_session()
+        self.poll_list_threshold = poll_list_threshold
+        self.poll_workers = poll_workers
+        self.poll_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, poll_workers))
+        self.wait_timeout = wait_timeout
+        self.readiness = readiness or ReadinessStats()
+        self.multiplexer = ReadinessMultiplexer(self)
+        self.retry = retry or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.cache_scope = cache_scope(self.url, self.token)
+        self.singleflight = SingleFlight() if coalesce else None
+        self.generations = {}
+        self.generations_lock = threading.Lock()
+        self.reference = ReferenceData(self, ttl=reference_ttl)
+        self.codec = get_codec(codec)
+        self.metrics = metrics if metrics is not None else Metrics()
         self.accounts = AccountsManager(self)
         self.tokens = TokensManager(self)
         self.notices = NoticesManager(self)
@@ -62,87 +131,276 @@ class Api():
         ## Not live yet ##
         # self.quarantinedmails = QuarantinedmailsManager(self)
 
-    def request(self, urlpath, method, dataObj, ensure_status=[200]):
+    def close(self):
+        """
+        Stop background readiness polling and close all pooled connections.
+        """
+        self.multiplexer.stop()
+        self.poll_executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, urlpath, method, dataObj, ensure_status=[200], idempotent=None):
+        """
+        Perform one API call, retrying transient failures according to self.retry.
+        GETs are idempotent; pass idempotent=True for POSTs which are safe to repeat.
+        """
         if method not in ('GET', 'POST'): raise ValueError(f'Invalid request method {method}')
+        if idempotent is None: idempotent = method == 'GET'
+        # Debug output is only formatted when it will be emitted; for large bodies that formatting
+        # costs more than the request itself
+        debug = log.isEnabledFor(logging.DEBUG)
+        body = None
         if method == 'GET':
             if dataObj is not None: raise ValueError(f'GET request method must not have dataObj')
-            log.debug(f'Performing GET {urlpath}')
-            resp = requests.get(API_URL + urlpath, headers=self.api_headers)
+            if debug: log.debug(f'Performing GET {urlpath}')
         if method == 'POST':
             if type(dataObj) is None: raise ValueError(f'POST request method must have dataObj')
-            log.debug(f'Performing POST {urlpath} with {repr(dataObj)}')
-            resp = requests.post(API_URL + urlpath, headers=self.api_headers, json=dataObj)
-        log.debug(resp.content.decode())
+            if debug: log.debug(f'Performing POST {urlpath} with {repr(dataObj)}')
+            body = self.codec.dumps(dataObj)
+        model, action = endpoint(urlpath)
+        span = tracing.start_span(f'{method} /{model}/{action}/', method=method, model=model, action=action, request_bytes=len(body or b''))
+        started = time.perf_counter()
+        attempts = 0
+        def attempt():
+            nonlocal attempts
+            attempts += 1
+            return self.send(urlpath, method, body)
         try:
-            result = json.loads(resp.content.decode())
-        except json.decoder.JSONDecodeError:
+            resp = self.retry.call(attempt, idempotent=idempotent, describe=f'{method} {urlpath}')
+        except Exception as e:
+            self.metrics.request(method, urlpath, 'error', time.perf_counter() - started, attempts, len(body or b''))
+            span.set(attempts=attempts)
+            span.end(error=e)
+            raise
+        self.metrics.request(method, urlpath, resp.status_code, time.perf_counter() - started, attempts, len(body or b''), len(resp.content))
+        if debug: log.debug(resp.content.decode(errors='replace'))
+        try:
+            result = self.codec.loads(resp.content)
+        except ValueError:
             result = None
-        log.debug(f'Got resp: {repr(resp)} and result {repr(result)}')
+        span.set(status=resp.status_code, attempts=attempts, response_bytes=len(resp.content))
+        span.end()
+        if debug: log.debug(f'Got resp: {repr(resp)} and result {repr(result)}')
         if ensure_status and resp.status_code not in ensure_status:
             if resp.status_code in [200, 400]:
-                raise RuntimeError(f'Unexpected status_code: {resp.status_code}, result: {result}')
+                raise ApiError(f'Unexpected status_code: {resp.status_code}, result: {result}', resp.status_code, result)
             else:
-                raise RuntimeError(f'Unexpected status_code: {resp.status_code}')
+                raise ApiError(f'Unexpected status_code: {resp.status_code}', resp.status_code, result)
         return resp, result
 
-    def request_result(self, urlpath, method, dataObj, ensure_status=[200]):
-        resp, result = self.request(urlpath, method, dataObj, ensure_status=ensure_status)
+    def send(self, urlpath, method, body, stream=False):
+        """
+        Make one attempt at an API call, pacing it through the rate limiter.
+        `body` is the encoded body of a POST (see self.codec).
+        With stream=True, the body of a GET is left to be read from the response.
+        """
+        if self.rate_limiter: self.rate_limiter.acquire(method)
+        if method == 'GET':
+            resp = self.session.get(self.url + urlpath, headers=self.api_headers, stream=stream)
+        else:
+            resp = self.session.post(self.url + urlpath, data=body, headers=self.api_headers)
+        if resp.status_code == 429 and self.rate_limiter:
+            retry_after = self.retry.retry_after(resp)
+            self.rate_limiter.hold(method, 1.0 if retry_after is None else retry_after)
+        return resp
+
+    def request_result(self, urlpath, method, dataObj, ensure_status=[200], idempotent=None):
+        resp, result = self.request(urlpath, method, dataObj, ensure_status=ensure_status, idempotent=idempotent)
         return result
 
     def http_get_result(self, urlpath, ensure_status=[200]):
-        return self.request_result(urlpath, 'GET', None, ensure_status=ensure_status)
+        """
+        GET `urlpath` and return the decoded result.
+        While an identical GET is already in flight from another thread, wait for it and share its result,
+        unless the model was written since that GET started (see written()).
+        """
+        fetch = lambda: self.request_result(urlpath, 'GET', None, ensure_status=ensure_status)
+        if self.singleflight is None: return fetch()
+        generation = self.generations.get(endpoint(urlpath)[0], 0)
+        return self.singleflight.do((urlpath, tuple(ensure_status or ()), generation), fetch)
+
+    def written(self, model_name):
+        """
+        Note a write to `model_name`, so that GETs of it made from now on never share
+        the result of one started before, which may predate the write.
+        """
+        with self.generations_lock:
+            self.generations[model_name] = self.generations.get(model_name, 0) + 1
+
+    def http_post_result(self, urlpath, dataObj, ensure_status=[200], idempotent=None):
+        return self.request_result(urlpath, 'POST', dataObj, ensure_status=ensure_status, idempotent=idempotent)
 
-    def http_post_result(self, urlpath, dataObj, ensure_status=[200]):
-        return self.request_result(urlpath, 'POST', dataObj, ensure_status=ensure_status)
+    def http_get_iter(self, urlpath, ensure_status=[200], chunk_size=1 << 16):
+        """
+        GET `urlpath`, whose result is a JSON array, and yield its elements as they are decoded
+        from the response stream, so the whole body is never held in memory.
+        Failures before the body starts are retried like any GET; an error status raises ApiError.
+        """
+        log.debug(f'Performing streamed GET {urlpath}')
+        model, action = endpoint(urlpath)
+        span = tracing.start_span(f'GET /{model}/{action}/', method='GET', model=model, action=action, stream=True)
+        started = time.perf_counter()
+        attempts = 0
+        def attempt():
+            nonlocal attempts
+            attempts += 1
+            return self.send(urlpath, 'GET', None, stream=True)
+        try:
+            resp = self.retry.call(attempt, idempotent=True, describe=f'GET {urlpath}')
+        except Exception as e:
+            self.metrics.request('GET', urlpath, 'error', time.perf_counter() - started, attempts)
+            span.set(attempts=attempts)
+            span.end(error=e)
+            raise
+        received = 0
+        def chunks():
+            nonlocal received
+            for chunk in resp.iter_content(chunk_size):
+                received += len(chunk)
+                yield chunk
+        error = None
+        try:
+            if ensure_status and resp.status_code not in ensure_status:
+                try:
+                    result = self.codec.loads(resp.content)
+                except ValueError:
+                    result = None
+                received = len(resp.content)
+                raise ApiError(f'Unexpected status_code: {resp.status_code}', resp.status_code, result)
+            yield from iter_array(chunks())
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            resp.close()
+            # Timed until the stream was read to the end (or abandoned), as that is when the transfer finished
+            self.metrics.request('GET', urlpath, resp.status_code, time.perf_counter() - started, attempts, received=received)
+            span.set(status=resp.status_code, attempts=attempts, response_bytes=received)
+            span.end(error=error)
 
     #
     # -- Wait methods --
     #
 
-    def wait_ready(self, model_name, uuids, delay=5.0, tries=0):
+    def pending_ready(self, model_name, uuids):
+        """
+        Check all given `uuids` once and return those which are not ready yet.
+        See poll_by_list() for how the batch is checked.
+        """
+        if self.poll_by_list(uuids):
+            ready = {item['id'] for item in self.http_get_result(f'/{model_name}/list/', ensure_status=[200]) if item['ready']}
+            return [uuid for uuid in uuids if uuid not in ready]
+        results = self.poll_map(lambda uuid: self.http_get_result(f'/{model_name}/read/{uuid}', ensure_status=[200]), uuids)
+        for result in results: assert type(result['ready']) == bool
+        return [uuid for uuid, result in zip(uuids, results) if not result['ready']]
+
+    def pending_deleted(self, model_name, uuids):
+        """
+        Check all given `uuids` once and return those which still exist.
+        See poll_by_list() for how the batch is checked.
+        """
+        if self.poll_by_list(uuids):
+            existing = {item['id'] for item in self.http_get_result(f'/{model_name}/list/', ensure_status=[200])}
+            return [uuid for uuid in uuids if uuid in existing]
+        responses = self.poll_map(lambda uuid: self.request(f'/{model_name}/read/{uuid}', 'GET', None, ensure_status=[200, 404]), uuids)
+        return [uuid for uuid, (resp, result) in zip(uuids, responses) if resp.status_code != 404]
+
+    def poll_by_list(self, uuids):
+        """
+        Batches of at least `poll_list_threshold` uuids are checked with one list/ call per round,
+        so polling cost stays flat as the batch grows. Smaller batches use concurrent read/ calls,
+        which are cheaper than downloading the whole collection.
+        """
+        return len(uuids) >= self.poll_list_threshold
+
+    def poll_map(self, fn, uuids):
+        """
+        Apply `fn` to every uuid using up to `poll_workers` concurrent requests, preserving order.
+        """
+        if len(uuids) < 2 or self.poll_workers < 2: return [fn(uuid) for uuid in uuids]
+        return list(self.poll_executor.map(tracing.wrap(fn), uuids))
+
+    def wait_backoff(self, profile, delay=None, tries=0, timeout=None):
         """
-        Block until all given `uuids` are ready, pausing `delay` before each check.
-        If `tries` > 0, raise a RuntimeError after that many attempts.
+        Return the Backoff pacing a wait for `profile`.
+        """
+        if timeout is None: timeout = self.wait_timeout
+        if delay is not None: return Backoff.fixed(delay, timeout=timeout, tries=tries)
+        backoff = self.readiness.backoff(profile, timeout=timeout)
+        backoff.tries = tries
+        return backoff
+
+    def wait_ready(self, model_name, uuids, delay=None, tries=0, timeout=None, profile=None):
+        """
+        Block until all given `uuids` are ready.
+        The first check is immediate. Later checks back off exponentially, starting from
+        what was learned about how long `profile` (by default, `model_name`) takes to be ready.
+        Passing `delay` instead pauses that long before every check.
+        Raise a RuntimeError after `timeout` seconds or, if `tries` > 0, after that many attempts.
         """
         if not uuids: return
+        profile = profile or model_name
         pending_uuids = list(uuids)
-        i = 0
-        while True:
-            time.sleep(delay)
-            i += 1
-            log.debug(f'Checking ready ({i}/{tries}) for {model_name} uuids: {repr(pending_uuids)}')
-            for uuid in pending_uuids:
-                result = self.http_get_result(f'/{model_name}/read/{uuid}', ensure_status=[200])
-                assert type(result['ready']) == bool
-                if result['ready']:
-                    pending_uuids.remove(uuid)
-            if not pending_uuids:
-                log.debug('Done waiting for ready')
-                return
-            if i == tries: break
-        raise RuntimeError(f'{model_name} {repr(pending_uuids)} never became ready')
-
-    def wait_deleted(self, model_name, uuids, delay=5.0, tries=0):
-        """
-        Block until all given `uuids` are deleted, pausing `delay` before each check.
-        If `tries` > 0, raise a RuntimeError after that many attempts.
+        started = time.monotonic()
+        with tracing.span(f'{model_name}.wait_ready', model=model_name, items=len(pending_uuids), profile=profile) as span:
+            for i, pause in enumerate(self.wait_backoff(profile, delay, tries, timeout).delays(), 1):
+                time.sleep(pause)
+                log.debug(f'Checking ready ({i}/{tries}) for {model_name} uuids: {repr(pending_uuids)}')
+                self.metrics.count('wait_rounds', model=model_name, state='ready')
+                with tracing.span('wait_round', model=model_name, state='ready', round=i, pending=len(pending_uuids)) as round_span:
+                    pending_uuids = self.pending_ready(model_name, pending_uuids)
+                    round_span.set(remaining=len(pending_uuids))
+                if not pending_uuids:
+                    self.readiness.record(profile, time.monotonic() - started)
+                    self.metrics.observe('wait_seconds', time.monotonic() - started, model=model_name, state='ready')
+                    span.set(rounds=i)
+                    log.debug('Done waiting for ready')
+                    return
+            self.metrics.count('wait_failures', model=model_name, state='ready')
+            raise RuntimeError(f'{model_name} {repr(pending_uuids)} never became ready')
+
+    def wait_deleted(self, model_name, uuids, delay=None, tries=0, timeout=None, profile=None):
+        """
+        Block until all given `uuids` are deleted.
+        Paced like wait_ready(), learning under the `profile` '<model_name>:deleted' by default.
         """
         if not uuids: return
+        profile = profile or f'{model_name}:deleted'
         pending_uuids = list(uuids)
-        i = 0
-        while True:
-            time.sleep(delay)
-            i += 1
-            log.debug(f'Checking deleted ({i}/{tries}) for {model_name} uuids: {repr(pending_uuids)}')
-            for uuid in pending_uuids:
-                resp, result = self.request(f'/{model_name}/read/{uuid}', 'GET', None, ensure_status=[200, 404])
-                if resp.status_code == 404:
-                    pending_uuids.remove(uuid)
-            if not pending_uuids:
-                log.debug('Done waiting for deletion')
-                return
-            if i == tries: break
-        raise RuntimeError(f'{model_name} {repr(pending_uuids)} never became deleted')
+        started = time.monotonic()
+        with tracing.span(f'{model_name}.wait_deleted', model=model_name, items=len(pending_uuids), profile=profile) as span:
+            for i, pause in enumerate(self.wait_backoff(profile, delay, tries, timeout).delays(), 1):
+                time.sleep(pause)
+                log.debug(f'Checking deleted ({i}/{tries}) for {model_name} uuids: {repr(pending_uuids)}')
+                self.metrics.count('wait_rounds', model=model_name, state='deleted')
+                with tracing.span('wait_round', model=model_name, state='deleted', round=i, pending=len(pending_uuids)) as round_span:
+                    pending_uuids = self.pending_deleted(model_name, pending_uuids)
+                    round_span.set(remaining=len(pending_uuids))
+                if not pending_uuids:
+                    self.readiness.record(profile, time.monotonic() - started)
+                    self.metrics.observe('wait_seconds', time.monotonic() - started, model=model_name, state='deleted')
+                    span.set(rounds=i)
+                    log.debug('Done waiting for deletion')
+                    return
+            self.metrics.count('wait_failures', model=model_name, state='deleted')
+            raise RuntimeError(f'{model_name} {repr(pending_uuids)} never became deleted')
+
+    #
+    # -- Multi-model apply --
+    #
+
+    def apply(self, desired, reuse=True):
+        """
+        Create items of several managers in dependency order, concurrently where possible.
+        See opalstack.apply.apply()
+        """
+        return apply(self, desired, reuse=reuse)
 
     #
     # -- Convenience methods --
@@ -153,6 +411,7 @@ class Api():
         Get the current server from which this is being executed.
         Returns None if not being run from an Opalstack webserver.
         """
+        if not embed and self.reference.ttl: return self.servers.by_hostname(socket.gethostname())
         return filt_one_or_none(self.servers.list_all(embed)['web_servers'], {
             'hostname': socket.gethostname(),
         })
@@ -164,10 +423,10 @@ class Api():
         """
         server = self.get_current_server()
         if not server: return None
-        return filt_one_or_none(
-            self.ips.list_all(embed=list(set(embed) | {'server'})),
-            {'server.hostname': server['hostname'], 'primary': True},
-        )
+        if set(embed) <= {'server'} and self.reference.ttl:
+            ip = self.ips.primary_for(server['id'])
+            return None if ip is None else dict(ip, server=server)
+        return self.ips.query_one_or_none({'server.hostname': server['hostname'], 'primary': True}, embed=embed)
 
     def get_current_osuser(self, embed=['server']):
         """
@@ -175,14 +434,16 @@ class Api():
         Returns None if not being run from an Opalstack webserver.
         """
         if 'server' in embed:
-            return filt_one_or_none(self.osusers.list_all(embed=embed), {
+            # The server is joined on the client, from the reference data, rather than embedded by the API
+            embed = [field for field in embed if field != 'server']
+            return filt_one_or_none(self.osusers.list_all(embed=embed, resolve=['server']), {
                 'name': os.environ.get('USER'),
                 'server.hostname': socket.gethostname(),
             })
         else:
-            server = self.get_current_web_server(embed)
+            server = self.get_current_server()
             if not server: return None
             return filt_one_or_none(self.osusers.list_all(embed=embed), {
                 'name': os.environ.get('USER'),
-                'server': self.get_current_web_server(embed)['id'],
+                'server': server['id'],
             })
@@ -0,0 +1,216 @@
+import logging
+import concurrent.futures
+
+from .manager import ApiModelManager
+
+log = logging.getLogger(__name__)
+
+class Ref():
+    def __init__(self, name, field='id'):
+        """
+        Stands for `field` of the item named `name` in the same apply() call.
+        It is replaced by the actual value once that item exists and is ready,
+        so the item containing the Ref is only created after it.
+        """
+        self.name = name
+        self.field = field
+
+    def __repr__(self):
+        return f'Ref({self.name!r}, {self.field!r})'
+
+class ApplyError(RuntimeError):
+    def __init__(self, message, applied, failed):
+        """
+        Raised by apply() once every branch has settled, if any item failed.
+            applied : {name: item} for every item which was applied anyway
+            failed  : {name: exception} for every item which failed or was skipped
+        """
+        super().__init__(message)
+        self.applied = applied
+        self.failed = failed
+
+def find_refs(value):
+    if isinstance(value, Ref): return [value]
+    if isinstance(value, dict): return [ref for v in value.values() for ref in find_refs(v)]
+    if isinstance(value, (list, tuple)): return [ref for v in value for ref in find_refs(v)]
+    return []
+
+def resolve_refs(value, applied):
+    if isinstance(value, Ref): return applied[value.name][value.field]
+    if isinstance(value, dict): return {k: resolve_refs(v, applied) for k, v in value.items()}
+    if isinstance(value, (list, tuple)): return type(value)(resolve_refs(v, applied) for v in value)
+    return value
+
+class Node():
+    def __init__(self, name, manager, item):
+        self.name = name
+        self.manager = manager
+        self.item = item
+        self.deps = list(dict.fromkeys(ref.name for ref in find_refs(item)))
+        self.dependents = []
+        self.waiting = len(self.deps)
+
+def build_graph(api, desired):
+    nodes = {}
+    for manager_name, items in desired.items():
+        manager = getattr(api, manager_name, None)
+        if not isinstance(manager, ApiModelManager): raise ValueError(f'Unknown manager {manager_name}')
+        for name, item in items.items():
+            if name in nodes: raise ValueError(f'Duplicate name {name}')
+            nodes[name] = Node(name, manager, item)
+    for node in nodes.values():
+        for dep in node.deps:
+            if dep not in nodes: raise ValueError(f'{node.name} refers to unknown item {dep}')
+            nodes[dep].dependents.append(node)
+
+    # Kahn's algorithm: anything left over is on a cycle
+    waiting = {name: node.waiting for name, node in nodes.items()}
+    queue = [node for node in nodes.values() if not node.waiting]
+    for node in queue:
+        for dependent in node.dependents:
+            waiting[dependent.name] -= 1
+            if not waiting[dependent.name]: queue.append(dependent)
+    if len(queue) != len(nodes):
+        raise ValueError(f'Reference cycle between {sorted(name for name, count in waiting.items() if count)}')
+    return nodes
+
+class Existing():
+    def __init__(self, manager, items):
+        """
+        The existing items of one manager, to look desired items up against.
+        Bucketed by the *_key() methods when the manager has them (see has_hash_keys()),
+        and compared pairwise with the check_*() methods otherwise.
+        A desired item missing a field the policy needs (a site not naming its server, say)
+        matches nothing.
+        """
+        self.manager = manager
+        self.items = items
+        self.hashed = manager.has_hash_keys()
+        if self.hashed:
+            self.buckets = {}
+            for policy in ('equals', 'satisfies', 'obstructs'):
+                bucket = self.buckets[policy] = {}
+                for item in items:
+                    key = self.key(policy, item)
+                    if key is not None: bucket.setdefault(key, item)
+
+    def key(self, policy, item):
+        try:
+            return getattr(self.manager, f'{policy}_key')(item)
+        except KeyError:
+            return None
+
+    def check(self, policy, existing, new):
+        try:
+            return getattr(self.manager, f'check_{policy}')(existing, new)
+        except KeyError:
+            return False
+
+    def find(self, policy, item):
+        if self.hashed:
+            key = self.key(policy, item)
+            return None if key is None else self.buckets[policy].get(key)
+        return next((e for e in self.items if self.check(policy, e, item)), None)
+
+    def reusable(self, item):
+        """An existing item equal to `item` or satisfying it, or None"""
+        found = self.find('equals', item)
+        return found if found is not None else self.find('satisfies', item)
+
+    def obstructing(self, item):
+        """An existing item which `item` could not be created alongside, or None"""
+        return self.find('obstructs', item)
+
+def apply(api, desired, reuse=True):
+    """
+    Apply the desired state of several managers at once, in dependency order.
+    `desired` maps manager names to {name: item}. Items may contain Ref(name) anywhere
+    in their values to stand for the id of another item, for example:
+
+        apply(opalapi, {
+            'osusers': {'user': {'name': 'myuser', 'server': web_server['id']}},
+            'domains': {'domain': {'name': 'www.example.com'}},
+            'apps':    {'app': {'name': 'myapp', 'osuser': Ref('user'), 'type': 'APA'}},
+            'sites':   {'site': {'name': 'mysite', 'ip4': ip['id'], 'domains': [Ref('domain')],
+                                 'routes': [{'app': Ref('app'), 'uri': '/'}]}},
+        })
+
+    Each item is created as soon as everything it refers to is ready, so independent
+    branches proceed concurrently. Items of the same manager which become unblocked
+    together are created with one call, and all pending items are polled together
+    by the Api's ReadinessMultiplexer.
+    If `reuse`, an existing item which equals or satisfies a desired one (see check_equals()
+    and check_satisfies()) is used instead of creating it.
+    Returns {name: item} once all items are ready.
+    Raises ValueError for unknown references or cycles, and ApplyError for items obstructed
+    by existing ones (see check_obstructs()), before making any change. Items containing Refs
+    can only be checked once those are resolved: if obstructed then, they fail without being created.
+    If some items fail, the rest still proceed (except for those depending on them),
+    then ApplyError is raised.
+    """
+    nodes = build_graph(api, desired)
+    applied = {}
+    failed = {}
+    inflight = {}
+
+    existing = {}
+    for node in nodes.values():
+        if node.manager not in existing: existing[node.manager] = Existing(node.manager, node.manager.list_all())
+
+    def obstruction(node, item):
+        found = existing[node.manager].obstructing(item)
+        if found is None or (reuse and existing[node.manager].reusable(item) is not None): return None
+        return RuntimeError(f'{node.name} is obstructed by existing {node.manager.model_name} {found.get("id")}')
+
+    def fail(node, exception):
+        if node.name in failed: return
+        failed[node.name] = exception
+        for dependent in node.dependents:
+            fail(dependent, RuntimeError(f'{dependent.name} skipped because {node.name} failed'))
+
+    for node in nodes.values():
+        exception = None if node.deps else obstruction(node, node.item)
+        if exception is not None: fail(node, exception)
+    if failed:
+        raise ApplyError(f'Obstructed by existing items: {sorted(failed)}', applied, failed)
+
+    runnable = [node for node in nodes.values() if not node.waiting]
+    while runnable or inflight:
+        groups = {}
+        for node in runnable: groups.setdefault(node.manager, []).append(node)
+        runnable = []
+        for manager, group in groups.items():
+            log.info(f'Applying {manager.model_name_plural}: {[node.name for node in group]}')
+            try:
+                items = [resolve_refs(node.item, applied) for node in group]
+                blocked = [obstruction(node, item) for node, item in zip(group, items)]
+                for node, exception in zip(group, blocked):
+                    if exception is not None: fail(node, exception)
+                group = [node for node, exception in zip(group, blocked) if exception is None]
+                items = [item for item, exception in zip(items, blocked) if exception is None]
+                if not group: continue
+                found = [existing[manager].reusable(item) if reuse else None for item in items]
+                created = manager.create([item for item, e in zip(items, found) if e is None], wait=False)
+            except Exception as e:
+                for node in group: fail(node, e)
+                continue
+            remaining = iter(created)
+            inflight[created.future] = (group, [e if e is not None else next(remaining) for e in found])
+        if not inflight: continue
+
+        done, _ = concurrent.futures.wait(list(inflight), return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            group, items = inflight.pop(future)
+            exception = concurrent.futures.CancelledError() if future.cancelled() else future.exception()
+            for node, item in zip(group, items):
+                if exception is not None:
+                    fail(node, exception)
+                    continue
+                applied[node.name] = item
+                for dependent in node.dependents:
+                    dependent.waiting -= 1
+                    if not dependent.waiting and dependent.name not in failed: runnable.append(dependent)
+
+    if failed:
+        raise ApplyError(f'Failed to apply {sorted(failed)}', applied, failed)
+    return applied
@@ -6,6 +6,7 @@ class AppsManager(ApiModelManager):
         self.model_name_plural = 'apps'
         self.is_instantaneous  = False
         self.primary_key       = 'id'
+        self.relations         = {'osuser': 'osusers'}
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -17,7 +18,10 @@ class AppsManager(ApiModelManager):
     def delete(self, *args, **kwargs):     return super().delete(*args, **kwargs)
     def delete_one(self, *args, **kwargs): return super().delete_one(*args, **kwargs)
     def mark_installed(self, app_ids):
-        self.api.http_post_result(f'/app/installed/', [{'id': app_id} for app_id in app_ids], ensure_status=[200])
+        try:
+            self.api.http_post_result(f'/app/installed/', [{'id': app_id} for app_id in app_ids], ensure_status=[200])
+        finally:
+            self.invalidate()
 
     def check_equals(self, a, b):
         return ( a['name'] == b['name'] and
@@ -28,3 +32,13 @@ class AppsManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return False
+
+    def equals_key(self, item):
+        return ( item['name'],
+                 item['osuser'] )
+
+    def obstructs_key(self, item):
+        return self.equals_key(item)
+
+    def satisfies_key(self, item):
+        return None
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import functools
+import itertools
+import concurrent.futures
+
+from . import tracing
+from .api import Api, make_session
+from .manager import ApiModelManager
+from .pending import PendingItem
+from .util import filt, one, one_or_none
+
+log = logging.getLogger(__name__)
+
+class AsyncApi():
+    def __init__(self, token, concurrency=16, **kwargs):
+        """
+        Asyncio counterpart of Api.
+        Every manager wired up by Api (apps, sites, osusers, dnsrecords, ...) is mirrored here
+        by an AsyncApiModelManager of the same name, sharing its model definition and check_* policies.
+
+        At most `concurrency` HTTP requests are in flight at once; the rest queue up.
+        Creates, updates and deletes run through the synchronous managers; their readiness is
+        polled by the Api's ReadinessMultiplexer and awaited on the event loop, so any number of
+        pending operations can be awaited at the same time.
+        Remaining keyword arguments are passed on to Api.
+        """
+        if kwargs.get('transport') is None: kwargs['transport'] = make_session(pool_maxsize=concurrency)
+        self.api = Api(token, **kwargs)
+        self.concurrency = concurrency
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        for name, manager in vars(self.api).items():
+            if isinstance(manager, ApiModelManager):
+                setattr(self, name, AsyncApiModelManager(self, manager))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.api.close()
+
+    async def aclose(self):
+        """
+        close() without blocking the event loop while in-flight requests finish.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def call(self, fn, *args, **kwargs):
+        """
+        Run the blocking `fn` on the bounded request pool and await its result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, tracing.wrap(functools.partial(fn, *args, **kwargs)))
+
+    async def request(self, urlpath, method, dataObj, ensure_status=[200], idempotent=None):
+        return await self.call(self.api.request, urlpath, method, dataObj, ensure_status=ensure_status, idempotent=idempotent)
+
+    async def request_result(self, urlpath, method, dataObj, ensure_status=[200], idempotent=None):
+        resp, result = await self.request(urlpath, method, dataObj, ensure_status=ensure_status, idempotent=idempotent)
+        return result
+
+    async def http_get_result(self, urlpath, ensure_status=[200]):
+        # Through Api.http_get_result(), so identical concurrent GETs are coalesced
+        return await self.call(self.api.http_get_result, urlpath, ensure_status=ensure_status)
+
+    async def http_post_result(self, urlpath, dataObj, ensure_status=[200], idempotent=None):
+        return await self.request_result(urlpath, 'POST', dataObj, ensure_status=ensure_status, idempotent=idempotent)
+
+    async def apply(self, desired, reuse=True):
+        """
+        See Api.apply()
+        """
+        return await self.call(self.api.apply, desired, reuse=reuse)
+
+# Methods of the synchronous managers which make no API calls, used as they are;
+# with the check_*, *_key, plan_* and set_* policy methods
+SYNC_METHODS = {'readiness_profile', 'invalidate', 'operation', 'pending', 'has_hash_keys', 'is_local'}
+
+def is_sync_method(name):
+    return ( name in SYNC_METHODS or name.endswith('_key') or
+             name.startswith('check_') or name.startswith('plan_') or name.startswith('set_') )
+
+class AsyncApiModelManager():
+    def __init__(self, aapi, manager):
+        """
+        Awaitable view of the synchronous `manager`.
+        Model properties (model_name, primary_key, is_instantaneous, ...) and
+        the check_* policies are read from `manager`, so overriding a policy
+        on the synchronous manager applies here too.
+        Any other method of `manager` not defined here (e.g. apps.mark_installed(), ips.primary_for())
+        becomes a coroutine function, run on the request pool so it never blocks the event loop.
+        """
+        self.aapi = aapi
+        self.manager = manager
+
+    def __getattr__(self, name):
+        value = getattr(self.manager, name)
+        if not callable(value) or is_sync_method(name): return value
+        @functools.wraps(value)
+        async def method(*args, **kwargs):
+            return await self.aapi.call(value, *args, **kwargs)
+        return method
+
+    async def list_all(self, *args, **kwargs):
+        """
+        See list_all() of the synchronous manager, which may serve it from the cache or,
+        for servers and ips, from the reference tier; run on the request pool.
+        """
+        return await self.aapi.call(self.manager.list_all, *args, **kwargs)
+
+    async def read(self, *args, **kwargs):
+        """
+        See read() of the synchronous manager; run on the request pool.
+        """
+        return await self.aapi.call(self.manager.read, *args, **kwargs)
+
+    async def query(self, keymap, embed=[]):
+        """
+        See ApiModelManager.query()
+        """
+        plan = self.manager.plan_query(keymap, embed)
+        log.debug(f'Querying {self.model_name_plural} for {repr(keymap)} with {repr(plan)}')
+        return filt(await self.list_all(embed=plan.embed, resolve=plan.resolve), keymap)
+
+    async def query_one(self, keymap, embed=[]):
+        return one(await self.query(keymap, embed))
+
+    async def query_one_or_none(self, keymap, embed=[]):
+        return one_or_none(await self.query(keymap, embed))
+
+    async def iter_all(self, embed=[], compact=False, batch_size=256):
+        """
+        Async generator counterpart of ApiModelManager.iter_all().
+        Items are decoded off the event loop, `batch_size` at a time.
+        """
+        items = self.manager.iter_all(embed=embed, compact=compact)
+        try:
+            while True:
+                batch = await self.aapi.call(lambda: list(itertools.islice(items, batch_size)))
+                if not batch: return
+                for item in batch: yield item
+        finally:
+            items.close()
+
+    async def settle(self, pending, wait):
+        """
+        Return the handle `pending` of a wait=False call as it is, or, if `wait`,
+        await it on the event loop and return the plain items, as the wait=True call would.
+        """
+        if not wait: return pending
+        await pending
+        return dict(pending) if isinstance(pending, PendingItem) else list(pending)
+
+    async def create(self, tocreate, wait=True):
+        """
+        See create() of the synchronous manager, called with wait=False on the request pool.
+        If wait=True, readiness is then awaited through the Api's ReadinessMultiplexer,
+        so waiting holds no thread of the pool.
+        """
+        return await self.settle(await self.aapi.call(self.manager.create, tocreate, wait=False), wait)
+
+    async def create_one(self, tocreate, wait=True):
+        return await self.settle(await self.aapi.call(self.manager.create_one, tocreate, wait=False), wait)
+
+    async def update(self, toupdate, wait=True):
+        """
+        See update() of the synchronous manager, and create() above.
+        """
+        return await self.settle(await self.aapi.call(self.manager.update, toupdate, wait=False), wait)
+
+    async def update_one(self, toupdate, wait=True):
+        return await self.settle(await self.aapi.call(self.manager.update_one, toupdate, wait=False), wait)
+
+    async def delete(self, todelete, wait=True):
+        """
+        See delete() of the synchronous manager, and create() above.
+        """
+        pending = await self.aapi.call(self.manager.delete, todelete, wait=False)
+        if not wait: return pending
+        await pending
+
+    async def delete_one(self, todelete, wait=True):
+        pending = await self.aapi.call(self.manager.delete_one, todelete, wait=False)
+        if not wait: return pending
+        await pending
+
+    async def bulk_create(self, tocreate, **kwargs):
+        """
+        See ApiModelManager.bulk_create()
+        """
+        return await self.aapi.call(self.manager.bulk_create, tocreate, **kwargs)
+
+    async def bulk_update(self, toupdate, **kwargs):
+        """
+        See ApiModelManager.bulk_update()
+        """
+        return await self.aapi.call(self.manager.bulk_update, toupdate, **kwargs)
+
+    async def bulk_delete(self, todelete, **kwargs):
+        """
+        See ApiModelManager.bulk_delete()
+        """
+        return await self.aapi.call(self.manager.bulk_delete, todelete, **kwargs)
+
+    async def check_ensure(self, needed, purge=False):
+        """
+        See ApiModelManager.check_ensure()
+        """
+        return await self.aapi.call(self.manager.check_ensure, needed, purge=purge)
+
+    async def check_reconcile(self, needed, purge=False):
+        """
+        See ApiModelManager.check_reconcile()
+        """
+        return await self.aapi.call(self.manager.check_reconcile, needed, purge=purge)
+
+    async def ensure(self, needed, purge=False, wait=True):
+        """
+        See ApiModelManager.ensure(), and create() above.
+        """
+        return await self.settle(await self.aapi.call(self.manager.ensure, needed, purge=purge, wait=False), wait)
+
+    async def reconcile(self, needed, purge=False, wait=True):
+        """
+        See ApiModelManager.reconcile(), and create() above.
+        """
+        updated, created = await self.aapi.call(self.manager.reconcile, needed, purge=purge, wait=False)
+        return await self.settle(updated, wait), await self.settle(created, wait)
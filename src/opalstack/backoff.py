@@ -0,0 +1,92 @@
+import time
+import random
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+class Backoff():
+    def __init__(self, initial=0.0, base=1.0, factor=2.0, cap=30.0, jitter=0.25, timeout=None, tries=0):
+        """
+        Schedule of pauses for a polling loop:
+            initial : pause before the first attempt (0 probes immediately)
+            base    : pause before the second attempt
+            factor  : each following pause is this many times longer than the previous one
+            cap     : no single pause is longer than this
+            jitter  : each pause after the first is randomized by up to this fraction either way
+            timeout : wall-clock budget in seconds, counted from the first call to delays(); None for no limit
+            tries   : if > 0, the maximum number of attempts
+        """
+        self.initial = initial
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+        self.timeout = timeout
+        self.tries = tries
+
+    @classmethod
+    def fixed(cls, delay, timeout=None, tries=0):
+        """
+        Pause `delay` before every attempt, like the original wait loops.
+        """
+        return cls(initial=delay, base=delay, factor=1.0, cap=delay, jitter=0.0, timeout=timeout, tries=tries)
+
+    def delays(self):
+        """
+        Yield the pause to take before each attempt.
+        Stops once `tries` attempts were made or once the `timeout` has passed;
+        a pause that would overrun the deadline is shortened to end right at it.
+        """
+        started = time.monotonic()
+        deadline = None if self.timeout is None else started + self.timeout
+        delay = self.initial
+        raw = self.base
+        attempt = 0
+        while True:
+            attempt += 1
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and attempt > 1: return
+                delay = max(0.0, min(delay, remaining))
+            yield delay
+            if attempt == self.tries: return
+            delay = raw
+            raw = min(self.cap, raw * self.factor)
+            if self.jitter:
+                delay = min(self.cap, delay * random.uniform(1.0 - self.jitter, 1.0 + self.jitter))
+
+class ReadinessStats():
+    def __init__(self, expected=5.0, alpha=0.3, min_delay=0.25, cap=30.0):
+        """
+        Learns how long each readiness profile (see ApiModelManager.readiness_profile())
+        typically takes to settle, and derives a Backoff from it:
+        the first probe is immediate, the second comes at about half the typical time,
+        and later probes back off exponentially up to `cap`.
+            expected  : assumed settle time, in seconds, for profiles with no observations yet
+            alpha     : weight of each new observation in the moving average
+            min_delay : shortest pause between probes
+        """
+        self.expected = expected
+        self.alpha = alpha
+        self.min_delay = min_delay
+        self.cap = cap
+        self.observed = {}
+        self.lock = threading.Lock()
+
+    def typical(self, profile):
+        with self.lock:
+            return self.observed.get(profile, self.expected)
+
+    def record(self, profile, elapsed):
+        with self.lock:
+            previous = self.observed.get(profile)
+            if previous is None:
+                self.observed[profile] = elapsed
+            else:
+                self.observed[profile] = self.alpha * elapsed + (1.0 - self.alpha) * previous
+        log.debug(f'Readiness of {profile} took {elapsed:.2f}s, now expecting {self.observed[profile]:.2f}s')
+
+    def backoff(self, profile, timeout=None):
+        base = min(self.cap, max(self.min_delay, self.typical(profile) / 2.0))
+        return Backoff(initial=0.0, base=base, factor=1.5, cap=max(base, self.cap), timeout=timeout)
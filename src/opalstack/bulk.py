@@ -0,0 +1,155 @@
+import logging
+import concurrent.futures
+
+from . import tracing
+from .errors import ApiError
+
+log = logging.getLogger(__name__)
+
+class BulkResult():
+    def __init__(self, manager, op, items):
+        """
+        Per-item outcome of a bulk create, update or delete, in the order of the given items.
+            results : the item returned by the API for each given item, or None if it failed
+                      or its outcome is unknown (for delete, the given item itself)
+            errors  : the exception for each given item which failed, or None
+            unknown : True for each given item the server answered for, but whose result could not
+                      be told apart from the others of its chunk (e.g. a short response): it may well
+                      have been applied, so it is neither succeeded nor failed
+            pending : with wait=False, a PendingResult of the succeeded items
+        """
+        self.manager = manager
+        self.op = op
+        self.items = items
+        self.results = [None] * len(items)
+        self.errors = [None] * len(items)
+        self.unknown = [False] * len(items)
+        self.pending = None
+
+    @property
+    def ok(self):
+        return not any(error is not None for error in self.errors) and not any(self.unknown)
+
+    @property
+    def succeeded(self):
+        return [result for result, error, unknown in zip(self.results, self.errors, self.unknown) if error is None and not unknown]
+
+    @property
+    def failed(self):
+        """
+        (item, exception) for each given item which failed
+        """
+        return [(item, error) for item, error in zip(self.items, self.errors) if error is not None]
+
+    @property
+    def failed_items(self):
+        """
+        The given items which failed, ready to be passed to another bulk call
+        """
+        return [item for item, error in self.failed]
+
+    @property
+    def unknown_items(self):
+        """
+        The given items which may or may not have been applied; check before sending them again
+        """
+        return [item for item, unknown in zip(self.items, self.unknown) if unknown]
+
+    def raise_for_errors(self):
+        if self.ok: return
+        failed, unknown = self.failed, self.unknown_items
+        first = f', first: {failed[0][1]}' if failed else ''
+        raise RuntimeError(f'{len(failed)} of {len(self.items)} {self.manager.model_name_plural} failed to {self.op}'
+                           f' and {len(unknown)} may not have{first}')
+
+    def __repr__(self):
+        return (f'<BulkResult {self.op} {self.manager.model_name_plural}: {len(self.succeeded)} succeeded, '
+                f'{len(self.failed)} failed, {len(self.unknown_items)} unknown>')
+
+def is_rejection(exception):
+    # Only a client error means the chunk was refused as a whole and nothing was applied,
+    # so that its halves may be resent; a 408 or 429 says nothing about the items
+    if not isinstance(exception, ApiError) or exception.status_code is None: return False
+    return 400 <= exception.status_code < 500 and exception.status_code not in (408, 429)
+
+def run_bulk(manager, op, items, chunk_size=100, workers=4, wait=True):
+    """
+    Send `items` to the `op` ('create', 'update' or 'delete') endpoint of `manager`
+    in chunks of at most `chunk_size`, with up to `workers` chunks in flight at once.
+      - Each chunk is one request, retried only by the Api's RetryPolicy.
+      - A chunk rejected with a client error (e.g. 400) is split in halves and each half resent,
+        so a bad item only fails itself and the rest of its chunk still goes through.
+        Any other failure (5xx, timeout, connection error) fails the whole chunk without resending it,
+        as the server may already have applied it.
+      - A chunk answered with a 200 but a different number of items than were sent was applied,
+        but its items cannot be matched to the results: they are reported as unknown, not failed.
+      - Readiness of every succeeded item is then awaited together in one wait, rather than per chunk.
+        Items which never become ready, or whose wait failed, are reported as failed.
+    Never raises for individual items: returns a BulkResult (see BulkResult.raise_for_errors()).
+    """
+    items = list(items)
+    result = BulkResult(manager, op, items)
+    api = manager.api
+    pk = manager.primary_key
+
+    def post(indexes):
+        if op == 'delete':
+            payload = [{pk: items[i][pk]} for i in indexes]
+        else:
+            payload = [items[i] for i in indexes]
+        log.info(f'Bulk {op} of {len(payload)} {manager.model_name_plural}')
+        try:
+            returned = api.http_post_result(f'/{manager.model_name}/{op}/', payload, ensure_status=[200], idempotent=op == 'update')
+        finally:
+            manager.invalidate()
+        if op == 'delete': return [items[i] for i in indexes]
+        return returned
+
+    def send(indexes):
+        try:
+            returned = post(indexes)
+        except Exception as e:
+            if is_rejection(e) and len(indexes) > 1:
+                half = len(indexes) // 2
+                send(indexes[:half])
+                send(indexes[half:])
+                return
+            log.warning(f'Bulk {op} of {len(indexes)} {manager.model_name_plural} failed: {e}')
+            for i in indexes: result.errors[i] = e
+            return
+        if len(returned) != len(indexes):
+            log.warning(f'Bulk {op} of {len(indexes)} {manager.model_name_plural} answered with {len(returned)} items')
+            for i in indexes: result.unknown[i] = True
+            return
+        for i, item in zip(indexes, returned): result.results[i] = item
+
+    chunks = [list(range(start, min(start + chunk_size, len(items)))) for start in range(0, len(items), chunk_size)]
+    if len(chunks) < 2 or workers < 2:
+        for chunk in chunks: send(chunk)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(tracing.wrap(send), chunks))
+
+    succeeded = [i for i in range(len(items)) if result.errors[i] is None and not result.unknown[i]]
+    deleted = op == 'delete'
+    returned = [result.results[i] for i in succeeded]
+    if not wait:
+        result.pending = manager.pending(returned, deleted=deleted, profile=None if deleted else manager.readiness_profile(returned))
+        return result
+    if manager.is_instantaneous or not succeeded: return result
+
+    uuids = [item[pk] for item in returned]
+    try:
+        if deleted:
+            api.wait_deleted(manager.model_name, uuids)
+        else:
+            api.wait_ready(manager.model_name, uuids, profile=manager.readiness_profile(returned))
+        manager.invalidate()
+    except Exception as e:
+        try:
+            still_pending = set(api.pending_deleted(manager.model_name, uuids) if deleted else api.pending_ready(manager.model_name, uuids))
+        except Exception:
+            still_pending = set(uuids)
+        for i, uuid in zip(succeeded, uuids):
+            if uuid in still_pending: result.errors[i] = e
+    return result
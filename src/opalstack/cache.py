@@ -0,0 +1,212 @@
+import os
+import copy
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import contextlib
+import urllib.parse
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+MISS = object()
+
+def cache_scope(url, token):
+    """
+    Name under which an Api's responses are cached, so caches shared between Api objects
+    never mix up the data of different accounts or endpoints.
+    """
+    return hashlib.sha256(f'{url}\0{token}'.encode()).hexdigest()[:16]
+
+class MemoryStore():
+    def __init__(self):
+        """
+        Keeps cached responses in this process, as {(scope, model_name): {key: (expires_at, value)}}.
+        Stores also keep a generation number per model, which clear() changes
+        (see Cache.generation()).
+        """
+        self.buckets = {}
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, scope, model_name, key):
+        with self.lock:
+            return self.buckets.get((scope, model_name), {}).get(key)
+
+    def generation(self, scope, model_name):
+        with self.lock:
+            return self.generations.get((scope, model_name), 0)
+
+    def set(self, scope, model_name, key, expires_at, value, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generations.get((scope, model_name), 0): return
+            self.buckets.setdefault((scope, model_name), {})[key] = (expires_at, value)
+
+    def entries(self, scope, model_name, prefix=''):
+        with self.lock:
+            return [(key, entry[0]) for key, entry in self.buckets.get((scope, model_name), {}).items() if key.startswith(prefix)]
+
+    def clear(self, scope, model_name):
+        with self.lock:
+            self.generations[(scope, model_name)] = self.generations.get((scope, model_name), 0) + 1
+            self.buckets.pop((scope, model_name), None)
+
+class DiskStore():
+    def __init__(self, path=None):
+        """
+        Keeps cached responses on disk, so separate processes on the same host
+        (e.g. cron runs) share them. By default under $XDG_CACHE_HOME/opalstack (~/.cache/opalstack).
+        Each response is one zlib-compressed JSON file, replaced atomically,
+        in a directory per account scope and model:
+            <path>/<scope>/<model_name>/<quoted key>
+        Writes and invalidations of a model are serialized across processes by
+        locking <path>/<scope>/<model_name>.lock (where fcntl is available).
+        """
+        if path is None:
+            path = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'opalstack')
+        self.path = path
+
+    def model_dir(self, scope, model_name):
+        return os.path.join(self.path, scope, model_name)
+
+    @contextlib.contextmanager
+    def locked(self, scope, model_name, exclusive):
+        os.makedirs(os.path.join(self.path, scope), mode=0o700, exist_ok=True)
+        with open(os.path.join(self.path, scope, f'{model_name}.lock'), 'a+') as lockfile:
+            if fcntl: fcntl.flock(lockfile, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield lockfile
+            finally:
+                if fcntl: fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def get(self, scope, model_name, key):
+        try:
+            with open(os.path.join(self.model_dir(scope, model_name), urllib.parse.quote(key, safe='')), 'rb') as f:
+                expires_at, value = json.loads(zlib.decompress(f.read()))
+        except (OSError, ValueError, zlib.error):
+            return None
+        return expires_at, value
+
+    def generation(self, scope, model_name):
+        # The lock file holds the generation number
+        with self.locked(scope, model_name, exclusive=False) as lockfile:
+            lockfile.seek(0)
+            return int(lockfile.read() or 0)
+
+    def set(self, scope, model_name, key, expires_at, value, generation=None):
+        data = zlib.compress(json.dumps([expires_at, value], separators=(',', ':')).encode(), 1)
+        with self.locked(scope, model_name, exclusive=True) as lockfile:
+            lockfile.seek(0)
+            if generation is not None and generation != int(lockfile.read() or 0): return
+            directory = self.model_dir(scope, model_name)
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f: f.write(data)
+                os.replace(tmp, os.path.join(directory, urllib.parse.quote(key, safe='')))
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def entries(self, scope, model_name, prefix=''):
+        try:
+            names = os.listdir(self.model_dir(scope, model_name))
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            key = urllib.parse.unquote(name)
+            if name.startswith('.tmp-') or not key.startswith(prefix): continue
+            entry = self.get(scope, model_name, key)
+            if entry is not None: entries.append((key, entry[0]))
+        return entries
+
+    def clear(self, scope, model_name):
+        with self.locked(scope, model_name, exclusive=True) as lockfile:
+            lockfile.seek(0)
+            generation = int(lockfile.read() or 0) + 1
+            lockfile.seek(0)
+            lockfile.truncate()
+            lockfile.write(str(generation))
+            lockfile.flush()
+            shutil.rmtree(self.model_dir(scope, model_name), ignore_errors=True)
+
+class Cache():
+    def __init__(self, ttl=60.0, ttls=None, store=None):
+        """
+        Opt-in cache of list_all() and read() responses (see Api(cache=...)):
+            ttl   : seconds a response stays fresh
+            ttls  : {model_name: seconds} overriding `ttl` per model; 0 disables caching for that model
+            store : where responses are kept; a MemoryStore by default, or a DiskStore to share them between processes
+        Every create(), update() or delete() through a manager drops all cached responses of its model.
+        (Cached collections are not patched with the returned items, since those are snapshots taken
+        before the items became ready.) Callers get their own copy of cached responses.
+        Hits and misses are counted per model (see snapshot()).
+        """
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.store = store or MemoryStore()
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def ttl_for(self, model_name):
+        return self.ttls.get(model_name, self.ttl)
+
+    def get(self, scope, model_name, key):
+        """
+        Return a copy of the fresh cached response for `key`, or MISS.
+        """
+        if not self.ttl_for(model_name): return MISS
+        entry = self.store.get(scope, model_name, key)
+        if entry is None or entry[0] <= time.time():
+            self.count('misses')
+            self.count(f'{model_name}:misses')
+            return MISS
+        self.count('hits')
+        self.count(f'{model_name}:hits')
+        return copy.deepcopy(entry[1])
+
+    def generation(self, scope, model_name):
+        """
+        Changes whenever `model_name` is invalidated. Pass it from before a fetch to set(),
+        so a response fetched before a write is not cached after it.
+        """
+        return self.store.generation(scope, model_name)
+
+    def set(self, scope, model_name, key, value, generation=None):
+        ttl = self.ttl_for(model_name)
+        if not ttl: return
+        self.store.set(scope, model_name, key, time.time() + ttl, copy.deepcopy(value), generation=generation)
+
+    def fresh_keys(self, scope, model_name, prefix=''):
+        """
+        Return the keys starting with `prefix` that have a fresh cached response, without counting hits or misses.
+        """
+        if not self.ttl_for(model_name): return []
+        now = time.time()
+        return [key for key, expires_at in self.store.entries(scope, model_name, prefix) if expires_at > now]
+
+    def invalidate(self, scope, model_name):
+        log.debug(f'Invalidating cached {model_name} responses')
+        self.count(f'{model_name}:invalidations')
+        self.store.clear(scope, model_name)
+
+    def snapshot(self):
+        """
+        Return a copy of the counters: hits, misses, and <model_name>:hits, :misses, :invalidations
+        """
+        with self.lock:
+            return dict(self.stats)
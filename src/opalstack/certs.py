@@ -1,4 +1,5 @@
 from .manager import ApiModelManager
+from .util import frozen
 
 class CertsManager(ApiModelManager):
     def __init__(self, api):
@@ -6,6 +7,7 @@ class CertsManager(ApiModelManager):
         self.model_name_plural = 'certs'
         self.is_instantaneous  = True
         self.primary_key       = 'id'
+        self.mutable_fields    = ('cert', 'intermediates', 'key')
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -28,3 +30,18 @@ class CertsManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return self.check_equals(new, existing)
+
+    def equals_key(self, item):
+        return ( item['name'],
+                 item['cert'],
+                 frozen(item['intermediates']),
+                 item['key'] )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return self.equals_key(item)
+
+    def update_key(self, item):
+        return ( item['name'], )
@@ -6,6 +6,8 @@ class DnsrecordsManager(ApiModelManager):
         self.model_name_plural = 'dnsrecords'
         self.is_instantaneous  = False
         self.primary_key       = 'id'
+        self.mutable_fields    = ('content', 'priority', 'ttl')
+        self.relations         = {'domain': 'domains'}
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -29,3 +31,20 @@ class DnsrecordsManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return self.check_equals(new, existing)
+
+    def equals_key(self, item):
+        return ( item['domain'],
+                 item['type'],
+                 item['content'],
+                 item['priority'],
+                 item['ttl'] )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return self.equals_key(item)
+
+    def update_key(self, item):
+        return ( item['domain'],
+                 item['type'] )
@@ -23,3 +23,12 @@ class DomainsManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return self.check_equals(new, existing)
+
+    def equals_key(self, item):
+        return ( item['name'], )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return self.equals_key(item)
@@ -0,0 +1,11 @@
+class ApiError(RuntimeError):
+    def __init__(self, message, status_code=None, result=None):
+        """
+        Raised when the API answers with an unexpected status.
+            status_code : the HTTP status of the response
+            result      : the decoded JSON body, or None
+        A RuntimeError, like every other error raised by this library.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.result = result
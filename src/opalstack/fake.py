@@ -0,0 +1,502 @@
+import re
+import copy
+import time
+import uuid
+import random
+import logging
+import datetime
+import threading
+import collections
+import urllib.parse
+
+import requests
+
+from .api import Api
+from .codec import get_codec
+from .metrics import endpoint
+
+log = logging.getLogger(__name__)
+
+API_PREFIX = '/api/v1'
+
+#
+# -- What the fake knows about each model --
+#
+
+# Fields holding ids of other objects, and the model those belong to; 'a.b' is field b of each object
+# in the list a. An embed=... name matches the last part. Used to embed and to check references.
+RELATIONS = {
+    'account':   {'web_servers': 'server', 'imap_servers': 'server', 'smtp_servers': 'server'},
+    'ip':        {'server': 'server'},
+    'dnsrecord': {'domain': 'domain'},
+    'osuser':    {'server': 'server'},
+    'osvar':     {'osusers': 'osuser'},
+    'app':       {'osuser': 'osuser'},
+    'mariauser': {'server': 'server'},
+    'mariadb':   {'server': 'server', 'dbusers_readwrite': 'mariauser', 'dbusers_readonly': 'mariauser'},
+    'psqluser':  {'server': 'server'},
+    'psqldb':    {'server': 'server', 'dbusers_readwrite': 'psqluser', 'dbusers_readonly': 'psqluser'},
+    'site':      {'server': 'server', 'ip4': 'ip', 'ip6': 'ip', 'domains': 'domain', 'cert': 'cert', 'routes.app': 'app'},
+    'mailuser':  {'imap_server': 'server'},
+    'address':   {'destinations': 'mailuser'},
+}
+
+# Fields the API fills in when a create leaves them out
+DEFAULTS = {
+    'dnsrecord': {'priority': 10, 'ttl': 3600},
+    'osvar':     {'global': False, 'osusers': []},
+    'app':       {'json': {}, 'installed': False},
+    'mariadb':   {'dbusers_readwrite': [], 'dbusers_readonly': []},
+    'psqldb':    {'dbusers_readwrite': [], 'dbusers_readonly': []},
+    'site':      {'domains': [], 'routes': [], 'cert': None, 'ip6': None, 'redirect': False, 'generate_le': False},
+    'address':   {'destinations': [], 'forwards': []},
+}
+
+# Fields (or combinations of fields) no two objects of a model may share
+UNIQUE = {
+    'domain':    [('name',)],
+    'osuser':    [('name',)],
+    'app':       [('osuser', 'name')],
+    'mariauser': [('name',)],
+    'mariadb':   [('name',)],
+    'psqluser':  [('name',)],
+    'psqldb':    [('name',)],
+    'mailuser':  [('name',)],
+    'site':      [('name',)],
+    'address':   [('source',)],
+}
+
+# Models whose changes take effect at once; the others go through a PENDING state first
+INSTANTANEOUS = {'token', 'notice', 'cert', 'server', 'ip'}
+
+# Models which can only be listed and read
+READ_ONLY = {'account', 'server', 'ip'}
+
+PRIMARY_KEYS = {'token': 'key'}
+
+# Accepted on create and update, but never returned
+WRITE_ONLY = ('password',)
+
+MODELS = sorted({'account', 'token', 'notice', 'server', 'ip', 'domain', 'dnsrecord', 'osuser', 'osvar', 'app',
+                 'mariadb', 'mariauser', 'psqldb', 'psqluser', 'cert', 'site', 'address', 'mailuser'})
+
+class Reset(Exception):
+    """
+    Raised by FakeServer.handle() to drop the connection instead of answering.
+    """
+
+class FakeServer():
+    def __init__(self, items=None, latency=0.0, ready_delay=0.0, delete_delay=None,
+                 error_rate=0.0, error_status=503, seed=0, clock=time.monotonic, history=1000):
+        """
+        An in-memory stand-in for the Opalstack API, serving list/, read/, create/, update/ and delete/
+        of every model, with embed=..., readiness transitions and injectable failures.
+            items        : the initial objects, {model_name: [item, ...]}; servers may also be given
+                           grouped, as the API lists them ({'web_servers': [...], ...}).
+                           None seeds an account with one web, imap and smtp server and their ips
+            latency      : seconds every request takes
+            ready_delay  : seconds created and updated objects stay PENDING before they are READY
+            delete_delay : seconds deleted objects stay DELETING before they are gone; by default ready_delay
+            error_rate   : fraction of requests answered with `error_status` instead, at random
+            seed         : seeds the ids and the random errors, so runs are reproducible
+            clock        : the time source for the delays
+            history      : number of recent requests kept in `history`, as (method, path, body)
+        See inject() for failing particular requests. Talk to it in-process through api() or FakeTransport,
+        or over HTTP (see benchmarks/standin.py).
+        """
+        self.latency = latency
+        self.ready_delay = ready_delay
+        self.delete_delay = ready_delay if delete_delay is None else delete_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.store = {model_name: {} for model_name in MODELS}
+        self.server_groups = {}
+        self.settle_at = {model_name: {} for model_name in MODELS}
+        self.faults = []
+        self.calls = collections.Counter()
+        self.history = collections.deque(maxlen=history)
+        self.lock = threading.Lock()
+        for model_name, model_items in (default_items(self) if items is None else items).items():
+            self.add(model_name, model_items)
+
+    def new_id(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def add(self, model_name, items):
+        """
+        Add ready objects, as they are, to `model_name`; objects without an id are given one.
+        """
+        with self.lock:
+            if model_name == 'server' and isinstance(items, dict):
+                for group, members in items.items(): self.add_servers(group, members)
+                return
+            if model_name == 'server':
+                self.add_servers('web_servers', items)
+                return
+            pk = PRIMARY_KEYS.get(model_name, 'id')
+            store = self.store.setdefault(model_name, {})
+            self.settle_at.setdefault(model_name, {})
+            for item in items:
+                item = dict(item)
+                if pk not in item: item[pk] = self.new_id()
+                store[item[pk]] = item
+
+    def add_servers(self, group, members):
+        for server in members:
+            server = dict(server)
+            if 'id' not in server: server['id'] = self.new_id()
+            self.store['server'][server['id']] = server
+            self.server_groups[server['id']] = group
+
+    def items(self, model_name):
+        """
+        Return copies of the current objects of `model_name`, whatever their state.
+        """
+        with self.lock:
+            self.settle(model_name)
+            return copy.deepcopy(list(self.store.get(model_name, {}).values()))
+
+    def inject(self, status=503, times=1, method=None, path=None, headers={}, reset=False):
+        """
+        Fail the next `times` requests whose method is `method` and whose path matches the regular
+        expression `path` (None matches any), with `status` and response `headers` (e.g. Retry-After),
+        or, with reset=True, by dropping the connection. The request is not processed.
+        """
+        with self.lock:
+            self.faults.append({'status': status, 'times': times, 'method': method,
+                                'path': re.compile(path) if path else None, 'headers': dict(headers), 'reset': reset})
+
+    def call_count(self, method=None, model_name=None, action=None):
+        """
+        Number of requests served, optionally only those with the given method, model and action.
+        """
+        with self.lock:
+            return sum(count for (m, model, a), count in self.calls.items()
+                       if method in (None, m) and model_name in (None, model) and action in (None, a))
+
+    def requested(self, method=None):
+        """
+        Paths (with their query) of the recent requests, optionally only those with the given method.
+        """
+        with self.lock:
+            return [path for m, path, body in self.history if method in (None, m)]
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls.clear()
+            self.history.clear()
+
+    #
+    # -- Handling a request --
+    #
+
+    def handle(self, method, path, body=None, headers=None):
+        """
+        Answer one request. `path` is relative to the API root ('/osuser/list/?embed=server')
+        and `body` is the decoded POST body. Returns (status, headers, result), or raises Reset.
+        When the request `headers` are given, they must carry a token ('Authorization: Token ...')
+        or the answer is 401; None skips the check, for calls made directly on the server.
+        """
+        if self.latency: time.sleep(self.latency)
+        if path.startswith(API_PREFIX): path = path[len(API_PREFIX):]
+        requested = path
+        path, _, query = path.partition('?')
+        embed = [name for value in urllib.parse.parse_qs(query).get('embed', []) for name in value.split(',') if name]
+        model_name, action = endpoint(path)
+        with self.lock:
+            self.calls[(method, model_name, action)] += 1
+            self.history.append((method, requested, body))
+            fault = self.fault(method, path)
+            if fault is not None:
+                if fault['reset']: raise Reset(f'{method} {path}')
+                return fault['status'], fault['headers'], {'detail': 'Injected failure.'}
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.error_status, {}, {'detail': 'Random failure.'}
+            if headers is not None and not authorized(headers):
+                return 401, {'WWW-Authenticate': 'Token'}, {'detail': 'Authentication credentials were not provided.'}
+            return self.route(method, path, body, embed)
+
+    def fault(self, method, path):
+        for fault in self.faults:
+            if fault['method'] not in (None, method): continue
+            if fault['path'] is not None and not fault['path'].search(path): continue
+            fault['times'] -= 1
+            if fault['times'] <= 0: self.faults.remove(fault)
+            return fault
+        return None
+
+    def route(self, method, path, body, embed):
+        parts = path.strip('/').split('/')
+        model_name = parts[0]
+        if model_name == 'usage' and method == 'GET' and len(parts) == 3 and parts[2] == 'latest':
+            return self.usage(parts[1], embed)
+        if model_name not in self.store: return 404, {}, {'detail': 'Not found.'}
+        action = parts[1] if len(parts) > 1 else ''
+        if method == 'GET' and action == 'list' and len(parts) == 2:
+            return 200, {}, self.list(model_name, embed)
+        if method == 'GET' and action == 'read' and len(parts) == 3:
+            self.settle(model_name)
+            item = self.store[model_name].get(parts[2])
+            if item is None: return 404, {}, {'detail': 'Not found.'}
+            return 200, {}, self.embedded(model_name, [item], embed)[0]
+        if method == 'POST' and len(parts) == 2 and action in ('create', 'update', 'delete', 'installed'):
+            if model_name in READ_ONLY or (action == 'installed' and model_name != 'app'):
+                return 405, {}, {'detail': f'Method "{method}" not allowed.'}
+            if not isinstance(body, list) or not all(isinstance(entry, dict) for entry in body):
+                return 400, {}, {'detail': 'Expected a list of items.'}
+            self.settle(model_name)
+            return getattr(self, action)(model_name, body)
+        if method not in ('GET', 'POST'): return 405, {}, {'detail': f'Method "{method}" not allowed.'}
+        return 404, {}, {'detail': 'Not found.'}
+
+    def list(self, model_name, embed):
+        self.settle(model_name)
+        items = self.embedded(model_name, list(self.store[model_name].values()), embed)
+        if model_name != 'server': return items
+        grouped = {'web_servers': [], 'imap_servers': [], 'smtp_servers': []}
+        for item in items: grouped.setdefault(self.server_groups.get(item['id'], 'web_servers'), []).append(item)
+        return grouped
+
+    def create(self, model_name, body):
+        store = self.store[model_name]
+        pk = PRIMARY_KEYS.get(model_name, 'id')
+        created = []
+        for entry in body:
+            item = dict(copy.deepcopy(DEFAULTS.get(model_name, {})), **copy.deepcopy(entry))
+            item[pk] = self.new_id() if pk == 'id' else f'{self.random.getrandbits(160):040x}'
+            item['created_at'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            if model_name == 'site' and 'server' not in item and item.get('ip4') in self.store['ip']:
+                item['server'] = self.store['ip'][item['ip4']]['server']
+            created.append(item)
+        error = self.validate(model_name, created, replaced=())
+        if error is not None: return 400, {}, error
+        for item in created:
+            for field in WRITE_ONLY: item.pop(field, None)
+            store[item[pk]] = item
+            self.transition(model_name, item, 'PENDING')
+        return 200, {}, [copy.deepcopy(item) for item in created]
+
+    def update(self, model_name, body):
+        store = self.store[model_name]
+        pk = PRIMARY_KEYS.get(model_name, 'id')
+        updated = []
+        for entry in body:
+            if entry.get(pk) not in store: return 400, {}, {pk: [f'Object with {pk}={entry.get(pk)} does not exist.']}
+            item = dict(store[entry[pk]], **copy.deepcopy(entry))
+            updated.append(item)
+        error = self.validate(model_name, updated, replaced={item[pk] for item in updated})
+        if error is not None: return 400, {}, error
+        for item in updated:
+            for field in WRITE_ONLY: item.pop(field, None)
+            store[item[pk]] = item
+            self.transition(model_name, item, 'PENDING')
+        return 200, {}, [copy.deepcopy(item) for item in updated]
+
+    def delete(self, model_name, body):
+        store = self.store[model_name]
+        pk = PRIMARY_KEYS.get(model_name, 'id')
+        for entry in body:
+            if entry.get(pk) not in store: return 400, {}, {pk: [f'Object with {pk}={entry.get(pk)} does not exist.']}
+        for entry in body:
+            item = store[entry[pk]]
+            if model_name in INSTANTANEOUS or self.delete_delay <= 0:
+                del store[entry[pk]]
+                self.settle_at[model_name].pop(entry[pk], None)
+            else:
+                self.transition(model_name, item, 'DELETING')
+        return 200, {}, []
+
+    def installed(self, model_name, body):
+        store = self.store[model_name]
+        for entry in body:
+            if entry.get('id') not in store: return 400, {}, {'id': [f'Object with id={entry.get("id")} does not exist.']}
+        for entry in body: store[entry['id']]['installed'] = True
+        return 200, {}, [copy.deepcopy(store[entry['id']]) for entry in body]
+
+    def usage(self, kind, embed):
+        group = {'web': 'web_servers', 'mail': 'imap_servers'}.get(kind)
+        if group is None: return 404, {}, {'detail': 'Not found.'}
+        servers = [server for server in self.store['server'].values() if self.server_groups.get(server['id']) == group]
+        usage = [{'server': server if 'server' in embed else server['id'], 'disk_used': 0.0, 'created_at': None} for server in servers]
+        return 200, {}, usage
+
+    def validate(self, model_name, items, replaced):
+        """
+        Return the error body for the first item which refers to a missing object
+        or clashes with another on a UNIQUE field, or None if all are valid.
+        """
+        for field, target in RELATIONS.get(model_name, {}).items():
+            for item in items:
+                for value in field_values(item, field):
+                    if value is not None and value not in self.store.get(target, {}):
+                        return {field.split('.')[-1]: [f'Invalid pk "{value}" - object does not exist.']}
+        pk = PRIMARY_KEYS.get(model_name, 'id')
+        for fields in UNIQUE.get(model_name, []):
+            seen = {tuple(item.get(f) for f in fields) for item in self.store[model_name].values() if item[pk] not in replaced}
+            for item in items:
+                key = tuple(item.get(f) for f in fields)
+                if key in seen: return {fields[-1]: [f'{model_name} with this {", ".join(fields)} already exists.']}
+                seen.add(key)
+        return None
+
+    #
+    # -- Readiness --
+    #
+
+    def transition(self, model_name, item, state):
+        """
+        Put `item` into `state` (PENDING or DELETING) until the configured delay has passed.
+        """
+        delay = self.delete_delay if state == 'DELETING' else self.ready_delay
+        pk = PRIMARY_KEYS.get(model_name, 'id')
+        if model_name in INSTANTANEOUS or delay <= 0:
+            if model_name not in INSTANTANEOUS: item.update(state='READY', ready=True)
+            return
+        item.update(state=state, ready=False)
+        self.settle_at[model_name][item[pk]] = self.clock() + delay
+
+    def settle(self, model_name):
+        """
+        Apply the transitions of `model_name` which are due.
+        """
+        pending = self.settle_at.get(model_name)
+        if not pending: return
+        now = self.clock()
+        store = self.store[model_name]
+        for key, at in list(pending.items()):
+            if at > now: continue
+            del pending[key]
+            item = store.get(key)
+            if item is None: continue
+            if item.get('state') == 'DELETING':
+                del store[key]
+            else:
+                item.update(state='READY', ready=True)
+
+    def embedded(self, model_name, items, embed):
+        """
+        Return `items` with the related ids named in `embed` replaced by copies of those objects.
+        Without embeds, the stored objects themselves are returned, so large lists are not copied.
+        """
+        fields = [(field, target) for field, target in RELATIONS.get(model_name, {}).items() if field.split('.')[-1] in embed]
+        if not fields: return items
+        result = []
+        for item in items:
+            item = copy.deepcopy(item)
+            for field, target in fields: embed_field(item, field.split('.'), self.store.get(target, {}))
+            result.append(item)
+        return result
+
+def authorized(headers):
+    """
+    Whether the request `headers` (a dict, or the case-insensitive headers of an HTTP request) carry a token.
+    """
+    scheme, _, token = (headers.get('Authorization') or '').partition(' ')
+    return scheme == 'Token' and bool(token.strip())
+
+def field_values(item, field):
+    """
+    The ids `item` holds in `field` (see RELATIONS), as a list.
+    """
+    head, _, rest = field.partition('.')
+    value = item.get(head)
+    if rest: return [v for sub in (value or []) if isinstance(sub, dict) for v in field_values(sub, rest)]
+    if isinstance(value, list): return value
+    return [value]
+
+def embed_field(item, path, objects):
+    value = item.get(path[0])
+    if len(path) > 1:
+        for sub in value or []:
+            if isinstance(sub, dict): embed_field(sub, path[1:], objects)
+    elif isinstance(value, list):
+        item[path[0]] = [copy.deepcopy(objects[v]) if v in objects else v for v in value]
+    elif value in objects:
+        item[path[0]] = copy.deepcopy(objects[value])
+
+def default_items(server):
+    """
+    An account with one web server (with a primary and a secondary ip), one imap and one smtp server.
+    """
+    web = {'id': server.new_id(), 'hostname': 'opal1.opalstack.com'}
+    imap = {'id': server.new_id(), 'hostname': 'mail1.opalstack.com'}
+    smtp = {'id': server.new_id(), 'hostname': 'smtp1.opalstack.com'}
+    return {
+        'server': {'web_servers': [web], 'imap_servers': [imap], 'smtp_servers': [smtp]},
+        'ip': [
+            {'id': server.new_id(), 'ip': '192.0.2.10', 'type': 4, 'primary': True, 'server': web['id']},
+            {'id': server.new_id(), 'ip': '192.0.2.11', 'type': 4, 'primary': False, 'server': web['id']},
+        ],
+        'account': [{
+            'id': server.new_id(),
+            'email': 'user@example.com',
+            'payment_processor': 'stripe',
+            'web_servers': [web['id']],
+            'imap_servers': [imap['id']],
+            'smtp_servers': [smtp['id']],
+            'usage_data': {'webservers': {web['id']: {'hostname': web['hostname'], 'disk_used': 0.0, 'disk_total': 10240.0,
+                                                      'rss_used': 0.0, 'rss_total': 1024.0}}},
+        }],
+    }
+
+#
+# -- In-process transport --
+#
+
+class FakeResponse():
+    def __init__(self, status_code, headers, content):
+        """
+        The parts of a requests.Response which Api reads.
+        """
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+    def __repr__(self):
+        return f'<FakeResponse [{self.status_code}]>'
+
+class FakeTransport():
+    def __init__(self, server, codec=None):
+        """
+        Delivers the requests of an Api to `server`, a FakeServer, within the process: no sockets,
+        but bodies are still encoded and decoded, and headers checked, so the client does the same work as over HTTP.
+        A dropped connection (see FakeServer.inject()) raises requests.ConnectionError, as requests does.
+        """
+        self.server = server
+        self.codec = get_codec(codec)
+
+    def request(self, method, url, data=None, headers=None):
+        path = urllib.parse.urlsplit(url)
+        path = path.path + ('?' + path.query if path.query else '')
+        body = self.codec.loads(data) if data else None
+        try:
+            status, headers, result = self.server.handle(method, path, body, headers=headers or {})
+        except Reset as e:
+            raise requests.ConnectionError(f'Connection reset by fake server: {e}')
+        return FakeResponse(status, headers, self.codec.dumps(result))
+
+    def get(self, url, headers=None, stream=False):
+        return self.request('GET', url, headers=headers)
+
+    def post(self, url, data=None, headers=None):
+        return self.request('POST', url, data, headers=headers)
+
+    def close(self):
+        pass
+
+def fake_api(server=None, token='0000000000000000000000000000000000000000', **kwargs):
+    """
+    Return an Api, configured by `kwargs`, which talks to `server` (by default, a new FakeServer) in-process.
+    """
+    server = server if server is not None else FakeServer()
+    return Api(token, transport=FakeTransport(server, codec=kwargs.get('codec')), **kwargs)
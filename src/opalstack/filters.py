@@ -0,0 +1,223 @@
+import re
+
+#
+# -- Operators --
+#
+# Values of a filter keymap are compared for equality, unless they are one of these:
+#
+#     filt(dnsrecords, {'type': In(['A', 'AAAA']), 'ttl': Lt(3600)})
+#     filt(osusers, {'name': Regex(r'^test'), 'server.hostname': Not('opal1.opalstack.com')})
+#     laxfilt(apps, {'json.site_url': Exists()})
+#
+# Operators compose with &, | and ~, e.g. Ge(300) & Le(3600), or ~In(['MX']).
+#
+# An operator's `missing` says whether an item lacking the keypath matches:
+# True or False for operators about existence, None for the rest, which makes
+# filt() raise KeyError and laxfilt() treat the item as a mismatch.
+#
+
+class Op():
+    missing = None
+
+    def __call__(self, value):
+        raise NotImplementedError()
+
+    def __and__(self, other):
+        return AllOf(self, other)
+
+    def __or__(self, other):
+        return AnyOf(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+class Eq(Op):
+    def __init__(self, expected):
+        self.expected = expected
+
+    def __call__(self, value):
+        return value == self.expected
+
+    def __repr__(self):
+        return f'Eq({self.expected!r})'
+
+def as_op(expected):
+    return expected if isinstance(expected, Op) else Eq(expected)
+
+class Not(Op):
+    def __init__(self, expected):
+        self.op = as_op(expected)
+        self.missing = None if self.op.missing is None else not self.op.missing
+
+    def __call__(self, value):
+        return not self.op(value)
+
+    def __repr__(self):
+        return f'Not({self.op!r})'
+
+class AllOf(Op):
+    def __init__(self, *expected):
+        self.ops = [as_op(e) for e in expected]
+        missing = [op.missing for op in self.ops]
+        self.missing = False if False in missing else None if None in missing else True
+
+    def __call__(self, value):
+        return all(op(value) for op in self.ops)
+
+    def __repr__(self):
+        return f'AllOf({", ".join(map(repr, self.ops))})'
+
+class AnyOf(Op):
+    def __init__(self, *expected):
+        self.ops = [as_op(e) for e in expected]
+        missing = [op.missing for op in self.ops]
+        self.missing = True if True in missing else None if None in missing else False
+
+    def __call__(self, value):
+        return any(op(value) for op in self.ops)
+
+    def __repr__(self):
+        return f'AnyOf({", ".join(map(repr, self.ops))})'
+
+class In(Op):
+    def __init__(self, values):
+        self.values = list(values)
+        try:
+            self.lookup = frozenset(self.values)
+        except TypeError:  # Unhashable values (e.g. embedded dicts) are searched linearly
+            self.lookup = self.values
+
+    def __call__(self, value):
+        try:
+            return value in self.lookup
+        except TypeError:
+            return value in self.values
+
+    def __repr__(self):
+        return f'In({self.values!r})'
+
+class Regex(Op):
+    def __init__(self, pattern, flags=0):
+        self.pattern = re.compile(pattern, flags)
+
+    def __call__(self, value):
+        return isinstance(value, str) and self.pattern.search(value) is not None
+
+    def __repr__(self):
+        return f'Regex({self.pattern.pattern!r})'
+
+class Compare(Op):
+    def __init__(self, bound):
+        self.bound = bound
+
+    def __call__(self, value):
+        try:
+            return self.compare(value, self.bound)
+        except TypeError:  # e.g. None compared with a number
+            return False
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.bound!r})'
+
+class Gt(Compare):
+    @staticmethod
+    def compare(value, bound): return value > bound
+
+class Ge(Compare):
+    @staticmethod
+    def compare(value, bound): return value >= bound
+
+class Lt(Compare):
+    @staticmethod
+    def compare(value, bound): return value < bound
+
+class Le(Compare):
+    @staticmethod
+    def compare(value, bound): return value <= bound
+
+class Exists(Op):
+    def __init__(self, exists=True):
+        self.exists = exists
+        self.missing = not exists
+
+    def __call__(self, value):
+        return self.exists
+
+    def __repr__(self):
+        return f'Exists({self.exists!r})'
+
+#
+# -- Compiled filters --
+#
+
+def accessor(keypath, sep='.'):
+    """
+    Return a function reading the value at `keypath` from an item, raising KeyError if it is missing.
+    The keypath is split once here rather than for every item.
+    """
+    keys = tuple(keypath.split(sep))
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda item: item[key]
+    if len(keys) == 2:
+        first, second = keys
+        return lambda item: item[first][second]
+    def get(item):
+        for key in keys: item = item[key]
+        return item
+    return get
+
+class Filter():
+    def __init__(self, keymap, sep='.', lax=False):
+        """
+        `keymap` compiled once into accessors and tests, for matching any number of items without copying them.
+        See opalstack.util.filt(); with lax=True, missing keys are mismatches as in laxfilt().
+        """
+        self.keymap = keymap
+        self.lax = lax
+        checks = []
+        for keypath, expected in keymap.items():
+            op = as_op(expected)
+            checks.append((accessor(keypath, sep), op))
+        self.match = self.compile(checks, lax)
+
+    @staticmethod
+    def compile(checks, lax):
+        if not checks: return lambda item: True
+        if not lax and all(type(op) is Eq for get, op in checks):
+            # The common case: plain values, compared inline rather than through Eq.__call__()
+            if len(checks) == 1:
+                (get, op), = checks
+                expected = op.expected
+                return lambda item: get(item) == expected
+            pairs = tuple((get, op.expected) for get, op in checks)
+            def match(item):
+                for get, expected in pairs:
+                    if get(item) != expected: return False
+                return True
+            return match
+        def match(item):
+            for get, op in checks:
+                try:
+                    value = get(item)
+                except KeyError:
+                    if op.missing is None:
+                        if lax: return False
+                        raise
+                    if not op.missing: return False
+                    continue
+                if not op(value): return False
+            return True
+        return match
+
+    def __call__(self, item):
+        return self.match(item)
+
+    def iter(self, items):
+        """
+        Lazily yield the matching items of any iterable, e.g. a generator of records.
+        """
+        return filter(self.match, items)
+
+    def all(self, items):
+        return list(filter(self.match, items))
@@ -1,4 +1,7 @@
 from .manager import ApiModelManager
+from .relations import resolve as resolve_relations
+from .records import compact as compact_records
+from .util import IndexedList
 
 class IpsManager(ApiModelManager):
     def __init__(self, api):
@@ -6,10 +9,42 @@ class IpsManager(ApiModelManager):
         self.model_name_plural = 'ips'
         self.is_instantaneous  = True
         self.primary_key       = 'id'
+        self.relations         = {'server': 'servers'}
         super().__init__(api)
 
-    def list_all(self, *args, **kwargs): return super().list_all(*args, **kwargs)
-    def read(self, *args, **kwargs):     return super().read(*args, **kwargs)
+    def list_all(self, embed=[], resolve=[], indexed=False, compact=False):
+        # Served from the reference tier (see opalstack.reference.ReferenceData) unless embeds are asked for
+        if embed or not self.api.reference.ttl: return super().list_all(embed, resolve, indexed, compact)
+        ips = resolve_relations(self, self.api.reference.ips(), resolve)
+        if compact: ips = compact_records(ips, self.model_name)
+        return IndexedList(ips) if indexed else ips
+
+    def read(self, uuid, embed=[], resolve=[]):
+        if embed or not self.api.reference.ttl: return super().read(uuid, embed, resolve)
+        ip = self.api.reference.ip(uuid)
+        return resolve_relations(self, [ip], resolve)[0] if ip is not None else super().read(uuid, embed, resolve)
+
+    def for_server(self, server_id):
+        """
+        Return all ips of the given server.
+        """
+        return self.api.reference.ips_for_server(server_id)
+
+    def primary_for(self, server_id):
+        """
+        Return the primary ip of the given server, or None.
+        """
+        return self.api.reference.primary_ip(server_id)
+
+    def is_local(self):
+        if not self.api.reference.ttl: return super().is_local()
+        return self.api.reference.is_fresh()
+
+    def refresh(self):
+        """
+        Refetch the reference data (servers and ips) now.
+        """
+        self.api.reference.refresh()
 
     def check_equals(self, a, b):
         return ( a['id'] == b['id'] )
@@ -19,3 +54,12 @@ class IpsManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return False
+
+    def equals_key(self, item):
+        return ( item['id'], )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return None
@@ -1,8 +1,23 @@
 import logging
+import contextlib
+
+from . import tracing
+from .pending import PendingResult, PendingItem
+from .bulk import run_bulk
+from .cache import MISS
+from .relations import resolve as resolve_relations
+from .records import compact as compact_records, Compactor
+from .query import plan as plan_query
+from .util import filt, one, one_or_none, IndexedList
 
 log = logging.getLogger(__name__)
 
 class ApiModelManager():
+    # Fields which update() can change in place; see check_updates()
+    mutable_fields = ()
+    # Foreign-key fields, mapped to the name of the Api manager they refer to; see list_all(resolve=...)
+    relations = {}
+
     def __init__(self, api):
         self.api = api
 
@@ -10,33 +25,141 @@ class ApiModelManager():
         if type(self.model_name)        is not str: raise NotImplementedError()
         if type(self.model_name_plural) is not str: raise NotImplementedError()
 
-    def list_all(self, embed=[]):
+    def list_all(self, embed=[], resolve=[], indexed=False, compact=False):
+        """
+        List all items. `embed` asks the API to inline related objects;
+        `resolve` joins them on the client instead (see opalstack.relations.resolve()).
+        With indexed=True, returns an opalstack.util.IndexedList, for many filt() lookups against the same items.
+        With compact=True, items are opalstack.records.Record mappings rather than dicts, for large collections.
+        """
         qs = ('?embed=' + ','.join(embed)) if embed else ''
-        return self.api.http_get_result(f'/{self.model_name}/list/{qs}', ensure_status=[200])
+        items = self.cached(f'list:{",".join(sorted(embed))}', lambda: self.api.http_get_result(f'/{self.model_name}/list/{qs}', ensure_status=[200]))
+        if resolve: items = resolve_relations(self, items, resolve)
+        if compact: items = compact_records(items, self.model_name)
+        return IndexedList(items) if indexed else items
+
+    def iter_all(self, embed=[], compact=False):
+        """
+        Yield all items one at a time, decoded incrementally from the response stream
+        (see Api.http_get_iter()), so memory use stays flat however large the collection.
+        A fresh cached list_all() response is used if there is one; streamed items are not cached.
+        With compact=True, yields opalstack.records.Record mappings.
+        """
+        key = f'list:{",".join(sorted(embed))}'
+        items = MISS if self.api.cache is None else self.api.cache.get(self.api.cache_scope, self.model_name, key)
+        if items is MISS:
+            qs = ('?embed=' + ','.join(embed)) if embed else ''
+            items = self.api.http_get_iter(f'/{self.model_name}/list/{qs}', ensure_status=[200])
+        if compact: items = Compactor(self.model_name).stream(items)
+        yield from items
 
-    def read(self, uuid, embed=[]):
+    def read(self, uuid, embed=[], resolve=[]):
         qs = ('?embed=' + ','.join(embed)) if embed else ''
-        return self.api.http_get_result(f'/{self.model_name}/read/{uuid}{qs}', ensure_status=[200])
+        item = self.cached(f'read:{uuid}:{",".join(sorted(embed))}', lambda: self.api.http_get_result(f'/{self.model_name}/read/{uuid}{qs}', ensure_status=[200]))
+        return resolve_relations(self, [item], resolve)[0] if resolve else item
+
+    def query(self, keymap, embed=[]):
+        """
+        Return the items matching `keymap` (see opalstack.util.filt()), fetched with the embeds
+        and client-side joins that its dotted keypaths need, so callers need not pass them.
+        `embed` adds fields to inline regardless. See plan_query().
+        """
+        plan = self.plan_query(keymap, embed)
+        log.debug(f'Querying {self.model_name_plural} for {repr(keymap)} with {repr(plan)}')
+        return filt(self.list_all(embed=plan.embed, resolve=plan.resolve), keymap)
+
+    def query_one(self, keymap, embed=[]):
+        return one(self.query(keymap, embed))
+
+    def query_one_or_none(self, keymap, embed=[]):
+        return one_or_none(self.query(keymap, embed))
+
+    def plan_query(self, keymap, embed=[]):
+        """
+        Return the opalstack.query.QueryPlan query() would follow for `keymap`. Makes no API calls.
+        """
+        return plan_query(self, keymap, embed)
+
+    def is_local(self):
+        """
+        True iff list_all() would be answered without a request, i.e. from the Api cache.
+        """
+        cache = self.api.cache
+        return cache is not None and 'list:' in cache.fresh_keys(self.api.cache_scope, self.model_name, prefix='list:')
+
+    def index_by_id(self):
+        """
+        Return {primary key: item} for all items; the target side of relations.
+        """
+        return {item[self.primary_key]: item for item in self.list_all()}
+
+    def cached(self, key, fetch):
+        """
+        Return the Api's cached response for `key` if fresh, otherwise call `fetch()` and cache its result.
+        Without an Api cache, just calls `fetch()`.
+        """
+        cache = self.api.cache
+        if cache is None: return fetch()
+        result = cache.get(self.api.cache_scope, self.model_name, key)
+        if result is not MISS: return result
+        generation = cache.generation(self.api.cache_scope, self.model_name)
+        result = fetch()
+        cache.set(self.api.cache_scope, self.model_name, key, result, generation=generation)
+        return result
+
+    def invalidate(self):
+        """
+        Drop every cached response of this model, and keep later reads from joining in-flight ones;
+        called after each write.
+        """
+        self.api.written(self.model_name)
+        if self.api.cache is not None: self.api.cache.invalidate(self.api.cache_scope, self.model_name)
+
+    def readiness_profile(self, items):
+        """
+        Name under which the time it takes for the given items to become ready is learned
+        (see opalstack.backoff.ReadinessStats). Override when some items settle much slower than others.
+        """
+        return self.model_name
+
+    @contextlib.contextmanager
+    def operation(self, op, items=()):
+        """
+        Record one `op` call on `items` in the Api metrics (see opalstack.metrics.Metrics.operation())
+        and as a '<model_name>.<op>' tracing span, under which its requests and waits nest.
+        """
+        with self.api.metrics.operation(self.model_name, op, items):
+            with tracing.span(f'{self.model_name}.{op}', model=self.model_name, op=op, items=len(items)) as span:
+                yield span
 
     def create(self, tocreate, wait=True):
         """
         Create the given items
         If wait=True, blocks until all are ready
+        If wait=False, returns a PendingResult instead
         """
         created = []
-        if not tocreate: return created
-        log.info(f'Creating {self.model_name_plural}: {repr(tocreate)}')
-        created += self.api.http_post_result(f'/{self.model_name}/create/', tocreate, ensure_status=[200])
-        if wait and not self.is_instantaneous:
-            self.api.wait_ready(self.model_name, [item[self.primary_key] for item in created])
-        return created
+        if not tocreate: return created if wait else PendingResult.completed(created)
+        with self.operation('create', tocreate):
+            log.info(f'Creating {self.model_name_plural}: {repr(tocreate)}')
+            try:
+                created += self.api.http_post_result(f'/{self.model_name}/create/', tocreate, ensure_status=[200])
+            finally:
+                self.invalidate()
+            if not wait: return self.pending(created, profile=self.readiness_profile(tocreate))
+            if not self.is_instantaneous:
+                self.api.wait_ready(self.model_name, [item[self.primary_key] for item in created], profile=self.readiness_profile(tocreate))
+                self.invalidate()
+            return created
 
     def create_one(self, tocreate, wait=True):
         """
         Create the given item
         If wait=True, blocks until ready
+        If wait=False, returns a PendingItem instead
         """
         created = self.create([tocreate], wait=wait)
+        if not wait: return PendingItem.single(created)
         assert len(created) == 1
         return created[0]
 
@@ -44,21 +167,30 @@ class ApiModelManager():
         """
         Update the given items
         If wait=True, blocks until all are ready
+        If wait=False, returns a PendingResult instead
         """
         updated = []
-        if not toupdate: return updated
-        log.info(f'Updating {self.model_name_plural}: {repr(toupdate)}')
-        updated += self.api.http_post_result(f'/{self.model_name}/update/', toupdate, ensure_status=[200])
-        if wait and not self.is_instantaneous:
-            self.api.wait_ready(self.model_name, [item[self.primary_key] for item in updated])
-        return updated
+        if not toupdate: return updated if wait else PendingResult.completed(updated)
+        with self.operation('update', toupdate):
+            log.info(f'Updating {self.model_name_plural}: {repr(toupdate)}')
+            try:
+                updated += self.api.http_post_result(f'/{self.model_name}/update/', toupdate, ensure_status=[200], idempotent=True)
+            finally:
+                self.invalidate()
+            if not wait: return self.pending(updated, profile=self.readiness_profile(toupdate))
+            if not self.is_instantaneous:
+                self.api.wait_ready(self.model_name, [item[self.primary_key] for item in updated], profile=self.readiness_profile(toupdate))
+                self.invalidate()
+            return updated
 
     def update_one(self, toupdate, wait=True):
         """
         Update the given item
         If wait=True, blocks until ready
+        If wait=False, returns a PendingItem instead
         """
         updated = self.update([toupdate], wait=wait)
+        if not wait: return PendingItem.single(updated)
         assert len(updated) == 1
         return updated[0]
 
@@ -66,19 +198,65 @@ class ApiModelManager():
         """
         Delete the given items
         If wait=True, blocks until all are deleted
+        If wait=False, returns a PendingResult of the given items instead
         """
-        if not todelete: return
-        log.info(f'Deleting {self.model_name_plural}: {repr(todelete)}')
-        self.api.http_post_result(f'/{self.model_name}/delete/', [{self.primary_key: item[self.primary_key]} for item in todelete], ensure_status=[200])
-        if wait and not self.is_instantaneous:
-            self.api.wait_deleted(self.model_name, [item[self.primary_key] for item in todelete])
+        if not todelete: return None if wait else PendingResult.completed([])
+        with self.operation('delete', todelete):
+            log.info(f'Deleting {self.model_name_plural}: {repr(todelete)}')
+            try:
+                self.api.http_post_result(f'/{self.model_name}/delete/', [{self.primary_key: item[self.primary_key]} for item in todelete], ensure_status=[200])
+            finally:
+                self.invalidate()
+            if not wait: return self.pending(todelete, deleted=True)
+            if not self.is_instantaneous:
+                self.api.wait_deleted(self.model_name, [item[self.primary_key] for item in todelete])
+                self.invalidate()
 
     def delete_one(self, todelete, wait=True):
         """
-        Delete the given items
-        If wait=True, blocks until all are deleted
+        Delete the given item
+        If wait=True, blocks until deleted
+        If wait=False, returns a PendingItem of the given item instead
         """
-        self.delete([todelete], wait=wait)
+        deleted = self.delete([todelete], wait=wait)
+        if not wait: return PendingItem.single(deleted)
+
+    def bulk_create(self, tocreate, chunk_size=100, workers=4, wait=True):
+        """
+        Create a large number of items in concurrent chunks, isolating failures to the items that caused them.
+        Returns a BulkResult. See opalstack.bulk.run_bulk()
+        """
+        with self.operation('bulk_create', tocreate):
+            return run_bulk(self, 'create', tocreate, chunk_size=chunk_size, workers=workers, wait=wait)
+
+    def bulk_update(self, toupdate, chunk_size=100, workers=4, wait=True):
+        """
+        Update a large number of items in concurrent chunks, isolating failures to the items that caused them.
+        Returns a BulkResult. See opalstack.bulk.run_bulk()
+        """
+        with self.operation('bulk_update', toupdate):
+            return run_bulk(self, 'update', toupdate, chunk_size=chunk_size, workers=workers, wait=wait)
+
+    def bulk_delete(self, todelete, chunk_size=100, workers=4, wait=True):
+        """
+        Delete a large number of items in concurrent chunks, isolating failures to the items that caused them.
+        Returns a BulkResult. See opalstack.bulk.run_bulk()
+        """
+        with self.operation('bulk_delete', todelete):
+            return run_bulk(self, 'delete', todelete, chunk_size=chunk_size, workers=workers, wait=wait)
+
+    def pending(self, items, deleted=False, profile=None):
+        """
+        Wrap items returned by a call made with wait=False in a PendingResult.
+        Their readiness (or deletion) is tracked by the Api's background ReadinessMultiplexer,
+        together with every other pending handle.
+        """
+        if self.is_instantaneous: return PendingResult.completed(items)
+        uuids = [item[self.primary_key] for item in items]
+        future = self.api.multiplexer.watch(self.model_name, uuids, deleted=deleted, profile=profile)
+        # Responses cached while the items were settling are stale once they have
+        future.add_done_callback(lambda future: self.invalidate())
+        return PendingResult(items, future)
 
     # -- Equality, Obstruction, and Satisfaction --
     #
@@ -120,6 +298,51 @@ class ApiModelManager():
     def check_obstructs(self, existing, new): raise NotImplementedError()
     def check_satisfies(self, existing, new): raise NotImplementedError()
 
+    # -- Hash keys --
+    #
+    # Each manager also describes its stock policy with hashable keys, so that planning
+    # can bucket items instead of comparing every pair:
+    #
+    # equals_key()    check_equals(a, b)            iff equals_key(a) == equals_key(b)
+    # satisfies_key() check_satisfies(existing, new) iff satisfies_key(existing) == satisfies_key(new),
+    #                 or never if satisfies_key() returns None
+    # obstructs_key() check_obstructs(existing, new) iff obstructs_key(existing) == obstructs_key(new)
+    #                 and existing does not satisfy new, or never if obstructs_key() returns None
+    #
+    # The keys are only trusted while they are defined by the same class as the check_* method
+    # they describe. Overriding a check_* method, on a subclass or on an instance as shown above,
+    # makes planning fall back to pairwise comparison with the check_* methods.
+    #
+    def equals_key(self, item):    raise NotImplementedError()
+    def obstructs_key(self, item): raise NotImplementedError()
+    def satisfies_key(self, item): raise NotImplementedError()
+
+    def check_updates(self, existing, new):
+        """
+        True iff updating the mutable_fields of the "existing" definition would make it equal to the "new" one
+        """
+        if not self.mutable_fields: return False
+        morphed = dict(existing, **{field: new[field] for field in self.mutable_fields if field in new})
+        return self.check_equals(morphed, new)
+
+    def update_key(self, item):
+        """
+        Hashable key such that check_updates(existing, new) iff update_key(existing) == update_key(new),
+        or None if this manager does not declare one.
+        """
+        return None
+
+    def has_hash_keys(self):
+        """
+        True iff the check_* policy in effect is the one described by the *_key() methods
+        """
+        def owner(name):
+            return next(klass for klass in type(self).__mro__ if name in vars(klass))
+        for check, key in (('check_equals', 'equals_key'), ('check_obstructs', 'obstructs_key'), ('check_satisfies', 'satisfies_key')):
+            if check in vars(self) or key in vars(self): return False
+            if owner(check) is not owner(key): return False
+        return True
+
     def set_has(self, X, z):
         return any(self.check_equals(x, z) for x in X)
 
@@ -132,7 +355,7 @@ class ApiModelManager():
         if not self.set_has(X, y): X.append(y)
 
     def set_remove(self, X, y):
-        [X.remove(x) for x in X if self.check_equals(x, y)]
+        X[:] = [x for x in X if not self.check_equals(x, y)]
 
     def set_move(self, i, X, Y):
         self.set_remove(X, i)
@@ -149,10 +372,20 @@ class ApiModelManager():
             except that a new item will not replace an existing item that satisfies it.
         See also create(), delete(), and ensure(). These functions can be used to enforce state produced by this one.
         """
+        return self.plan_ensure(self.list_all(), needed, purge=purge)
+
+    def plan_ensure(self, existing, needed, purge=False):
+        """
+        Like check_ensure(), but plans against the given list of `existing` items
+        instead of fetching them. Makes no API calls.
+        Runs in near-linear time when has_hash_keys(), and compares every pair otherwise.
+        """
+        assert type(existing) is list
         assert type(needed) is list
         assert type(purge) is bool
 
-        existing = self.list_all()
+        if self.has_hash_keys():
+            return self.plan_ensure_hashed(existing, needed, purge)
 
         def is_valid(items):
             """Check that no items in a set obstruct any other members in the same set"""
@@ -164,50 +397,191 @@ class ApiModelManager():
         assert is_valid(existing)
         assert is_valid(needed)
 
-        toretain = existing[:]
+        toretain = []
         todelete = []
         tocreate = []
 
-        # Eliminate self-satisfied items
-        satisfied = []
-        for x in toretain:
-            for y in toretain:
-                if x != y and self.check_satisfies(y, x): self.set_add(satisfied, x)
-        for item in satisfied:
-            self.set_move(item, toretain, todelete)
+        # Eliminate self-satisfied items: those satisfied by an earlier existing item are redundant
+        for x in existing:
+            if any(self.check_satisfies(y, x) for y in toretain):
+                todelete.append(x)
+            else:
+                toretain.append(x)
 
         for a in needed:
             # Remove existing items if they obstruct or are obstructed by anything needed
-            for b in toretain:
-                if (    self.check_obstructs(a, b)
-                     or self.check_obstructs(b, a) ): self.set_move(b, toretain, todelete)
+            obstructing = [b for b in toretain if self.check_obstructs(a, b) or self.check_obstructs(b, a)]
+            if obstructing:
+                removed = {id(b) for b in obstructing}
+                toretain = [b for b in toretain if id(b) not in removed]
+                todelete += obstructing
 
             # Add any unsatisfied items to those which must exist
-            for b in toretain:
-                if self.check_satisfies(b, a): break
-            else:
+            if not any(self.check_satisfies(b, a) for b in toretain):
                 self.set_add(tocreate, a)
 
         # Purge removes unneeded existing items
         if purge:
-            trash = []
-            for b in toretain:
-                for a in needed:
-                    if self.check_satisfies(b, a): break
-                else:
-                    self.set_add(trash, b)
+            trash = [b for b in toretain if not any(self.check_satisfies(b, a) for a in needed)]
+            toretain = [b for b in toretain if any(self.check_satisfies(b, a) for a in needed)]
+            todelete += trash
+
+        return toretain, todelete, tocreate
+
+    def plan_ensure_hashed(self, existing, needed, purge):
+        """
+        plan_ensure() using the *_key() methods: same result, but items are bucketed by key
+        """
+        def is_valid(items):
+            """Check that no items in a set obstruct any other members in the same set"""
+            buckets = {}
+            for item in items:
+                okey = self.obstructs_key(item)
+                if okey is not None: buckets.setdefault(okey, []).append(item)
+            for bucket in buckets.values():
+                skeys = {self.satisfies_key(item) for item in bucket}
+                if len(skeys) == 1 and None not in skeys: continue
+                if any(item != bucket[0] for item in bucket): return False
+            return True
+
+        assert is_valid(existing)
+        assert is_valid(needed)
+
+        retained = {}  # id(item) -> item, for existing items still retained
+        by_okey = {}   # obstructs_key -> {id(item): item} of retained items
+        by_skey = {}   # satisfies_key -> number of retained items
+        todelete = []
+        tocreate = []
+        tocreate_keys = set()
+
+        # Eliminate self-satisfied items: those satisfied by an earlier existing item are redundant
+        for x in existing:
+            skey = self.satisfies_key(x)
+            if skey is not None and skey in by_skey:
+                todelete.append(x)
+                continue
+            retained[id(x)] = x
+            if skey is not None: by_skey[skey] = 1
+            okey = self.obstructs_key(x)
+            if okey is not None: by_okey.setdefault(okey, {})[id(x)] = x
 
-            [self.set_move(item, toretain, todelete) for item in trash]
+        def retire(b):
+            del retained[id(b)]
+            skey = self.satisfies_key(b)
+            if skey is not None: by_skey[skey] -= 1
+            okey = self.obstructs_key(b)
+            if okey is not None: del by_okey[okey][id(b)]
+            todelete.append(b)
 
+        for a in needed:
+            # Remove existing items if they obstruct or are obstructed by anything needed
+            skey = self.satisfies_key(a)
+            okey = self.obstructs_key(a)
+            if okey is not None:
+                for b in list(by_okey.get(okey, {}).values()):
+                    if skey is None or self.satisfies_key(b) != skey: retire(b)
+
+            # Add any unsatisfied items to those which must exist
+            if skey is None or not by_skey.get(skey):
+                ekey = self.equals_key(a)
+                if ekey not in tocreate_keys:
+                    tocreate_keys.add(ekey)
+                    tocreate.append(a)
+
+        # Purge removes unneeded existing items
+        if purge:
+            needed_skeys = {self.satisfies_key(a) for a in needed}
+            needed_skeys.discard(None)
+            for b in list(retained.values()):
+                if self.satisfies_key(b) not in needed_skeys: retire(b)
+
+        toretain = [x for x in existing if id(x) in retained]
         return toretain, todelete, tocreate
 
+    def check_reconcile(self, needed, purge=False):
+        """
+        Like check_ensure(), but produce four lists of operations:
+            toretain : a list of existing items that should be retained
+            todelete : a list of existing items that must be deleted
+            toupdate : a list of updates which turn existing items into needed ones
+            tocreate : a list of new items that must be created
+        An existing item which would otherwise be deleted is updated instead when that alone
+        makes it equal to an item which would otherwise be created (see check_updates()).
+        Each update only carries the primary key and the mutable_fields that change.
+        """
+        existing = self.list_all()
+        with tracing.span(f'{self.model_name}.plan', model=self.model_name, existing=len(existing), needed=len(needed)) as span:
+            plan = self.plan_reconcile(existing, needed, purge=purge)
+            span.set(retain=len(plan[0]), delete=len(plan[1]), update=len(plan[2]), create=len(plan[3]))
+        return plan
+
+    def plan_reconcile(self, existing, needed, purge=False):
+        """
+        Like check_reconcile(), but plans against the given list of `existing` items
+        instead of fetching them. Makes no API calls.
+        """
+        toretain, todelete, tocreate = self.plan_ensure(existing, needed, purge=purge)
+        if not self.mutable_fields or not todelete or not tocreate:
+            return toretain, todelete, [], tocreate
+
+        def owner(name):
+            return next(klass for klass in type(self).__mro__ if name in vars(klass))
+        hashed = ( self.has_hash_keys() and
+                   'check_updates' not in vars(self) and owner('check_updates') is ApiModelManager and
+                   'update_key' not in vars(self) and owner('update_key') is not ApiModelManager )
+
+        # Existing items waiting to be deleted, which could be morphed instead
+        if hashed:
+            candidates = {}
+            for b in todelete: candidates.setdefault(self.update_key(b), []).append(b)
+        else:
+            candidates = todelete[:]
+
+        morphed = {}  # id(b) -> the needed item that b is morphed into
+        for a in tocreate:
+            if hashed:
+                bucket = candidates.get(self.update_key(a))
+                b = bucket.pop(0) if bucket else None
+            else:
+                b = next((b for b in candidates if self.check_updates(b, a)), None)
+                if b is not None: candidates.remove(b)
+            if b is not None: morphed[id(b)] = (b, a)
+
+        toupdate = []
+        for b, a in morphed.values():
+            update = {self.primary_key: b[self.primary_key]}
+            update.update({field: a[field] for field in self.mutable_fields if field in a and a[field] != b.get(field)})
+            toupdate.append(update)
+        updated_targets = {id(a) for b, a in morphed.values()}
+        todelete = [b for b in todelete if id(b) not in morphed]
+        tocreate = [a for a in tocreate if id(a) not in updated_targets]
+        return toretain, todelete, toupdate, tocreate
+
     def ensure(self, needed, purge=False, wait=True):
         """
         Ensure the given items exist exactly as specified (modifying existing ones if necessary)
-        This MAY delete existing items and create new ones in their place!
-        If wait=True, blocks until created are ready
+        Existing items are updated in place when possible (see check_reconcile()),
+        but this MAY delete existing items and create new ones in their place!
+        Returns the created items; see reconcile() for the updated ones too.
+        If wait=True, blocks until updated and created are ready
+        If wait=False, returns a PendingResult of the created items, done once the updated are ready too
+        """
+        with self.operation('ensure', needed):
+            updated, created = self.apply_reconcile(needed, purge=purge, wait=wait)
+            if not wait: return PendingResult(created, PendingResult.gather(updated, created).future)
+            return created
+
+    def reconcile(self, needed, purge=False, wait=True):
+        """
+        Like ensure(), but return (updated, created): the items updated in place and the items created.
+        With wait=False, both are PendingResults.
         """
-        toretain, todelete, tocreate = self.check_ensure(needed, purge=purge)
+        with self.operation('reconcile', needed):
+            return self.apply_reconcile(needed, purge=purge, wait=wait)
+
+    def apply_reconcile(self, needed, purge=False, wait=True):
+        toretain, todelete, toupdate, tocreate = self.check_reconcile(needed, purge=purge)
         self.delete(todelete, wait=True)
+        updated = self.update(toupdate, wait=wait)
         created = self.create(tocreate, wait=wait)
-        return created
+        return updated, created
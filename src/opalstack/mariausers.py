@@ -6,6 +6,7 @@ class MariausersManager(ApiModelManager):
         self.model_name_plural = 'mariausers'
         self.is_instantaneous  = False
         self.primary_key       = 'id'
+        self.relations         = {'server': 'servers'}
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -26,3 +27,13 @@ class MariausersManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return self.check_equals(new, existing)
+
+    def equals_key(self, item):
+        return ( item['name'],
+                 item['server'] )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return self.equals_key(item)
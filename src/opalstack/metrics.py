@@ -0,0 +1,264 @@
+import os
+import math
+import time
+import random
+import logging
+import tempfile
+import threading
+import contextlib
+
+log = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+def endpoint(urlpath):
+    """
+    Return the (model, action) an API path addresses, e.g. ('dnsrecord', 'read')
+    for '/dnsrecord/read/<uuid>?embed=domain', so uuids and query strings do not
+    split one endpoint into many series.
+    """
+    parts = urlpath.split('?', 1)[0].strip('/').split('/')
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+class Summary():
+    def __init__(self, max_samples=1024):
+        """
+        Count, sum, min and max of every observed value, and quantiles estimated
+        from a uniform sample of at most `max_samples` of them (reservoir sampling),
+        so memory stays bounded however many values are observed.
+        """
+        self.max_samples = max_samples
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min: self.min = value
+        if self.max is None or value > self.max: self.max = value
+        if len(self.samples) < self.max_samples:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < self.max_samples: self.samples[i] = value
+
+    def quantile(self, q, ordered=None):
+        """
+        The `q` quantile (0 <= q <= 1) of the sampled values, by nearest rank; None before any value.
+        """
+        ordered = ordered if ordered is not None else sorted(self.samples)
+        if not ordered: return None
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+        result = {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max}
+        for q in QUANTILES: result[f'p{q * 100:g}'] = self.quantile(q, ordered)
+        return result
+
+class Metrics():
+    def __init__(self, prefix='opalstack', max_samples=1024):
+        """
+        Counters and summaries (latency and size distributions), each kept per set of labels.
+        Api records into its `metrics` on every request (see Api.request()):
+            requests{model, action, method, status}    : requests made; status is 'error' when no response came back
+            retries{model, action, method}             : attempts beyond the first
+            request_seconds{model, action, method}     : wall-clock time per request, retries included
+            request_bytes{model, action, method}       : encoded POST bodies
+            response_bytes{model, action, method}      : response bodies
+        and while waiting for readiness (see Api.wait_ready(), Api.wait_deleted() and PendingResult):
+            wait_rounds{model, state}                  : readiness checks made; state is 'ready' or 'deleted'
+            wait_seconds{model, state}                 : time until every item of a wait was done
+            wait_failures{model, state}                : waits which ran out of time or tries
+        and around each manager create/update/delete/ensure and bulk_* call:
+            operations{model, op}                      : calls made
+            operation_items{model, op}                 : items passed to them
+            operation_errors{model, op}                : calls which raised
+            operation_seconds{model, op}               : wall-clock time per call, waits included
+        A registry may be shared between Api objects. It is exported by snapshot(), prometheus()
+        and write_prometheus(); add_sink() passes every recorded value on as it happens.
+        """
+        self.prefix = prefix
+        self.max_samples = max_samples
+        self.counters = {}
+        self.summaries = {}
+        self.sinks = []
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        """
+        Add `amount` to the counter `name` for `labels`.
+        """
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        if self.sinks: self.emit('counter', name, amount, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        Record one `value` (seconds, bytes, ...) in the summary `name` for `labels`.
+        """
+        key = (name, label_key(labels))
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None: summary = self.summaries[key] = Summary(self.max_samples)
+            summary.observe(value)
+        if self.sinks: self.emit('summary', name, value, labels)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the seconds spent in the with block in the summary `name`, whether or not it raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextlib.contextmanager
+    def operation(self, model, op, items=()):
+        """
+        Record one manager operation on `items` (see operations, operation_items,
+        operation_errors and operation_seconds above).
+        """
+        self.count('operations', model=model, op=op)
+        if items: self.count('operation_items', len(items), model=model, op=op)
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count('operation_errors', model=model, op=op)
+            raise
+        finally:
+            self.observe('operation_seconds', time.perf_counter() - started, model=model, op=op)
+
+    def request(self, method, urlpath, status, seconds, attempts=1, sent=0, received=None):
+        """
+        Record one finished API request (see requests, retries, request_seconds,
+        request_bytes and response_bytes above).
+        """
+        model, action = endpoint(urlpath)
+        self.count('requests', model=model, action=action, method=method, status=status)
+        if attempts > 1: self.count('retries', attempts - 1, model=model, action=action, method=method)
+        self.observe('request_seconds', seconds, model=model, action=action, method=method)
+        if method == 'POST': self.observe('request_bytes', sent, model=model, action=action, method=method)
+        if received is not None: self.observe('response_bytes', received, model=model, action=action, method=method)
+
+    #
+    # -- Sinks --
+    #
+
+    def add_sink(self, sink):
+        """
+        Call `sink(kind, name, value, labels)` for every value recorded from now on,
+        where `kind` is 'counter' (`value` is the amount added) or 'summary' (`value` is the observation).
+        Sinks run on the recording thread and should be quick; an exception in one is logged and ignored.
+        """
+        with self.lock:
+            self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        with self.lock:
+            self.sinks = [s for s in self.sinks if s is not sink]
+
+    def emit(self, kind, name, value, labels):
+        for sink in self.sinks:
+            try:
+                sink(kind, name, value, labels)
+            except Exception:
+                log.exception(f'Metrics sink {sink!r} failed')
+
+    #
+    # -- Export --
+    #
+
+    def total(self, name, **labels):
+        """
+        Sum of the counter `name` over every series whose labels include `labels`,
+        e.g. total('requests', model='dnsrecord') for all dnsrecord requests.
+        """
+        wanted = set(label_key(labels))
+        with self.lock:
+            return sum(value for (n, key), value in self.counters.items() if n == name and wanted.issubset(key))
+
+    def summary(self, name, **labels):
+        """
+        Return the snapshot (count, sum, min, max, p50, p95, p99) of the summary `name`
+        with exactly `labels`, or None if nothing was observed for them.
+        """
+        with self.lock:
+            summary = self.summaries.get((name, label_key(labels)))
+            return summary.snapshot() if summary is not None else None
+
+    def snapshot(self):
+        """
+        Return a copy of everything recorded, as plain (JSON serializable) data:
+            {'counters':  {name: [{'labels': {...}, 'value': ...}, ...]},
+             'summaries': {name: [{'labels': {...}, 'count': ..., 'sum': ..., 'min': ..., 'max': ...,
+                                   'p50': ..., 'p95': ..., 'p99': ...}, ...]}}
+        """
+        result = {'counters': {}, 'summaries': {}}
+        with self.lock:
+            for (name, key), value in sorted(self.counters.items()):
+                result['counters'].setdefault(name, []).append({'labels': dict(key), 'value': value})
+            for (name, key), summary in sorted(self.summaries.items(), key=lambda item: item[0]):
+                result['summaries'].setdefault(name, []).append(dict({'labels': dict(key)}, **summary.snapshot()))
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.summaries.clear()
+
+    def prometheus(self):
+        """
+        Return everything recorded in the Prometheus text exposition format:
+        counters as <prefix>_<name>_total, summaries with their quantiles, _sum and _count.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, series in snapshot['counters'].items():
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for s in series: lines.append(f'{metric}{format_labels(s["labels"])} {format_value(s["value"])}')
+        for name, series in snapshot['summaries'].items():
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {metric} summary')
+            for s in series:
+                for q in QUANTILES:
+                    value = s[f'p{q * 100:g}']
+                    lines.append(f'{metric}{format_labels(s["labels"], quantile=f"{q:g}")} {format_value(value)}')
+                lines.append(f'{metric}_sum{format_labels(s["labels"])} {format_value(s["sum"])}')
+                lines.append(f'{metric}_count{format_labels(s["labels"])} {s["count"]}')
+        return ''.join(line + '\n' for line in lines)
+
+    def write_prometheus(self, path):
+        """
+        Write prometheus() to `path`, replacing it atomically so that a collector
+        (e.g. the node_exporter textfile collector) never reads a partial file.
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f: f.write(self.prometheus())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+def format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels: return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+def format_value(value):
+    if value is None: return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
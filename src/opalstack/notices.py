@@ -6,6 +6,7 @@ class NoticesManager(ApiModelManager):
         self.model_name_plural = 'notices'
         self.is_instantaneous  = True
         self.primary_key       = 'id'
+        self.mutable_fields    = ('content',)
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -26,3 +27,16 @@ class NoticesManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return self.check_equals(new, existing)
+
+    def equals_key(self, item):
+        return ( item['type'],
+                 item['content'] )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return self.equals_key(item)
+
+    def update_key(self, item):
+        return ( item['type'], )
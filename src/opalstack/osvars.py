@@ -6,6 +6,8 @@ class OSVarsManager(ApiModelManager):
         self.model_name_plural = 'osvars'
         self.is_instantaneous  = False
         self.primary_key       = 'id'
+        self.mutable_fields    = ('content', 'osusers')
+        self.relations         = {'osusers': 'osusers'}
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -28,3 +30,19 @@ class OSVarsManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return self.check_equals(new, existing)
+
+    def equals_key(self, item):
+        return ( item['name'],
+                 item['content'],
+                 item['global'],
+                 tuple(sorted(item['osusers'])) )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return self.equals_key(item)
+
+    def update_key(self, item):
+        return ( item['name'],
+                 item['global'] )
@@ -0,0 +1,203 @@
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+
+from . import tracing
+
+log = logging.getLogger(__name__)
+
+class Pending():
+    """
+    Tracks whether the server has finished with the items of a wait=False call:
+    result() blocks until it has, and the handle can be awaited.
+    """
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """
+        Block until all items are ready (or deleted), then return them.
+        Raises RuntimeError if they never got there, or concurrent.futures.TimeoutError
+        if `timeout` seconds pass first.
+        """
+        self.future.result(timeout)
+        return self
+
+    def exception(self, timeout=None):
+        return self.future.exception(timeout)
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(lambda future: fn(self))
+
+    def __await__(self):
+        yield from asyncio.wrap_future(self.future).__await__()
+        return self
+
+class PendingResult(Pending, list):
+    def __init__(self, items, future):
+        """
+        The items returned by create(), update() or delete() called with wait=False.
+        This is a plain list of those items, which is also a Pending handle.
+        """
+        super().__init__(items)
+        self.future = future
+
+    @classmethod
+    def completed(cls, items):
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return cls(items, future)
+
+    @classmethod
+    def gather(cls, *results):
+        """
+        Combine several PendingResults into one holding all of their items,
+        which is done once all of them are.
+        """
+        future = concurrent.futures.Future()
+        remaining = [len(results)]
+        lock = threading.Lock()
+        def on_done(done):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+                if future.done(): return
+                if done.cancelled():
+                    future.cancel()
+                elif done.exception() is not None:
+                    future.set_exception(done.exception())
+                elif last:
+                    future.set_result(None)
+        gathered = cls([item for result in results for item in result], future)
+        if not results: future.set_result(None)
+        for result in results: result.future.add_done_callback(on_done)
+        return gathered
+
+class PendingItem(Pending, dict):
+    def __init__(self, item, future):
+        """
+        The item returned by create_one(), update_one() or delete_one() called with wait=False.
+        This is a plain dict of that item, which is also a Pending handle.
+        """
+        super().__init__(item)
+        self.future = future
+
+    @classmethod
+    def single(cls, result):
+        """
+        The one item of the PendingResult `result`, tracking the same future.
+        """
+        assert len(result) == 1
+        return cls(result[0], result.future)
+
+class Watch():
+    def __init__(self, model_name, uuids, deleted, profile, backoff):
+        self.model_name = model_name
+        self.pending_uuids = list(uuids)
+        self.deleted = deleted
+        self.profile = profile
+        self.delays = backoff.delays()
+        self.started = time.monotonic()
+        self.next_at = self.started + next(self.delays)
+        self.future = concurrent.futures.Future()
+
+class ReadinessMultiplexer():
+    def __init__(self, api):
+        """
+        A single background thread that polls readiness for every pending handle, of every model.
+        Each round, the due uuids of all handles on the same model are checked together with
+        one batched Api.pending_ready() or Api.pending_deleted() call.
+        Each handle keeps its own pacing, as in Api.wait_ready().
+        """
+        self.api = api
+        self.watches = []
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def watch(self, model_name, uuids, deleted=False, profile=None):
+        """
+        Start tracking `uuids` and return a concurrent.futures.Future
+        resolved once all of them are ready (or, if `deleted`, gone).
+        """
+        if profile is None: profile = f'{model_name}:deleted' if deleted else model_name
+        watch = Watch(model_name, uuids, deleted, profile, self.api.wait_backoff(profile))
+        if not watch.pending_uuids:
+            watch.future.set_result(None)
+            return watch.future
+        with self.cond:
+            if self.stopped: raise RuntimeError('ReadinessMultiplexer is stopped')
+            self.watches.append(watch)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='opalstack-readiness', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return watch.future
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.thread is not None: self.thread.join()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    now = time.monotonic()
+                    due = [watch for watch in self.watches if watch.next_at <= now]
+                    if due: break
+                    wake_at = min((watch.next_at for watch in self.watches), default=None)
+                    self.cond.wait(None if wake_at is None else wake_at - now)
+                if self.stopped:
+                    for watch in self.watches: watch.future.cancel()
+                    return
+            groups = {}
+            for watch in due:
+                groups.setdefault((watch.model_name, watch.deleted), []).append(watch)
+            for (model_name, deleted), watches in groups.items():
+                self.poll(model_name, deleted, watches)
+
+    def poll(self, model_name, deleted, watches):
+        uuids = list(dict.fromkeys(uuid for watch in watches for uuid in watch.pending_uuids))
+        state = 'deleted' if deleted else 'ready'
+        log.debug(f'Checking {state} for {len(watches)} pending {model_name} handle(s)')
+        self.api.metrics.count('wait_rounds', model=model_name, state=state)
+        try:
+            # Rounds run on the polling thread, so their spans are roots rather than children of a waiting operation
+            with tracing.span('wait_round', model=model_name, state=state, handles=len(watches), pending=len(uuids)) as span:
+                if deleted:
+                    still_pending = set(self.api.pending_deleted(model_name, uuids))
+                else:
+                    still_pending = set(self.api.pending_ready(model_name, uuids))
+                span.set(remaining=len(still_pending))
+        except Exception as e:
+            self.finish(watches, exception=e)
+            return
+        now = time.monotonic()
+        finished = []
+        for watch in watches:
+            watch.pending_uuids = [uuid for uuid in watch.pending_uuids if uuid in still_pending]
+            if not watch.pending_uuids:
+                self.api.readiness.record(watch.profile, now - watch.started)
+                self.api.metrics.observe('wait_seconds', now - watch.started, model=model_name, state=state)
+                finished.append(watch)
+                continue
+            try:
+                watch.next_at = now + next(watch.delays)
+            except StopIteration:
+                self.api.metrics.count('wait_failures', model=model_name, state=state)
+                self.finish([watch], exception=RuntimeError(f'{model_name} {repr(watch.pending_uuids)} never became {state}'))
+        self.finish(finished)
+
+    def finish(self, watches, exception=None):
+        with self.cond:
+            for watch in watches:
+                if watch in self.watches: self.watches.remove(watch)
+        for watch in watches:
+            if exception is None:
+                watch.future.set_result(None)
+            else:
+                watch.future.set_exception(exception)
@@ -0,0 +1,72 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+class QueryPlan():
+    def __init__(self, embed, resolve):
+        """
+        How manager.query() fetches the items a keymap is matched against:
+            embed   : fields for the API to inline, i.e. list_all(embed=...)
+            resolve : relation paths joined on the client afterwards, i.e. list_all(resolve=...)
+        """
+        self.embed = embed
+        self.resolve = resolve
+
+    def __repr__(self):
+        return f'QueryPlan(embed={self.embed!r}, resolve={self.resolve!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, QueryPlan) and (self.embed, self.resolve) == (other.embed, other.resolve)
+
+def keypath_fields(manager, keymap, sep='.'):
+    """
+    Split the nested keypaths of `keymap` into the top-level fields they go through,
+    and the deeper relation paths below those, e.g. for apps, {'osuser.server.hostname': ...}
+    gives (['osuser'], ['osuser.server']).
+    """
+    fields = []
+    paths = []
+    for keypath in keymap:
+        keys = keypath.split(sep)[:-1]
+        if not keys: continue
+        if keys[0] not in fields: fields.append(keys[0])
+        target = manager
+        for depth, key in enumerate(keys):
+            target_name = target.relations.get(key)
+            if target_name is None: break
+            path = '.'.join(keys[:depth + 1])
+            if depth and path not in paths: paths.append(path)
+            target = getattr(manager.api, target_name)
+    return fields, paths
+
+def cached_superset(manager, embed):
+    """
+    Return the smallest embed list, covering all of `embed`, of a fresh cached list_all() response
+    of `manager`, or None.
+    """
+    cache = manager.api.cache
+    if cache is None: return None
+    candidates = []
+    for key in cache.fresh_keys(manager.api.cache_scope, manager.model_name, prefix='list:'):
+        cached_embed = [field for field in key[len('list:'):].split(',') if field]
+        if set(embed) <= set(cached_embed): candidates.append(cached_embed)
+    return min(candidates, key=len) if candidates else None
+
+def plan(manager, keymap, embed=[], sep='.'):
+    """
+    Work out the cheapest single fetch of `manager`'s items that filt(items, keymap) can be matched against:
+        - Relations whose target collection is already at hand (see ApiModelManager.is_local())
+          are joined on the client, so the API does not inline them.
+        - Any other field a keypath goes through is embedded, along with the given `embed`.
+        - A fresh cached response embedding more than that is reused rather than fetching afresh.
+        - Relations below those fields (e.g. 'osuser.server') are joined on the client.
+    """
+    fields, paths = keypath_fields(manager, keymap, sep)
+    local = [field for field in fields if field not in embed and field in manager.relations
+             and getattr(manager.api, manager.relations[field]).is_local()]
+    needed = sorted(set(embed) | {field for field in fields if field not in local})
+    superset = cached_superset(manager, needed)
+    if superset is not None and len(superset) > len(needed):
+        log.debug(f'Reusing cached {manager.model_name_plural} embedding {superset} for {needed}')
+        needed = sorted(superset)
+    return QueryPlan(needed, [field for field in local if field not in needed] + paths)
@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+class TokenBucket():
+    def __init__(self, rate, burst=None):
+        """
+        Allows `rate` requests per second on average, and up to `burst` (by default, `rate`) at once.
+        Callers which find the bucket empty reserve their token and sleep until it is due,
+        so waiting callers are served in order, without waking up to compete.
+        """
+        self.rate = float(rate)
+        self.burst = float(rate if burst is None else burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Take `tokens` and return how many seconds to wait before using them.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now > self.updated:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+            self.tokens -= tokens
+            return max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        Block until `tokens` may be used. Returns the time spent waiting.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0: time.sleep(wait)
+        return wait
+
+    def hold(self, seconds):
+        """
+        Hand out nothing for the next `seconds` (e.g. after the server asked us to back off),
+        then resume at the steady rate, without a burst.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now > self.updated:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = max(self.updated, now + seconds)
+            self.tokens = min(self.tokens, 1.0)
+
+class RateLimiter():
+    def __init__(self, read_rate=None, mutate_rate=None, read_burst=None, mutate_burst=None):
+        """
+        Client-side rate limits for API requests, one TokenBucket per endpoint class:
+            read   : GET requests, including readiness polling
+            mutate : POST requests (create, update, delete, ...)
+        A rate of None leaves that class unlimited.
+        Every request of every Api given this limiter draws from the same buckets,
+        so one limiter may be shared by all threads and Api objects of a process.
+        """
+        self.buckets = {
+            'read':   None if read_rate is None else TokenBucket(read_rate, read_burst),
+            'mutate': None if mutate_rate is None else TokenBucket(mutate_rate, mutate_burst),
+        }
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def endpoint_class(method):
+        return 'read' if method == 'GET' else 'mutate'
+
+    def acquire(self, method):
+        """
+        Block until a request with `method` may be sent.
+        """
+        endpoint_class = self.endpoint_class(method)
+        bucket = self.buckets[endpoint_class]
+        if bucket is None: return 0.0
+        waited = bucket.acquire()
+        with self.lock:
+            self.stats[f'{endpoint_class}:requests'] = self.stats.get(f'{endpoint_class}:requests', 0) + 1
+            if waited > 0:
+                self.stats[f'{endpoint_class}:throttled'] = self.stats.get(f'{endpoint_class}:throttled', 0) + 1
+                self.stats[f'{endpoint_class}:wait_seconds'] = self.stats.get(f'{endpoint_class}:wait_seconds', 0.0) + waited
+        return waited
+
+    def hold(self, method, seconds):
+        """
+        The server rate-limited a request with `method`: pause its whole endpoint class
+        for `seconds`, for every sharer, rather than letting each thread find out on its own.
+        """
+        bucket = self.buckets[self.endpoint_class(method)]
+        if bucket is None: return
+        log.warning(f'Rate limited, holding {self.endpoint_class(method)} requests for {seconds:.2f}s')
+        bucket.hold(seconds)
+
+    def snapshot(self):
+        """
+        Return a copy of the counters, per endpoint class:
+            <class>:requests     : requests which drew a token
+            <class>:throttled    : of those, requests which had to wait
+            <class>:wait_seconds : total time spent waiting
+        """
+        with self.lock:
+            return dict(self.stats)
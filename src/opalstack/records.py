@@ -0,0 +1,190 @@
+import operator
+import collections.abc
+
+#
+# -- Compact records --
+#
+# A Record stores the values of one item in slots, in the order of a key schema shared by every
+# record with the same keys, instead of a dict per item. Embedded objects which are identical
+# across items (e.g. the same server inlined into thousands of osusers) are stored once, and
+# short repeated strings (types, states, ids of related items) are shared too.
+#
+# Records behave as mutable mappings: item['name'], item.get(), `in`, keys()/items(), dict(item),
+# comparison with dicts, and assignment of new keys all work. They are not dicts, though:
+# isinstance(item, dict) is False and json.dumps() needs default=dict. Shared embedded objects
+# are one object, so changing one changes it for every item referring to it.
+#
+
+class Record(collections.abc.MutableMapping):
+    __slots__ = ('_extra',)
+    # Set on each schema class by record_class()
+    _keys = ()
+    _getters = {}
+    _slots = {}
+
+    def __init__(self, values=(), extra=None):
+        for slot, value in zip(self._slots.values(), values):
+            setattr(self, slot, value)
+        self._extra = extra
+
+    def __getitem__(self, key):
+        getter = self._getters.get(key)
+        if getter is not None:
+            try:
+                return getter(self)
+            except AttributeError:  # Deleted
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra: return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        slot = self._slots.get(key)
+        if slot is not None: return setattr(self, slot, value)
+        if self._extra is None: self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self._slots.get(key)
+        if slot is not None and hasattr(self, slot): return delattr(self, slot)
+        if self._extra is not None and key in self._extra: return self._extra.__delitem__(key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key, slot in self._slots.items():
+            if hasattr(self, slot): yield key
+        if self._extra: yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        slot = self._slots.get(key)
+        if slot is not None: return hasattr(self, slot)
+        return self._extra is not None and key in self._extra
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    def __reduce__(self):
+        slots = self._slots.values()
+        return (rebuild, (type(self).__name__, self._keys, [getattr(self, slot, MISSING) for slot in slots], self._extra))
+
+class Missing():
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = Missing()
+
+record_classes = {}
+
+def record_class(name, keys):
+    """
+    Return the Record class for items with exactly `keys`, in that order, creating it on first use.
+    """
+    klass = record_classes.get((name, keys))
+    if klass is None:
+        slots = {key: f'_{i}' for i, key in enumerate(keys)}
+        klass = record_classes[(name, keys)] = type(name, (Record,), {
+            '__slots__': tuple(slots.values()),
+            '_keys': keys,
+            '_slots': slots,
+            '_getters': {key: operator.attrgetter(slot) for key, slot in slots.items()},
+        })
+    return klass
+
+def rebuild(name, keys, values, extra):
+    record = record_class(name, keys)(extra=extra)
+    for slot, value in zip(record._slots.values(), values):
+        if value is not MISSING: setattr(record, slot, value)
+    return record
+
+def freeze(value):
+    """
+    Hashable key of a decoded JSON value, telling apart values that merely compare equal (e.g. 1 and True).
+    """
+    kind = type(value)
+    if kind is str: return value
+    if kind is dict or isinstance(value, collections.abc.Mapping):
+        return (dict, tuple(sorted([(k, freeze(v)) for k, v in value.items()])))
+    if kind is list: return (list, tuple([freeze(v) for v in value]))
+    return (kind, value)
+
+class Compactor():
+    def __init__(self, model_name='record', max_string=64):
+        """
+        Converts decoded items to Records, sharing identical embedded objects and repeated strings
+        (up to `max_string` characters) between everything it converts.
+        Rows are named after `model_name`, e.g. OsuserRecord, and embedded objects after
+        the key holding them, e.g. ServerRecord.
+        """
+        self.row_name = record_name(model_name)
+        self.max_string = max_string
+        self.strings = {}
+        self.embedded = {}
+        self.converted = {}
+
+    def compact(self, item):
+        """
+        Return `item` (a dict) as a Record.
+        """
+        return self.record(self.row_name, item)
+
+    def stream(self, items, max_strings=1 << 16):
+        """
+        Lazily compact the items of any iterable. Only embedded objects are remembered between items,
+        and the table of shared strings is restarted once it holds `max_strings`, so memory stays
+        bounded when the caller does not keep the records.
+        """
+        for item in items:
+            yield self.compact(item)
+            self.converted.clear()
+            if len(self.strings) > max_strings: self.strings = {}
+
+    def convert(self, value, name):
+        kind = type(value)
+        if kind is str:
+            return self.strings.setdefault(value, value) if len(value) <= self.max_string else value
+        if kind is list:
+            return [self.convert(v, name) for v in value]
+        if kind is not dict:
+            return value
+        # The same embedded object (e.g. after resolve=...) is converted once,
+        # and identical ones are shared
+        converted = self.converted.get(id(value))
+        if converted is not None and converted[0] is value: return converted[1]
+        key = freeze(value)
+        record = self.embedded.get(key)
+        if record is None: record = self.embedded[key] = self.record(record_name(name), value)
+        self.converted[id(value)] = (value, record)
+        return record
+
+    def record(self, name, value):
+        strings = self.strings
+        max_string = self.max_string
+        values = []
+        for k, v in value.items():
+            kind = type(v)
+            if kind is str:
+                if len(v) <= max_string: v = strings.setdefault(v, v)
+            elif kind is dict or kind is list:
+                v = self.convert(v, k)
+            values.append(v)
+        return record_class(name, tuple([strings.setdefault(k, k) for k in value]))(values)
+
+def record_name(name):
+    """
+    Class name for records of `name`, e.g. 'WebServersRecord' for 'web_servers';
+    'EmbeddedRecord' for keys which make no name, such as ids.
+    """
+    if not str(name).isidentifier(): return 'EmbeddedRecord'
+    return ''.join(word[:1].upper() + word[1:] for word in str(name).split('_')) + 'Record'
+
+def compact(items, model_name='record'):
+    """
+    Return `items` (a list of dicts, such as a list_all() result) as a list of Records; see Compactor.
+    """
+    compactor = Compactor(model_name)
+    return [compactor.compact(item) for item in items]
@@ -0,0 +1,101 @@
+import copy
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+class ReferenceIndexes():
+    def __init__(self, servers, ips):
+        """
+        Lookup tables built once per fetch of the servers and ips collections.
+            servers                 : the servers list/ response, {'web_servers': [...], 'imap_servers': [...], ...}
+            ips                     : the ips list/ response
+            server_by_id            : {server id: server}
+            server_by_hostname      : {(kind, hostname): server}, where kind is 'web', 'imap', 'smtp', ...
+            ip_by_id                : {ip id: ip}
+            ips_by_server           : {server id: [ip, ...]}
+            primary_ip_by_server    : {server id: the server's primary ip}
+        """
+        self.servers = servers
+        self.ips = ips
+        self.server_by_id = {}
+        self.server_by_hostname = {}
+        for group, members in servers.items():
+            kind = group[:-len('_servers')] if group.endswith('_servers') else group
+            for server in members:
+                self.server_by_id[server['id']] = server
+                self.server_by_hostname.setdefault((kind, server['hostname']), server)
+        self.ip_by_id = {ip['id']: ip for ip in ips}
+        self.ips_by_server = {}
+        self.primary_ip_by_server = {}
+        for ip in ips:
+            self.ips_by_server.setdefault(ip['server'], []).append(ip)
+            if ip.get('primary'): self.primary_ip_by_server.setdefault(ip['server'], ip)
+
+class ReferenceData():
+    def __init__(self, api, ttl=3600.0):
+        """
+        Long-lived tier for the reference collections (servers and ips), which almost never change.
+        Both are fetched together on first use, then served from memory with prebuilt indexes
+        for `ttl` seconds, or until refresh() is called. A ttl of 0 disables the tier.
+        Lookups return copies, so callers may modify them freely.
+        """
+        self.api = api
+        self.ttl = ttl
+        self.indexes = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Refetch servers and ips now and rebuild the indexes.
+        """
+        with self.lock:
+            self.load()
+        return self.indexes
+
+    def load(self):
+        log.debug('Loading reference data (servers, ips)')
+        servers = self.api.http_get_result('/server/list/', ensure_status=[200])
+        ips = self.api.http_get_result('/ip/list/', ensure_status=[200])
+        self.indexes = ReferenceIndexes(servers, ips)
+        self.loaded_at = time.monotonic()
+
+    def is_fresh(self):
+        """
+        True iff the indexes are loaded and younger than `ttl`, so lookups make no request.
+        """
+        return self.indexes is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def current(self):
+        """
+        Return the ReferenceIndexes, fetching them first if missing or older than `ttl`.
+        """
+        indexes, loaded_at = self.indexes, self.loaded_at
+        if indexes is not None and time.monotonic() - loaded_at < self.ttl: return indexes
+        with self.lock:
+            # Another thread may have loaded them while we waited
+            if self.indexes is None or time.monotonic() - self.loaded_at >= self.ttl: self.load()
+            return self.indexes
+
+    def servers(self):
+        return copy.deepcopy(self.current().servers)
+
+    def ips(self):
+        return copy.deepcopy(self.current().ips)
+
+    def server(self, server_id):
+        return copy.deepcopy(self.current().server_by_id.get(server_id))
+
+    def server_by_hostname(self, hostname, kind='web'):
+        return copy.deepcopy(self.current().server_by_hostname.get((kind, hostname)))
+
+    def ip(self, ip_id):
+        return copy.deepcopy(self.current().ip_by_id.get(ip_id))
+
+    def ips_for_server(self, server_id):
+        return copy.deepcopy(self.current().ips_by_server.get(server_id, []))
+
+    def primary_ip(self, server_id):
+        return copy.deepcopy(self.current().primary_ip_by_server.get(server_id))
@@ -0,0 +1,47 @@
+import logging
+import collections.abc
+
+log = logging.getLogger(__name__)
+
+def split_paths(paths):
+    """
+    Group relation paths by their first field: ['osuser', 'osuser.server', 'domain']
+    becomes {'osuser': ['server'], 'domain': []}.
+    """
+    groups = {}
+    for path in paths:
+        field, _, rest = path.partition('.')
+        groups.setdefault(field, [])
+        if rest: groups[field].append(rest)
+    return groups
+
+def resolve(manager, items, paths):
+    """
+    Replace foreign-key ids in `items` (modified in place, and returned) with the items they refer to,
+    joined on the client against the target manager's collection, as declared in `manager.relations`.
+    Each path names a relation field, optionally followed by fields of the target to resolve in turn,
+    e.g. ['server'] for osusers, or ['osuser', 'osuser.server'] for apps.
+    List-valued fields (e.g. a site's domains) have each of their ids replaced.
+    Ids with no matching target are left as they are, and objects already embedded by the API
+    (see list_all(embed=...)) only have the deeper paths resolved within them.
+    Rows referring to the same target share one object.
+    """
+    for field, subpaths in split_paths(paths).items():
+        target_name = manager.relations.get(field)
+        if target_name is None: raise ValueError(f'{manager.model_name} has no relation {field}')
+        target = getattr(manager.api, target_name)
+        values = [v for item in items for v in (item.get(field) if isinstance(item.get(field), list) else [item.get(field)])]
+        # Objects the API already embedded are kept; only their own relations are resolved
+        embedded = [v for v in values if isinstance(v, collections.abc.Mapping)]
+        if subpaths and embedded: resolve(target, embedded, subpaths)
+        if not any(isinstance(v, str) for v in values): continue
+        index = target.index_by_id()
+        if subpaths: resolve(target, list(index.values()), subpaths)
+        log.debug(f'Resolving {manager.model_name}.{field} against {len(index)} {target.model_name_plural}')
+        for item in items:
+            value = item.get(field)
+            if isinstance(value, list):
+                item[field] = [index.get(v, v) if isinstance(v, str) else v for v in value]
+            elif isinstance(value, str) and value in index:
+                item[field] = index[value]
+    return items
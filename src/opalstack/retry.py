@@ -0,0 +1,128 @@
+import time
+import logging
+import threading
+import email.utils
+
+import requests
+
+from .backoff import Backoff
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+class RetryPolicy():
+    def __init__(self, retries=4, base=0.5, factor=2.0, cap=30.0, jitter=0.25, max_elapsed=120.0,
+                 statuses=RETRY_STATUSES, errors=RETRY_ERRORS, respect_retry_after=True):
+        """
+        When and how Api.request() retries a failed request.
+            retries             : at most this many retries per request (0 disables retrying)
+            base, factor, cap,
+            jitter              : pauses between attempts, as in opalstack.backoff.Backoff
+            max_elapsed         : give up once this many seconds have passed since the first attempt; None for no limit
+            statuses            : response statuses worth retrying
+            errors              : exception classes worth retrying: those of a request which may not have
+                                  reached the server, or whose answer was cut off (not e.g. an invalid URL)
+            respect_retry_after : never retry sooner than a Retry-After header asks
+        A 429 was rejected before being processed, so it is retried for any request.
+        Other statuses and connection errors are only retried for idempotent requests
+        (GET, and POSTs flagged idempotent such as updates), since a create may already have happened.
+        Counts of what was retried are kept in `stats` (see snapshot()); a policy may be shared between Api objects.
+        """
+        self.retries = retries
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+        self.max_elapsed = max_elapsed
+        self.statuses = statuses
+        self.errors = errors
+        self.respect_retry_after = respect_retry_after
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def snapshot(self):
+        """
+        Return a copy of the counters:
+            retries            : retries performed
+            retries:<reason>   : retries per status code, or per exception class
+            retried_requests   : requests which needed at least one retry
+            recovered_requests : of those, requests which eventually succeeded
+            gave_up            : requests still failing when the retries or the budget ran out
+            retry_wait_seconds : total time spent pausing before retries
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def reason(self, resp, error, idempotent):
+        """
+        Return why the attempt should be retried, or None if it should not.
+        """
+        if error is not None:
+            return type(error).__name__ if idempotent and isinstance(error, self.errors) else None
+        if resp.status_code not in self.statuses: return None
+        if resp.status_code == 429 or idempotent: return str(resp.status_code)
+        return None
+
+    def retry_after(self, resp):
+        """
+        Seconds the server asked us to wait, or None.
+        """
+        if resp is None or not self.respect_retry_after: return None
+        value = resp.headers.get('Retry-After')
+        if not value: return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+    def call(self, send, idempotent=True, describe='request'):
+        """
+        Call `send()`, which performs one attempt and returns a requests.Response,
+        retrying as described above. Returns the last response, or raises the last
+        connection error if no response came back.
+        """
+        backoff = Backoff(initial=0.0, base=self.base, factor=self.factor, cap=self.cap, jitter=self.jitter,
+                          timeout=self.max_elapsed, tries=self.retries + 1)
+        delays = backoff.delays()
+        next(delays)
+        started = time.monotonic()
+        retried = False
+        while True:
+            try:
+                resp, error = send(), None
+            except requests.RequestException as e:
+                resp, error = None, e
+            reason = self.reason(resp, error, idempotent)
+            if reason is None: break
+            pause = next(delays, None)
+            retry_after = self.retry_after(resp)
+            if retry_after is not None and pause is not None:
+                if self.max_elapsed is not None and time.monotonic() - started + retry_after > self.max_elapsed:
+                    pause = None
+                else:
+                    pause = max(pause, retry_after)
+            if pause is None:
+                log.warning(f'Giving up on {describe} after {reason}')
+                self.count('gave_up')
+                break
+            log.warning(f'Retrying {describe} in {pause:.2f}s after {reason}')
+            self.count('retries')
+            self.count(f'retries:{reason}')
+            self.count('retry_wait_seconds', pause)
+            if not retried: self.count('retried_requests')
+            retried = True
+            time.sleep(pause)
+        if retried and reason is None: self.count('recovered_requests')
+        if error is not None: raise error
+        return resp
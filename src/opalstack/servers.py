@@ -8,8 +8,36 @@ class ServersManager(ApiModelManager):
         self.primary_key       = 'id'
         super().__init__(api)
 
-    def list_all(self, *args, **kwargs): return super().list_all(*args, **kwargs)
-    def read(self, *args, **kwargs):     return super().read(*args, **kwargs)
+    def list_all(self, embed=[]):
+        # Served from the reference tier (see opalstack.reference.ReferenceData) unless embeds are asked for
+        if embed or not self.api.reference.ttl: return super().list_all(embed)
+        return self.api.reference.servers()
+
+    def read(self, uuid, embed=[]):
+        if embed or not self.api.reference.ttl: return super().read(uuid, embed)
+        server = self.api.reference.server(uuid)
+        return server if server is not None else super().read(uuid, embed)
+
+    def index_by_id(self):
+        if not self.api.reference.ttl:
+            return {server['id']: server for group in super().list_all().values() for server in group}
+        return {server['id']: server for group in self.api.reference.servers().values() for server in group}
+
+    def by_hostname(self, hostname, kind='web'):
+        """
+        Return the server of the given kind ('web', 'imap' or 'smtp') with `hostname`, or None.
+        """
+        return self.api.reference.server_by_hostname(hostname, kind)
+
+    def is_local(self):
+        if not self.api.reference.ttl: return super().is_local()
+        return self.api.reference.is_fresh()
+
+    def refresh(self):
+        """
+        Refetch the reference data (servers and ips) now.
+        """
+        self.api.reference.refresh()
 
     def check_equals(self, a, b):
         return ( a['id'] == b['id'] )
@@ -19,3 +47,12 @@ class ServersManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return False
+
+    def equals_key(self, item):
+        return ( item['id'], )
+
+    def obstructs_key(self, item):
+        return None
+
+    def satisfies_key(self, item):
+        return None
@@ -0,0 +1,61 @@
+import copy
+import logging
+import threading
+import concurrent.futures
+
+log = logging.getLogger(__name__)
+
+class SingleFlight():
+    def __init__(self):
+        """
+        Coalesces concurrent identical calls: while a call for some key is in flight,
+        later callers with the same key wait for it and share its outcome instead of
+        making their own. Calls made after it finished start afresh.
+        """
+        self.inflight = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Return `fn()`, or a copy of the result of the identical call already in flight for `key`.
+        An exception raised by that call is raised to every caller sharing it.
+        """
+        with self.lock:
+            entry = self.inflight.get(key)
+            leader = entry is None
+            if leader:
+                entry = self.inflight[key] = [concurrent.futures.Future(), 0]
+                self.stats['calls'] = self.stats.get('calls', 0) + 1
+            else:
+                entry[1] += 1
+                self.stats['coalesced'] = self.stats.get('coalesced', 0) + 1
+        future = entry[0]
+        if not leader:
+            log.debug(f'Joining in-flight call for {key}')
+            return copy.deepcopy(future.result())
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key)
+            future.set_exception(e)
+            raise
+        # Followers copy from a private copy, taken before the leader can change its result
+        future.set_result(copy.deepcopy(result) if self.finish(key) else result)
+        return result
+
+    def finish(self, key):
+        """
+        Stop sharing the call for `key`; return the number of callers which joined it.
+        """
+        with self.lock:
+            return self.inflight.pop(key)[1]
+
+    def snapshot(self):
+        """
+        Return a copy of the counters:
+            calls     : calls actually made
+            coalesced : calls which shared another's outcome instead
+        """
+        with self.lock:
+            return dict(self.stats)
@@ -6,6 +6,7 @@ class SitesManager(ApiModelManager):
         self.model_name_plural = 'sites'
         self.is_instantaneous  = False
         self.primary_key       = 'id'
+        self.relations         = {'server': 'servers', 'ip4': 'ips', 'domains': 'domains'}
         super().__init__(api)
 
     def list_all(self, *args, **kwargs):   return super().list_all(*args, **kwargs)
@@ -17,6 +18,11 @@ class SitesManager(ApiModelManager):
     def delete(self, *args, **kwargs):     return super().delete(*args, **kwargs)
     def delete_one(self, *args, **kwargs): return super().delete_one(*args, **kwargs)
 
+    def readiness_profile(self, items):
+        # Issuing a Let's Encrypt certificate takes far longer than anything else
+        if any(item.get('generate_le') for item in items): return f'{self.model_name}:generate_le'
+        return self.model_name
+
     def check_equals(self, a, b):
         return ( a['name'] == b['name'] and
                  a['server'] == b['server'] )
@@ -26,3 +32,13 @@ class SitesManager(ApiModelManager):
 
     def check_satisfies(self, existing, new):
         return False
+
+    def equals_key(self, item):
+        return ( item['name'],
+                 item['server'] )
+
+    def obstructs_key(self, item):
+        return self.equals_key(item)
+
+    def satisfies_key(self, item):
+        return None
@@ -0,0 +1,68 @@
+import json
+import codecs
+import logging
+
+log = logging.getLogger(__name__)
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]'
+
+def iter_array(chunks, decoder=None, compact_at=1 << 16):
+    """
+    Decode a JSON array incrementally from an iterable of byte chunks (e.g. a streamed response body),
+    yielding its elements one at a time, so memory use is bounded by the largest element rather than
+    the whole array. Raises ValueError if the body is not a JSON array.
+    """
+    decoder = decoder or json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    done = False
+    started = False
+
+    def fill():
+        nonlocal buf, pos, done
+        if done: return False
+        # Drop what was consumed, so the buffer does not grow with the array
+        if pos >= compact_at or pos == len(buf):
+            buf, pos = buf[pos:], 0
+        for chunk in chunks:
+            text = utf8.decode(chunk)
+            if text:
+                buf += text
+                return True
+        buf += utf8.decode(b'', final=True)
+        done = True
+        return False
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE: pos += 1
+            if pos < len(buf) or not fill(): return pos < len(buf)
+
+    if not skip_whitespace() or buf[pos] != '[': raise ValueError('Expected a JSON array')
+    pos += 1
+    while True:
+        if not skip_whitespace(): raise ValueError('Unterminated JSON array')
+        if buf[pos] == ']':
+            if started: raise ValueError('Trailing comma in JSON array')
+            return
+        while True:
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if fill(): continue
+                raise ValueError('Truncated or invalid JSON array') from None
+            # A number may continue in the next chunk (e.g. "12" then "34", or "1.5" then "e-7"),
+            # so it is only complete once a delimiter follows it
+            if type(element) in (int, float) and (end == len(buf) or buf[end] not in DELIMITERS) and fill(): continue
+            break
+        pos = end
+        yield element
+        if not skip_whitespace(): raise ValueError('Unterminated JSON array')
+        if buf[pos] == ']': return
+        if buf[pos] != ',': raise ValueError(f'Expected , or ] in JSON array, got {buf[pos]!r}')
+        pos += 1
+        started = True
@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import functools
+import contextlib
+import contextvars
+
+log = logging.getLogger(__name__)
+
+current = contextvars.ContextVar('opalstack_span', default=None)
+
+def new_id(bits=64):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+class Span():
+    def __init__(self, tracer, name, parent=None, attributes={}):
+        """
+        One timed step of work. Spans started while another is current (see Tracer.span())
+        become its children and share its trace_id, so a whole flow can be read back as a tree.
+        """
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else new_id(128)
+        self.span_id = new_id()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes)
+        self.status = 'ok'
+        self.thread = threading.get_ident()
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        """
+        Add or replace attributes, e.g. the status of a response once it has arrived.
+        """
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        """
+        Finish the span, marking it failed if `error` (an exception) is given, and export it.
+        Ending a span twice has no effect.
+        """
+        if self.duration is not None: return
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.status = 'error'
+            self.attributes['error'] = type(error).__name__
+        self.tracer.export(self)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'status': self.status,
+            'thread': self.thread,
+            'attributes': self.attributes,
+        }
+
+    def __repr__(self):
+        return f'<Span {self.name} {self.span_id}>'
+
+class NullSpan():
+    """
+    Stands in for a Span while nothing is exporting, so tracing costs next to nothing when off.
+    """
+    def set(self, **attributes): pass
+    def end(self, error=None):   pass
+
+NULL_SPAN = NullSpan()
+
+class Tracer():
+    def __init__(self):
+        """
+        Creates spans and hands every finished one to its exporters (see add_exporter()).
+        While it has no exporter, spans are not recorded at all.
+        """
+        self.exporters = []
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.exporters)
+
+    def add_exporter(self, exporter):
+        """
+        Export finished spans to `exporter`, any object with export(span) and close() methods
+        (see JsonLinesExporter, ChromeTraceExporter and MemoryExporter).
+        """
+        with self.lock:
+            self.exporters = self.exporters + [exporter]
+        return exporter
+
+    def remove_exporter(self, exporter):
+        with self.lock:
+            self.exporters = [e for e in self.exporters if e is not exporter]
+
+    def start_span(self, name, **attributes):
+        """
+        Start a span, child of the current one, without making it current.
+        The caller must end() it; this suits work that outlives one block, such as a generator.
+        """
+        if not self.exporters: return NULL_SPAN
+        return Span(self, name, current.get(), attributes)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Time the with block as a span, child of the current one, and make it current within the block,
+        so spans started inside (in this thread or task, or in functions passed through wrap()) nest under it.
+        An exception leaving the block marks the span failed.
+        """
+        if not self.exporters:
+            yield NULL_SPAN
+            return
+        span = Span(self, name, current.get(), attributes)
+        token = current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        finally:
+            current.reset(token)
+            span.end()
+
+    def export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                log.exception(f'Span exporter {exporter!r} failed')
+
+#
+# -- The process-wide tracer --
+#
+
+tracer = Tracer()
+
+def span(name, **attributes):
+    """
+    See Tracer.span(), on the process-wide tracer.
+    """
+    return tracer.span(name, **attributes)
+
+def start_span(name, **attributes):
+    """
+    See Tracer.start_span(), on the process-wide tracer.
+    """
+    return tracer.start_span(name, **attributes)
+
+def current_span():
+    """
+    Return the span current in this thread or task, or None.
+    """
+    return current.get()
+
+def wrap(fn):
+    """
+    Return `fn` bound to the current span, so that spans it starts on another thread
+    (e.g. in a ThreadPoolExecutor) nest under the span current here.
+    """
+    if not tracer.exporters: return fn
+    context = contextvars.copy_context()
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+#
+# -- Exporters --
+#
+
+class JsonLinesExporter():
+    def __init__(self, path):
+        """
+        Append every finished span to `path` as one JSON object per line (see Span.to_dict()).
+        Start times are in seconds since the epoch; durations are in seconds.
+        """
+        self.path = path
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class ChromeTraceExporter():
+    def __init__(self, path):
+        """
+        Write every finished span to `path` as a complete ('X') event of the Chrome trace event format,
+        which chrome://tracing, Perfetto and speedscope show as a flame chart, one track per thread.
+        Events are written as they finish; close() terminates the JSON array, but the viewers
+        also accept the file of a process which did not get to close it.
+        """
+        self.path = path
+        self.file = open(path, 'w')
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.count = 0
+
+    def event(self, span):
+        args = dict(span.attributes, trace_id=span.trace_id, span_id=span.span_id, status=span.status)
+        if span.parent_id is not None: args['parent_id'] = span.parent_id
+        return {
+            'name': span.name,
+            'cat': 'opalstack',
+            'ph': 'X',
+            'ts': span.start * 1e6,
+            'dur': span.duration * 1e6,
+            'pid': self.pid,
+            'tid': span.thread,
+            'args': args,
+        }
+
+    def export(self, span):
+        event = json.dumps(self.event(span), default=str)
+        with self.lock:
+            self.file.write(('[\n' if not self.count else ',\n') + event)
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.write(('[' if not self.count else '') + '\n]\n')
+            self.file.close()
+
+class MemoryExporter():
+    """
+    Keep finished spans in `spans`, e.g. for tests or for analysis in the same process.
+    """
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def close(self):
+        pass
+
+EXPORTERS = {'jsonl': JsonLinesExporter, 'chrome': ChromeTraceExporter}
+
+@contextlib.contextmanager
+def exporting(path, format='jsonl'):
+    """
+    Export the spans of the process-wide tracer to `path`, as 'jsonl' or 'chrome', within the with block:
+        with opalstack.tracing.exporting('ensure.trace.json', format='chrome'):
+            opalapi.osusers.ensure(...)
+    """
+    if format not in EXPORTERS: raise ValueError(f'Unknown trace format {format}; expected one of {", ".join(EXPORTERS)}')
+    exporter = tracer.add_exporter(EXPORTERS[format](path))
+    try:
+        yield exporter
+    finally:
+        tracer.remove_exporter(exporter)
+        exporter.close()
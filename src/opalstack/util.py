@@ -3,24 +3,39 @@ import time
 import logging
 import subprocess
 import textwrap
+import collections.abc
+
+from . import tracing
+from .filters import Filter, Op, accessor
 
 log = logging.getLogger(__name__)
 
 def ts():
     return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
 
+def program_name(cmd):
+    """
+    The program `cmd` runs, e.g. 'rsync' for ['/usr/bin/rsync', '-a', ...]. Tracing spans record only
+    this, since the rest of a command line may carry credentials.
+    """
+    if isinstance(cmd, str): cmd = cmd.split()
+    if not isinstance(cmd, (list, tuple)) or not cmd: return None
+    return os.path.basename(str(cmd[0]))
+
 def run(cmd, stdin=None, strip=True, ensure_status=[0]):
     log.debug(f'Running cmd: {cmd}')
-    if isinstance(cmd, str):
-        p = subprocess.run(cmd, shell=True, executable='/bin/bash', stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    elif isinstance(cmd, list) or isinstance(cmd, tuple):
-        p = subprocess.run(cmd, shell=False, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    else:
-        raise ValueError('cmd must be a string, list, or tuple')
-    stdout = p.stdout.decode().strip() if strip else p.stdout.decode()
-    stderr = p.stderr.decode().strip() if strip else p.stderr.decode()
-    if ensure_status and p.returncode not in ensure_status:
-        raise RuntimeError(f'Command "{cmd}" exited with status {p.returncode}. Stderr: {stderr}')
+    with tracing.span('run', program=program_name(cmd)) as span:
+        if isinstance(cmd, str):
+            p = subprocess.run(cmd, shell=True, executable='/bin/bash', stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        elif isinstance(cmd, list) or isinstance(cmd, tuple):
+            p = subprocess.run(cmd, shell=False, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            raise ValueError('cmd must be a string, list, or tuple')
+        span.set(returncode=p.returncode, stdout_bytes=len(p.stdout), stderr_bytes=len(p.stderr))
+        stdout = p.stdout.decode().strip() if strip else p.stdout.decode()
+        stderr = p.stderr.decode().strip() if strip else p.stderr.decode()
+        if ensure_status and p.returncode not in ensure_status:
+            raise RuntimeError(f'Command "{cmd}" exited with status {p.returncode}. Stderr: {stderr}')
     return (stdout, stderr, p.returncode)
 
 def filt(items, keymap, sep='.'):
@@ -38,17 +53,19 @@ def filt(items, keymap, sep='.'):
         filt(items, {'loc': 4, 'server.hostname': 'host1'})       # Returns [foo]
         filt(items, {'name': 'bar', 'server.hostname': 'host2'})  # Returns [bar]
         filt(items, {'name': 'bar', 'server.hostname': 'host3'})  # Returns []
+        filt(items, {'loc': Gt(3), 'name': Not('foo')})           # Returns [baz]
+
+    Values may also be operators from opalstack.filters, e.g. {'type': In(['A', 'AAAA'])}.
+    An IndexedList answers from its hash indexes instead of scanning.
     """
-    filtered = []
-    for item in items:
-        for keypath in keymap:
-            val = item.copy()
-            for key in keypath.split(sep):
-                val = val[key]
-            if val != keymap[keypath]: break
-        else:
-            filtered.append(item)
-    return filtered
+    if isinstance(items, IndexedList): return items.filt(keymap, sep)
+    return Filter(keymap, sep).all(items)
+
+def ifilt(items, keymap, sep='.', lax=False):
+    """
+    Like filt() (or laxfilt() with lax=True), but lazily yields the matching items of any iterable.
+    """
+    return Filter(keymap, sep, lax=lax).iter(items)
 
 def laxfilt(items, keymap, sep='.'):
     """
@@ -64,21 +81,17 @@ def laxfilt(items, keymap, sep='.'):
         filt(items, {'yyy': 'zzz'})     # Raises KeyError
         laxfilt(items, {'yyy': 'zzz'})  # Returns [foo]
     """
-    filtered = []
-    for item in items:
-        for keypath in keymap:
-            ok = True
-            val = item.copy()
-            for key in keypath.split(sep):
-                try:
-                    val = val[key]
-                except KeyError:
-                    ok = False
-                    break
-            if not ok or val != keymap[keypath]: break
-        else:
-            filtered.append(item)
-    return filtered
+    if isinstance(items, IndexedList): return items.laxfilt(keymap, sep)
+    return Filter(keymap, sep, lax=True).all(items)
+
+def frozen(value):
+    """
+    Hashable equivalent of a JSON-like value: lists become tuples and dicts become sorted tuples of items.
+    """
+    if isinstance(value, list): return tuple(frozen(v) for v in value)
+    if isinstance(value, dict): return tuple(sorted((k, frozen(v)) for k, v in value.items()))
+    if isinstance(value, collections.abc.Mapping): return tuple(sorted((k, frozen(v)) for k, v in value.items()))
+    return value
 
 def one(items):
     assert len(items) == 1
@@ -102,6 +115,122 @@ def laxfilt_one(items, keymap):
 def laxfilt_one_or_none(items, keymap):
     return one_or_none(laxfilt(items, keymap))
 
+class IndexedList(list):
+    """
+    A list of items (e.g. from list_all(indexed=True)) which answers filt() lookups from hash indexes.
+    An index on a set of keypaths, nested (e.g. 'server.hostname') or not, is built the first time
+    a keymap comparing exactly those keypaths to plain values is looked up, and reused afterwards,
+    so resolving m names against n items costs O(n + m) rather than O(n * m).
+    Keymaps mixing plain values with operators use the index for the plain values.
+    Indexes are dropped whenever the list changes; changes to the items themselves are not noticed.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.indexes = {}
+
+    def index_by(self, *keypaths, sep='.'):
+        """
+        Return the index on `keypaths`: {frozen values: [positions of the matching items]},
+        plus a list of the positions of items lacking one of the keypaths under None,
+        building it if needed.
+        """
+        key = (tuple(sorted(keypaths)), sep)
+        index = self.indexes.get(key)
+        if index is not None: return index
+        getters = [accessor(keypath, sep) for keypath in key[0]]
+        index = {None: []}
+        for position, item in enumerate(self):
+            try:
+                values = tuple(frozen(get(item)) for get in getters)
+            except KeyError:
+                index[None].append(position)
+                continue
+            index.setdefault(values, []).append(position)
+        self.indexes[key] = index
+        return index
+
+    def candidates(self, keymap, sep, lax):
+        """
+        Items which might match `keymap`, in list order: the index bucket for its plain values,
+        plus, unless lax, the items lacking those keypaths, so the filter raises KeyError as filt() would.
+        """
+        keypaths = sorted(keypath for keypath, expected in keymap.items() if not isinstance(expected, Op))
+        if not keypaths: return self
+        index = self.index_by(*keypaths, sep=sep)
+        positions = index.get(tuple(frozen(keymap[keypath]) for keypath in keypaths), [])
+        if not lax and index[None]: positions = sorted(positions + index[None])
+        return [self[position] for position in positions]
+
+    def filt(self, keymap, sep='.'):
+        return Filter(keymap, sep).all(self.candidates(keymap, sep, lax=False))
+
+    def laxfilt(self, keymap, sep='.'):
+        return Filter(keymap, sep, lax=True).all(self.candidates(keymap, sep, lax=True))
+
+    def filt_one(self, keymap):
+        return one(self.filt(keymap))
+
+    def filt_one_or_none(self, keymap):
+        return one_or_none(self.filt(keymap))
+
+    def laxfilt_one(self, keymap):
+        return one(self.laxfilt(keymap))
+
+    def laxfilt_one_or_none(self, keymap):
+        return one_or_none(self.laxfilt(keymap))
+
+    def changed(self):
+        self.indexes = {}
+
+    def __setitem__(self, *args):
+        self.changed()
+        return super().__setitem__(*args)
+
+    def __delitem__(self, *args):
+        self.changed()
+        return super().__delitem__(*args)
+
+    def __iadd__(self, *args):
+        self.changed()
+        return super().__iadd__(*args)
+
+    def __imul__(self, *args):
+        self.changed()
+        return super().__imul__(*args)
+
+    def append(self, *args):
+        self.changed()
+        return super().append(*args)
+
+    def extend(self, *args):
+        self.changed()
+        return super().extend(*args)
+
+    def insert(self, *args):
+        self.changed()
+        return super().insert(*args)
+
+    def remove(self, *args):
+        self.changed()
+        return super().remove(*args)
+
+    def pop(self, *args):
+        self.changed()
+        return super().pop(*args)
+
+    def clear(self):
+        self.changed()
+        return super().clear()
+
+    def sort(self, *args, **kwargs):
+        self.changed()
+        return super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self.changed()
+        return super().reverse()
+
 class SshRunner():
     def __init__(self, userhost, ssh_password=None, ssh_password_filepath=None, ssh_privkey_path=None, ssh_pubkey_path=None):
         if (ssh_password and not ssh_password_filepath) or (ssh_password_filepath and not ssh_password):
@@ -122,6 +251,12 @@ class SshRunner():
     def has_key(self):
         return bool(self.ssh_privkey_path)
 
+    def span(self, kind, auth, **attributes):
+        """
+        A tracing span for one ssh, scp or rsync call, under which its subprocess span nests.
+        """
+        return tracing.span(kind, userhost=self.userhost, auth=auth, **attributes)
+
     #
     # Password-based SSH
     #
@@ -141,7 +276,8 @@ class SshRunner():
                     '-o', 'StrictHostKeyChecking=no',
                     self.userhost,
         ]
-        return self.run_via_sshpass(prelude + [remote_cmd], *args, **kwargs)
+        with self.span('ssh', 'password'):
+            return self.run_via_sshpass(prelude + [remote_cmd], *args, **kwargs)
 
     def run_passbased_scp(self, src, dst, *args, **kwargs):
         prelude = [ '/usr/bin/scp', '-q', '-C',
@@ -149,7 +285,8 @@ class SshRunner():
                     '-o', 'PubkeyAuthentication=no',
                     '-o', 'StrictHostKeyChecking=no',
         ]
-        return self.run_via_sshpass(prelude + [src, dst], *args, **kwargs)
+        with self.span('scp', 'password', src=src, dst=dst):
+            return self.run_via_sshpass(prelude + [src, dst], *args, **kwargs)
 
     def run_passbased_rsync(self, src, dst, *args, **kwargs):
         prelude = [ 'rsync', '-a',
@@ -157,7 +294,8 @@ class SshRunner():
                               ' -o PubkeyAuthentication=no'
                               ' -o StrictHostKeyChecking=no',
         ]
-        return self.run_via_sshpass(prelude + [src, dst], *args, **kwargs)
+        with self.span('rsync', 'password', src=src, dst=dst):
+            return self.run_via_sshpass(prelude + [src, dst], *args, **kwargs)
 
     def check_ssh_password(self):
         stdout, stderr, retcode = self.run_passbased_ssh('/bin/true', ensure_status=[])
@@ -181,7 +319,8 @@ class SshRunner():
                     '-o', 'StrictHostKeyChecking=no',
                     self.userhost,
         ]
-        return run(prelude + [remote_cmd], *args, **kwargs)
+        with self.span('ssh', 'key'):
+            return run(prelude + [remote_cmd], *args, **kwargs)
 
     def run_keybased_scp(self, src, dst, *args, **kwargs):
         prelude = [ '/usr/bin/scp', '-q', '-C',
@@ -190,7 +329,8 @@ class SshRunner():
                     '-o', 'PubkeyAuthentication=yes',
                     '-o', 'StrictHostKeyChecking=no',
         ]
-        return run(prelude + [src, dst], *args, **kwargs)
+        with self.span('scp', 'key', src=src, dst=dst):
+            return run(prelude + [src, dst], *args, **kwargs)
 
     def run_keybased_rsync(self, src, dst, *args, **kwargs):
         prelude = [ 'rsync', '-a',
@@ -199,7 +339,8 @@ class SshRunner():
                               ' -o PubkeyAuthentication=yes'
                               ' -o StrictHostKeyChecking=no',
         ]
-        return run(prelude + [src, dst], *args, **kwargs)
+        with self.span('rsync', 'key', src=src, dst=dst):
+            return run(prelude + [src, dst], *args, **kwargs)
 
     def check_ssh_key(self):
         stdout, stderr, retcode = self.run_keybased_ssh('/bin/true', ensure_status=[])
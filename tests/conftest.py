@@ -0,0 +1,31 @@
+import pytest
+
+from opalstack.backoff import ReadinessStats
+from opalstack.fake import FakeServer, fake_api
+
+#
+# An in-process FakeServer, and Apis talking to it through the real request path.
+#
+
+@pytest.fixture
+def server():
+    return FakeServer()
+
+@pytest.fixture
+def new_api(server):
+    """
+    Make an Api on `server` (or on the given `on` server) with keyword arguments for Api.
+    Readiness is polled quickly, and every Api made is closed after the test.
+    """
+    apis = []
+    def new_api(on=None, token='0123456789abcdef0123456789abcdef01234567', **kwargs):
+        kwargs.setdefault('readiness', ReadinessStats(expected=0.05, min_delay=0.01))
+        api = fake_api(on if on is not None else server, token=token, **kwargs)
+        apis.append(api)
+        return api
+    yield new_api
+    for api in apis: api.close()
+
+@pytest.fixture
+def api(new_api):
+    return new_api()
@@ -0,0 +1,116 @@
+import pytest
+
+from opalstack.apply import Ref, ApplyError
+from opalstack.fake import FakeServer
+
+#
+# A FakeServer noting, for each create, the model, the names created and the names of
+# every item still pending at the time, to check what apply() waited for.
+#
+
+class ApplyServer(FakeServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.events = []
+
+    def create(self, model_name, body):
+        for name in self.store: self.settle(name)
+        pending = {item.get('name') for store in self.store.values() for item in store.values() if item.get('ready') is False}
+        self.events.append((model_name, [entry.get('name') for entry in body], pending))
+        return super().create(model_name, body)
+
+    def created(self):
+        return [model_name for model_name, names, pending in self.events]
+
+@pytest.fixture
+def server():
+    return ApplyServer(ready_delay=0.05)
+
+def primary_ip(server):
+    return next(ip for ip in server.items('ip') if ip['primary'])
+
+def site_desired(server):
+    ip = primary_ip(server)
+    return {
+        'domains': {'domain': {'name': 'www.example.com'}},
+        'osusers': {'osuser': {'name': 'user1', 'server': ip['server']}},
+        'apps':    {'app': {'name': 'app1', 'osuser': Ref('osuser'), 'type': 'STA'}},
+        'sites':   {'site': {'name': 'site1', 'server': ip['server'], 'ip4': ip['id'], 'domains': [Ref('domain')],
+                             'routes': [{'app': Ref('app'), 'uri': '/'}]}},
+    }
+
+def test_refs_are_resolved_in_dependency_order(api, server):
+    applied = api.apply(site_desired(server))
+
+    assert applied['app']['osuser'] == applied['osuser']['id']
+    assert applied['site']['domains'] == [applied['domain']['id']]
+    assert applied['site']['routes'] == [{'app': applied['app']['id'], 'uri': '/'}]
+    assert all(item['ready'] for item in server.items('site'))
+
+    pending = {model_name: pending for model_name, names, pending in server.events}
+    assert 'user1' not in pending['app']
+    assert not {'app1', 'www.example.com'} & pending['site']
+
+def test_independent_branches_overlap(api, server):
+    api.apply(site_desired(server))
+
+    # The domain and the osuser are both created before either is ready
+    assert sorted(server.created()[:2]) == ['domain', 'osuser']
+    first, second = server.events[:2]
+    assert first[1][0] in second[2]
+
+def test_unblocked_items_of_one_manager_are_created_together(api, server):
+    desired = {'domains': {f'domain{i}': {'name': f'www{i}.example.com'} for i in range(5)}}
+    applied = api.apply(desired)
+
+    assert len(applied) == 5
+    assert [(model_name, names) for model_name, names, pending in server.events] == [('domain', [f'www{i}.example.com' for i in range(5)])]
+
+def test_existing_items_are_reused(api, server):
+    server.add('osuser', [{'id': 'existing-user', 'name': 'user1', 'server': primary_ip(server)['server']}])
+    applied = api.apply(site_desired(server))
+
+    assert applied['osuser']['id'] == 'existing-user'
+    assert applied['app']['osuser'] == 'existing-user'
+    assert 'osuser' not in server.created()
+
+def test_existing_apps_and_sites_are_reused(new_api, server):
+    # Apps and sites are never satisfied by another item, only equal to one
+    first = new_api().apply(site_desired(server))
+    server.events.clear()
+    again = new_api().apply(site_desired(server))
+
+    assert server.created() == []
+    assert {name: item['id'] for name, item in again.items()} == {name: item['id'] for name, item in first.items()}
+
+def test_obstructions_are_reported_before_any_change(api, server):
+    server.add('osuser', [{'id': 'existing-user', 'name': 'user1', 'server': primary_ip(server)['server']}])
+    server.add('app', [{'id': 'existing-app', 'name': 'app1', 'osuser': 'existing-user', 'type': 'STA'}])
+    desired = {
+        'domains': {'domain': {'name': 'www.example.com'}},
+        'apps':    {'app': {'name': 'app1', 'osuser': 'existing-user', 'type': 'APA'}},
+    }
+    with pytest.raises(ApplyError) as info:
+        api.apply(desired, reuse=False)
+
+    assert sorted(info.value.failed) == ['app'] and 'existing-app' in str(info.value.failed['app'])
+    assert server.requested('POST') == []
+
+def test_failure_skips_dependents_only(api, server):
+    server.inject(400, method='POST', path='^/osuser/create/')
+    with pytest.raises(ApplyError) as info:
+        api.apply(site_desired(server))
+
+    assert sorted(info.value.failed) == ['app', 'osuser', 'site']
+    assert sorted(info.value.applied) == ['domain']
+    assert server.created() == ['domain']
+
+@pytest.mark.parametrize('desired', [
+    {'apps': {'app': {'name': 'app1', 'osuser': Ref('nobody')}}},
+    {'apps': {'a': {'name': 'a', 'osuser': Ref('b')}, 'b': {'name': 'b', 'osuser': Ref('a')}}},
+    {'nonsense': {'x': {}}},
+])
+def test_invalid_graphs_are_rejected_before_any_change(api, server, desired):
+    with pytest.raises(ValueError):
+        api.apply(desired)
+    assert not server.history
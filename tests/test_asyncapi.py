@@ -0,0 +1,141 @@
+import asyncio
+import inspect
+import threading
+
+import pytest
+
+import opalstack
+from opalstack.fake import FakeServer, FakeTransport
+from opalstack.backoff import ReadinessStats
+from opalstack.pending import PendingResult
+
+@pytest.fixture
+def server():
+    return FakeServer(ready_delay=0.05)
+
+def async_api(server, **kwargs):
+    return opalstack.AsyncApi(token='x', transport=FakeTransport(server), readiness=ReadinessStats(expected=0.05, min_delay=0.01), **kwargs)
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+def test_other_manager_methods_are_awaitable(server):
+    async def main():
+        async with async_api(server) as aapi:
+            assert inspect.iscoroutinefunction(aapi.ips.primary_for)
+            assert inspect.iscoroutinefunction(aapi.apps.mark_installed)
+            # Policies make no requests and stay plain methods
+            assert not inspect.iscoroutinefunction(aapi.osusers.check_equals)
+            assert aapi.osusers.model_name == 'osuser'
+            web = (await aapi.servers.list_all())['web_servers'][0]
+            assert (await aapi.servers.by_hostname('opal1.opalstack.com')) == web
+            assert (await aapi.ips.primary_for(web['id']))['ip'] == '192.0.2.10'
+            osuser = await aapi.osusers.create_one({'name': 'user1', 'server': web['id']})
+            app = await aapi.apps.create_one({'name': 'app1', 'osuser': osuser['id'], 'type': 'STA'})
+            await aapi.apps.mark_installed([app['id']])
+            return await aapi.apps.read(app['id'])
+    assert run(main())['installed']
+
+def test_reference_data_is_shared_with_the_sync_manager(server):
+    async def main():
+        async with async_api(server, reference_ttl=3600) as aapi:
+            await aapi.servers.list_all()
+            await aapi.ips.list_all()
+            web = (await aapi.servers.list_all())['web_servers'][0]
+            assert (await aapi.servers.read(web['id'])) == web
+    run(main())
+    assert server.call_count('GET', 'server', 'list') == 1 and server.call_count('GET', 'ip', 'list') == 1
+    assert server.call_count('GET', 'server', 'read') == 0
+
+def test_requests_run_off_the_event_loop(server):
+    server.latency = 0.1
+    async def main():
+        async with async_api(server) as aapi:
+            listed = asyncio.ensure_future(aapi.domains.list_all())
+            ticks = 0
+            while not listed.done():
+                await asyncio.sleep(0.01)
+                ticks += 1
+            return await listed, ticks
+    domains, ticks = run(main())
+    assert domains == [] and ticks >= 5
+
+class CountingServer(FakeServer):
+    """
+    Records the largest number of requests it was handling at once.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.counting = threading.Lock()
+
+    def handle(self, method, path, body=None, headers=None):
+        with self.counting:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            return super().handle(method, path, body, headers=headers)
+        finally:
+            with self.counting: self.in_flight -= 1
+
+def test_concurrency_bounds_the_requests_in_flight():
+    server = CountingServer(latency=0.05)
+    async def main():
+        async with async_api(server, concurrency=2, coalesce=False) as aapi:
+            return await asyncio.gather(*[aapi.domains.list_all() for i in range(6)])
+    assert run(main()) == [[]] * 6
+    assert server.call_count('GET', 'domain', 'list') == 6 and server.most_in_flight == 2
+
+def test_concurrent_creates_are_waited_for_together(server):
+    async def main():
+        async with async_api(server) as aapi:
+            created = await asyncio.gather(*[aapi.domains.create_one({'name': f'example{i}.com'}) for i in range(5)])
+            with pytest.raises(opalstack.ApiError):
+                await aapi.domains.create_one({'name': 'example0.com'})
+            return created, await aapi.domains.list_all()
+    created, domains = run(main())
+    assert [domain['name'] for domain in created] == [f'example{i}.com' for i in range(5)]
+    assert all(domain['ready'] for domain in domains) and len(domains) == 5
+
+def test_wait_false_returns_an_awaitable_handle(server):
+    async def main():
+        async with async_api(server) as aapi:
+            pending = await aapi.domains.create([{'name': 'example.com'}], wait=False)
+            assert isinstance(pending, PendingResult) and not pending[0]['ready']
+            assert (await pending) is pending
+            domain = await aapi.domains.read(pending[0]['id'])
+            await aapi.domains.delete_one(domain)
+            return domain, await aapi.domains.list_all()
+    domain, remaining = run(main())
+    assert domain['ready'] and remaining == []
+
+def test_large_batches_are_polled_by_list(server):
+    async def main():
+        async with async_api(server, poll_list_threshold=3) as aapi:
+            return await aapi.domains.create([{'name': f'example{i}.com'} for i in range(4)])
+    assert len(run(main())) == 4
+    assert server.call_count('GET', 'domain', 'list') >= 1 and server.call_count('GET', 'domain', 'read') == 0
+
+def test_waits_hold_no_request_slot():
+    server = FakeServer(ready_delay=0.3)
+    async def main():
+        async with async_api(server, concurrency=1) as aapi:
+            creating = asyncio.ensure_future(aapi.domains.create_one({'name': 'example.com'}))
+            await asyncio.sleep(0.05)
+            listed = await aapi.domains.list_all()
+            return listed, creating.done(), await creating
+    listed, done, created = run(main())
+    assert not done and not listed[0]['ready']
+    assert type(created) is dict and server.items('domain')[0]['ready']
+
+def test_ensure_and_reconcile(server):
+    async def main():
+        async with async_api(server) as aapi:
+            created = await aapi.domains.ensure([{'name': 'example.com'}, {'name': 'example.org'}])
+            assert (await aapi.domains.check_ensure([{'name': 'example.com'}]))[2] == []
+            updated, again = await aapi.domains.reconcile([{'name': 'example.com'}], purge=True)
+            return created, updated, again, await aapi.domains.list_all()
+    created, updated, again, domains = run(main())
+    assert sorted(domain['name'] for domain in created) == ['example.com', 'example.org']
+    assert (updated, again) == ([], []) and [domain['name'] for domain in domains] == ['example.com']
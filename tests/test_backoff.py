@@ -0,0 +1,59 @@
+import pytest
+
+from opalstack.backoff import Backoff, ReadinessStats
+from opalstack.fake import FakeServer
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr('opalstack.backoff.time.monotonic', clock.monotonic)
+    return clock
+
+def take(delays, count):
+    return [delay for i, delay in zip(range(count), delays)]
+
+def test_exponential_and_capped():
+    backoff = Backoff(initial=0, base=1, factor=2, cap=5, jitter=0)
+    assert take(backoff.delays(), 6) == [0, 1, 2, 4, 5, 5]
+    assert take(Backoff.fixed(3).delays(), 3) == [3, 3, 3]
+
+def test_jitter_stays_within_bounds():
+    delays = take(Backoff(initial=0, base=1, factor=2, cap=100, jitter=0.25).delays(), 8)
+    for attempt, delay in enumerate(delays[1:]):
+        assert 0.75 * 2 ** attempt <= delay <= 1.25 * 2 ** attempt
+
+def test_tries_and_deadline(clock):
+    assert len(list(Backoff(tries=4, jitter=0).delays())) == 4
+    delays = Backoff(initial=0, base=4, factor=1, jitter=0, timeout=10).delays()
+    assert next(delays) == 0
+    clock.now += 8
+    # Shortened to end right at the deadline, then no more attempts
+    assert next(delays) == 2
+    clock.now += 2
+    assert list(delays) == []
+
+def test_learned_delays_converge():
+    stats = ReadinessStats(expected=5.0, alpha=0.5, min_delay=0.1)
+    assert stats.backoff('osuser').base == 2.5
+    for i in range(12): stats.record('osuser', 1.0)
+    assert stats.typical('osuser') == pytest.approx(1.0)
+    assert stats.backoff('osuser').base == pytest.approx(0.5)
+    # Other profiles keep the default, and nothing goes below min_delay
+    assert stats.backoff('site').base == 2.5
+    stats.record('token', 0.0)
+    assert stats.backoff('token').base == 0.1
+
+def test_waits_learn_from_each_other(new_api):
+    stats = ReadinessStats(expected=0.4, alpha=0.5, min_delay=0.01)
+    api = new_api(on=FakeServer(ready_delay=0.05), readiness=stats)
+    for i in range(5): api.domains.create_one({'name': f'example{i}.com'})
+    # Started from a guess eight times too long, the waits now expect close to the real time
+    assert 0.05 <= stats.typical('domain') < 0.2
+    assert api.wait_backoff('domain').base < 0.1
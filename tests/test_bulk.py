@@ -0,0 +1,112 @@
+import pytest
+import requests
+
+from opalstack.errors import ApiError
+from opalstack.fake import FakeServer
+from opalstack.retry import RetryPolicy
+
+#
+# A FakeServer (which, like the API, rejects a whole request containing a bad item)
+# which can also leave some records pending forever or answer creates with too few items.
+#
+
+class BulkServer(FakeServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.add('domain', [{'id': 'd1', 'name': 'example.com'}])
+        self.dropped = 0
+
+    def create(self, model_name, body):
+        status, headers, created = super().create(model_name, body)
+        return status, headers, created[self.dropped:] if status == 200 else created
+
+    def transition(self, model_name, item, state):
+        super().transition(model_name, item, state)
+        if item.get('content') == 'stuck':
+            item.update(state='PENDING', ready=False)
+            self.settle_at[model_name].pop(item['id'], None)
+
+@pytest.fixture
+def server():
+    return BulkServer(ready_delay=0.05)
+
+@pytest.fixture(autouse=True)
+def no_pauses(monkeypatch):
+    monkeypatch.setattr('opalstack.retry.time.sleep', lambda seconds: None)
+
+def records(n, bad=(), stuck=()):
+    # A record on a domain which does not exist is refused with a 400, and so is its whole request
+    return [{'domain': 'no-such-domain' if i in bad else 'd1', 'type': 'TXT', 'content': 'stuck' if i in stuck else f'v{i}',
+             'priority': 10, 'ttl': 300} for i in range(n)]
+
+def posts(server):
+    return [len(body) for method, path, body in server.history if method == 'POST']
+
+def test_items_are_sent_in_chunks_and_waited_on_together(api, server):
+    result = api.dnsrecords.bulk_create(records(250), chunk_size=100, workers=3)
+
+    assert result.ok
+    assert sorted(posts(server)) == [50, 100, 100]
+    assert [item['content'] for item in result.succeeded] == [f'v{i}' for i in range(250)]
+    assert all(record['ready'] for record in server.items('dnsrecord'))
+    # One wait for all 250: each round is one list/ call
+    rounds = api.metrics.total('wait_rounds', model='dnsrecord', state='ready')
+    assert server.call_count('GET', 'dnsrecord', 'list') == rounds and server.call_count('GET', 'dnsrecord', 'read') == 0
+
+def test_bad_items_only_fail_themselves(api, server):
+    result = api.dnsrecords.bulk_create(records(40, bad=(3, 17)), chunk_size=10, workers=2)
+
+    assert not result.ok
+    assert [item['domain'] for item in result.failed_items] == ['no-such-domain', 'no-such-domain']
+    assert all(isinstance(error, ApiError) and error.status_code == 400 for item, error in result.failed)
+    assert len(result.succeeded) == 38 and len(server.items('dnsrecord')) == 38
+    with pytest.raises(RuntimeError):
+        result.raise_for_errors()
+
+def test_429s_are_retried_by_the_retry_policy_alone(new_api, server):
+    api = new_api(retry=RetryPolicy(retries=2, base=0))
+    server.inject(429, times=2, headers={'Retry-After': '0'})
+    result = api.dnsrecords.bulk_create(records(5), chunk_size=5)
+
+    assert result.ok
+    assert posts(server) == [5, 5, 5]
+
+def test_429s_past_the_retry_policy_fail_the_chunk(new_api, server):
+    api = new_api(retry=RetryPolicy(retries=1, base=0))
+    server.inject(429, times=3, headers={'Retry-After': '0'})
+    result = api.dnsrecords.bulk_create(records(5), chunk_size=5)
+
+    assert len(result.failed) == 5
+    assert posts(server) == [5, 5]
+
+def test_server_errors_on_create_are_not_resent(api, server):
+    server.inject(502, method='POST')
+    result = api.dnsrecords.bulk_create(records(8), chunk_size=8)
+
+    assert posts(server) == [8]
+    assert len(result.failed) == 8 and result.failed[0][1].status_code == 502
+
+def test_short_responses_are_unknown_not_failed(api, server):
+    server.dropped = 1
+    result = api.dnsrecords.bulk_create(records(8), chunk_size=4)
+
+    assert posts(server) == [4, 4]
+    assert result.failed == [] and len(result.unknown_items) == 8 and not result.ok
+    assert result.succeeded == []
+    # The server did apply them
+    assert len(server.items('dnsrecord')) == 8
+
+def test_items_never_ready_are_reported(new_api, server):
+    api = new_api(wait_timeout=0.3)
+    result = api.dnsrecords.bulk_create(records(3, stuck=(1,)))
+
+    assert [item['content'] for item in result.failed_items] == ['stuck']
+    assert len(result.succeeded) == 2
+
+def test_failed_waits_are_reported_not_raised(new_api, server):
+    api = new_api(retry=RetryPolicy(retries=0))
+    server.inject(reset=True, method='GET', times=100)
+    result = api.dnsrecords.bulk_create(records(3))
+
+    assert len(result.failed) == 3 and all(isinstance(error, requests.ConnectionError) for item, error in result.failed)
+    assert len(server.items('dnsrecord')) == 3
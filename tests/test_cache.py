@@ -0,0 +1,154 @@
+import multiprocessing
+
+import pytest
+
+from opalstack.cache import Cache, DiskStore
+from opalstack.fake import FakeServer
+
+@pytest.fixture
+def server():
+    return FakeServer({'domain': [{'id': 'domain1', 'name': 'one.example.com', 'ready': True}]})
+
+def gets(server, action=None):
+    return server.call_count('GET', 'domain', action)
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr('opalstack.cache.time.time', clock.time)
+    return clock
+
+def test_repeated_lookups_are_served_from_cache(clock, server, new_api):
+    api = new_api(cache=Cache(ttl=60))
+    first = api.domains.list_all()
+    assert api.domains.list_all() == first
+    api.domains.read('domain1')
+    api.domains.read('domain1')
+    assert gets(server) == 2
+    stats = api.cache.snapshot()
+    assert stats['hits'] == 2 and stats['misses'] == 2
+    assert stats['domain:hits'] == 2
+
+def test_embed_sets_are_cached_separately(clock, server, new_api):
+    api = new_api(cache=Cache())
+    api.domains.list_all()
+    api.domains.list_all(embed=['dnsrecords'])
+    api.domains.list_all(embed=['dnsrecords'])
+    assert gets(server) == 2
+
+def test_entries_expire_after_their_ttl(clock, server, new_api):
+    api = new_api(cache=Cache(ttl=60, ttls={'domain': 5}))
+    api.domains.list_all()
+    clock.now += 6
+    api.domains.list_all()
+    assert gets(server) == 2
+
+def test_zero_ttl_disables_caching_for_a_model(clock, server, new_api):
+    api = new_api(cache=Cache(ttl=60, ttls={'domain': 0}))
+    api.domains.list_all()
+    api.domains.list_all()
+    assert gets(server) == 2
+
+def test_writes_invalidate_the_model(clock, server, new_api):
+    api = new_api(cache=Cache())
+    api.domains.list_all()
+    api.domains.create([{'name': 'two.example.com'}])
+    assert [domain['name'] for domain in api.domains.list_all()] == ['one.example.com', 'two.example.com']
+    assert gets(server, 'list') == 2
+
+def test_callers_cannot_corrupt_the_cache(clock, server, new_api):
+    api = new_api(cache=Cache())
+    api.domains.list_all().clear()
+    assert len(api.domains.list_all()) == 1
+
+def test_response_fetched_before_a_write_is_not_cached(clock, server, new_api):
+    cache = Cache()
+    api = new_api(cache=cache)
+    generation = cache.generation(api.cache_scope, 'domain')
+    cache.invalidate(api.cache_scope, 'domain')
+    cache.set(api.cache_scope, 'domain', 'list:', [], generation=generation)
+    api.domains.list_all()
+    assert gets(server) == 1
+
+def test_shared_cache_keeps_accounts_apart(clock, server, new_api):
+    cache = Cache()
+    first = new_api(cache=cache)
+    second = new_api(token='y', cache=cache)
+    first.domains.list_all()
+    second.domains.list_all()
+    assert gets(server) == 2
+
+#
+# DiskStore
+#
+
+def test_disk_cache_is_shared_between_caches(clock, tmp_path, server, new_api):
+    # Two Cache objects on one directory behave like two processes on one host
+    first = new_api(cache=Cache(store=DiskStore(str(tmp_path))))
+    second = new_api(cache=Cache(store=DiskStore(str(tmp_path))))
+
+    first.domains.list_all(embed=['dnsrecords'])
+    assert second.domains.list_all(embed=['dnsrecords']) == server.items('domain')
+    assert gets(server) == 1
+
+def test_disk_cache_invalidation_reaches_other_caches(clock, tmp_path, server, new_api):
+    first = new_api(cache=Cache(store=DiskStore(str(tmp_path))))
+    second = new_api(cache=Cache(store=DiskStore(str(tmp_path))))
+
+    first.domains.list_all()
+    second.domains.create([{'name': 'two.example.com'}])
+    assert [domain['name'] for domain in first.domains.list_all()] == ['one.example.com', 'two.example.com']
+    assert gets(server, 'list') == 2
+
+def test_disk_cache_skips_responses_fetched_before_an_invalidation(clock, tmp_path):
+    store = DiskStore(str(tmp_path))
+    generation = store.generation('scope', 'domain')
+    DiskStore(str(tmp_path)).clear('scope', 'domain')
+    store.set('scope', 'domain', 'list:', 2000.0, [], generation=generation)
+    assert store.get('scope', 'domain', 'list:') is None
+
+def test_disk_cache_tolerates_corrupt_files(clock, tmp_path):
+    store = DiskStore(str(tmp_path))
+    store.set('scope', 'domain', 'list:', 2000.0, [1, 2])
+    path = tmp_path / 'scope' / 'domain' / 'list%3A'
+    assert store.get('scope', 'domain', 'list:') == (2000.0, [1, 2])
+    path.write_bytes(b'garbage')
+    assert store.get('scope', 'domain', 'list:') is None
+
+@pytest.mark.parametrize('store', ['memory', 'disk'])
+def test_fresh_keys(clock, tmp_path, store):
+    cache = Cache(ttl=60, ttls={'domain': 5}, store=DiskStore(str(tmp_path)) if store == 'disk' else None)
+    cache.set('scope', 'domain', 'list:dnsrecords', [])
+    cache.set('scope', 'domain', 'read:domain1:', {})
+    clock.now += 3
+    cache.set('scope', 'domain', 'list:', [])
+    assert sorted(cache.fresh_keys('scope', 'domain', prefix='list:')) == ['list:', 'list:dnsrecords']
+    clock.now += 3
+    assert cache.fresh_keys('scope', 'domain') == ['list:']
+    assert cache.snapshot() == {}
+
+def hammer(path, worker):
+    store = DiskStore(path)
+    for i in range(50):
+        store.set('scope', 'domain', f'read:{i % 5}:', 2000.0, {'worker': worker, 'i': i, 'padding': 'x' * 1000})
+        if i % 10 == 0: store.clear('scope', 'domain')
+
+def test_disk_cache_concurrent_processes(tmp_path):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=hammer, args=(str(tmp_path), worker)) for worker in range(4)]
+    for process in processes: process.start()
+    for process in processes: process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    store = DiskStore(str(tmp_path))
+    for i in range(5):
+        entry = store.get('scope', 'domain', f'read:{i}:')
+        assert entry is None or entry[1]['padding'] == 'x' * 1000
+    assert store.generation('scope', 'domain') == 20
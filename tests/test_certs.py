@@ -2,7 +2,7 @@ import pytest
 from testutil import *
 
 import opalstack
-opalapi = opalstack.Api(APIKEY)
+opalapi = make_api()
 
 EXAMPLE_CERT = """
 -----BEGIN CERTIFICATE-----
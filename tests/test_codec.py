@@ -0,0 +1,61 @@
+import json
+import logging
+
+import pytest
+
+from opalstack.codec import get_codec, JsonCodec, OrjsonCodec, orjson
+from opalstack.records import compact
+
+CODECS = ['json', pytest.param('orjson', marks=pytest.mark.skipif(orjson is None, reason='orjson is not installed'))]
+
+@pytest.mark.parametrize('name', CODECS)
+def test_round_trip(name):
+    codec = get_codec(name)
+    obj = [{'id': 'a', 'name': 'naïve ✓', 'ttl': 3600, 'ready': True, 'tags': [None, 1.5]}]
+    assert codec.loads(codec.dumps(obj)) == obj
+    assert codec.loads(json.dumps(obj).encode()) == obj
+    with pytest.raises(ValueError):
+        codec.loads(b'')
+
+@pytest.mark.parametrize('name', CODECS)
+def test_records_are_encoded_as_objects(name):
+    rows = [{'id': 'a', 'server': {'id': 's', 'hostname': 'h'}}, {'id': 'b', 'server': {'id': 's', 'hostname': 'h'}}]
+    assert json.loads(get_codec(name).dumps(compact(rows))) == rows
+    with pytest.raises(TypeError):
+        get_codec(name).dumps([object()])
+
+def test_choosing_a_codec():
+    assert isinstance(get_codec('json'), JsonCodec)
+    assert get_codec().name == ('orjson' if orjson is not None else 'json')
+    codec = JsonCodec()
+    assert get_codec(codec) is codec
+    with pytest.raises(ValueError):
+        get_codec('yaml')
+    if orjson is None:
+        with pytest.raises(RuntimeError):
+            OrjsonCodec()
+
+#
+# An object which counts how often it is formatted.
+#
+
+class Formatted(list):
+    count = 0
+
+    def __repr__(self):
+        Formatted.count += 1
+        return super().__repr__()
+
+def test_debug_output_is_only_formatted_when_enabled(caplog, server, new_api):
+    api = new_api(codec='json')
+    Formatted.count = 0
+    with caplog.at_level(logging.INFO, logger='opalstack.api'):
+        assert api.http_post_result('/domain/create/', Formatted([{'name': 'example.com'}]))[0]['name'] == 'example.com'
+    assert Formatted.count == 0
+    assert server.history[-1] == ('POST', '/domain/create/', [{'name': 'example.com'}])
+    sent = api.metrics.summary('request_bytes', model='domain', action='create', method='POST')
+    assert sent['sum'] == len(b'[{"name":"example.com"}]')
+    with caplog.at_level(logging.DEBUG, logger='opalstack.api'):
+        api.http_post_result('/domain/create/', Formatted([{'name': 'example.org'}]))
+    assert Formatted.count == 1
+    assert 'Performing POST /domain/create/' in caplog.text
@@ -0,0 +1,145 @@
+import types
+import random
+
+import pytest
+
+from opalstack.dnsrecords import DnsrecordsManager
+from opalstack.addresses import AddressesManager
+from opalstack.osvars import OSVarsManager
+from opalstack.sites import SitesManager
+from opalstack.fake import FakeServer, fake_api
+
+#
+# Planning makes no API calls, so these managers need no Api.
+#
+
+def pairwise(manager):
+    # Overriding a check_* method on the instance disables the hash keys
+    manager.check_equals = types.MethodType(type(manager).check_equals, manager)
+    assert not manager.has_hash_keys()
+    return manager
+
+def make_dnsrecord(rng, i):
+    return { 'id': f'dns{i}',
+             'domain': rng.choice(['d1', 'd2']),
+             'type': rng.choice(['A', 'TXT']),
+             'content': rng.choice(['1.2.3.4', '5.6.7.8', 'x']),
+             'priority': 10,
+             'ttl': rng.choice([300, 3600]) }
+
+def make_address(rng, i):
+    return { 'id': f'addr{i}',
+             'source': f'a{i}@example.com',
+             'destinations': rng.sample(['m1', 'm2', 'm3'], rng.randint(0, 2)),
+             'forwards': [] }
+
+def make_osvar(rng, i):
+    return { 'id': f'var{i}',
+             'name': rng.choice(['FOO', 'BAR']),
+             'content': rng.choice(['1', '2']),
+             'global': False,
+             'osusers': rng.sample(['u1', 'u2', 'u3'], 2) }
+
+def make_site(rng, i):
+    return { 'id': f'site{i}',
+             'name': f's{i}',
+             'server': 'srv1' }
+
+@pytest.mark.parametrize('manager_class, make_item', [
+    (DnsrecordsManager, make_dnsrecord),
+    (AddressesManager, make_address),
+    (OSVarsManager, make_osvar),
+    (SitesManager, make_site),
+])
+@pytest.mark.parametrize('purge', [False, True])
+def test_hashed_plan_matches_pairwise_plan(manager_class, make_item, purge):
+    rng = random.Random(1234)
+    hashed = manager_class(None)
+    assert hashed.has_hash_keys()
+    slow = pairwise(manager_class(None))
+
+    for trial in range(50):
+        existing = [make_item(rng, i) for i in range(rng.randint(0, 30))]
+        needed = [make_item(rng, i) for i in rng.sample(range(40), rng.randint(0, 20))]
+        for item in needed: del item['id']
+
+        expected = slow.plan_ensure(existing, needed, purge=purge)
+        assert hashed.plan_ensure(existing, needed, purge=purge) == expected
+
+def test_redundant_existing_items_are_deleted_once():
+    dnsrecords = DnsrecordsManager(None)
+    record = {'domain': 'd1', 'type': 'A', 'content': '1.2.3.4', 'priority': 10, 'ttl': 300}
+    existing = [dict(record, id='first'), dict(record, id='second')]
+
+    toretain, todelete, tocreate = dnsrecords.plan_ensure(existing, [record])
+
+    assert [item['id'] for item in toretain] == ['first']
+    assert [item['id'] for item in todelete] == ['second']
+    assert tocreate == []
+
+def test_obstructing_address_is_replaced():
+    addresses = AddressesManager(None)
+    existing = [{'id': 'addr1', 'source': 'a@example.com', 'destinations': ['m1'], 'forwards': []}]
+    needed = [{'source': 'a@example.com', 'destinations': ['m2'], 'forwards': []}]
+
+    toretain, todelete, tocreate = addresses.plan_ensure(existing, needed)
+
+    assert toretain == []
+    assert todelete == existing
+    assert tocreate == needed
+
+@pytest.mark.parametrize('manager_class, make_item', [
+    (DnsrecordsManager, make_dnsrecord),
+    (AddressesManager, make_address),
+    (OSVarsManager, make_osvar),
+])
+@pytest.mark.parametrize('purge', [False, True])
+def test_hashed_reconcile_matches_pairwise_reconcile(manager_class, make_item, purge):
+    rng = random.Random(4321)
+    hashed = manager_class(None)
+    slow = pairwise(manager_class(None))
+
+    for trial in range(50):
+        existing = [make_item(rng, i) for i in range(rng.randint(0, 30))]
+        needed = [make_item(rng, i) for i in rng.sample(range(40), rng.randint(0, 20))]
+        for item in needed: del item['id']
+
+        expected = slow.plan_reconcile(existing, needed, purge=purge)
+        assert hashed.plan_reconcile(existing, needed, purge=purge) == expected
+
+def test_changed_address_is_updated_in_place():
+    addresses = AddressesManager(None)
+    existing = [{'id': 'addr1', 'source': 'a@example.com', 'destinations': ['m1'], 'forwards': []}]
+    needed = [{'source': 'a@example.com', 'destinations': ['m2'], 'forwards': []}]
+
+    toretain, todelete, toupdate, tocreate = addresses.plan_reconcile(existing, needed)
+
+    assert toretain == []
+    assert todelete == []
+    assert toupdate == [{'id': 'addr1', 'destinations': ['m2']}]
+    assert tocreate == []
+
+def test_models_without_mutable_fields_are_replaced():
+    sites = SitesManager(None)
+    existing = [{'id': 'site1', 'name': 's1', 'server': 'srv1'}]
+    needed = [{'name': 's1', 'server': 'srv1'}]
+
+    toretain, todelete, toupdate, tocreate = sites.plan_reconcile(existing, needed)
+
+    assert todelete == existing
+    assert toupdate == []
+    assert tocreate == needed
+
+def test_ensure_returns_the_created_and_reconcile_the_updated_too():
+    server = FakeServer({'domain': [{'id': 'd1', 'name': 'example.com'}],
+                         'dnsrecord': [{'id': 'dns1', 'domain': 'd1', 'type': 'A', 'content': '1.2.3.4', 'priority': 10, 'ttl': 300}]})
+    api = fake_api(server)
+    changed = {'domain': 'd1', 'type': 'A', 'content': '5.6.7.8', 'priority': 10, 'ttl': 300}
+    added = {'domain': 'd1', 'type': 'TXT', 'content': 'x', 'priority': 10, 'ttl': 300}
+
+    created = api.dnsrecords.ensure([changed, added], purge=True)
+    assert [item['type'] for item in created] == ['TXT']
+    assert server.call_count('POST', 'dnsrecord', 'update') == 1
+
+    updated, created = api.dnsrecords.reconcile([dict(changed, content='9.9.9.9'), added], purge=True)
+    assert [item['id'] for item in updated] == ['dns1'] and created == []
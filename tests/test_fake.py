@@ -0,0 +1,101 @@
+import pytest
+import requests
+
+import opalstack
+from opalstack.fake import FakeServer, FakeTransport, fake_api
+from opalstack.retry import RetryPolicy
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def server():
+    return FakeServer()
+
+def test_reference_data_and_embed(server):
+    api = fake_api(server)
+    servers = api.servers.list_all()
+    assert [len(servers[group]) for group in ('web_servers', 'imap_servers', 'smtp_servers')] == [1, 1, 1]
+    web = servers['web_servers'][0]
+    assert api.ips.primary_for(web['id'])['ip'] == '192.0.2.10'
+    account = api.accounts.list_all(embed=['imap_servers'])[0]
+    assert account['web_servers'] == [web['id']] and account['imap_servers'][0]['hostname'] == 'mail1.opalstack.com'
+    osuser = api.osusers.create_one({'name': 'user1', 'server': web['id'], 'password': 'secret'})
+    assert 'password' not in osuser and osuser['ready']
+    assert api.osusers.read(osuser['id'], embed=['server'])['server'] == web
+    assert api.osusers.read(osuser['id'])['server'] == web['id']
+    assert server.call_count('POST', 'osuser', 'create') == 1
+
+def test_validation_is_atomic(server):
+    api = fake_api(server)
+    web = api.servers.list_all()['web_servers'][0]
+    api.osusers.create_one({'name': 'user1', 'server': web['id']})
+    with pytest.raises(opalstack.ApiError) as info:
+        api.osusers.create([{'name': 'user2', 'server': web['id']}, {'name': 'user1', 'server': web['id']}])
+    assert info.value.status_code == 400 and 'name' in info.value.result
+    with pytest.raises(opalstack.ApiError) as info:
+        api.osusers.create([{'name': 'user3', 'server': 'no-such-server'}])
+    assert info.value.result == {'server': ['Invalid pk "no-such-server" - object does not exist.']}
+    with pytest.raises(opalstack.ApiError) as info:
+        api.osusers.read('no-such-osuser')
+    assert info.value.status_code == 404
+    with pytest.raises(opalstack.ApiError) as info:
+        api.http_post_result('/ip/create/', [{'ip': '192.0.2.12'}])
+    assert info.value.status_code == 405
+    assert [osuser['name'] for osuser in api.osusers.list_all()] == ['user1']
+
+def test_readiness_transitions():
+    clock = Clock()
+    server = FakeServer(ready_delay=2.0, clock=clock)
+    api = fake_api(server)
+    web = api.servers.list_all()['web_servers'][0]
+    created = api.http_post_result('/osuser/create/', [{'name': 'user1', 'server': web['id']}])[0]
+    assert (created['state'], created['ready']) == ('PENDING', False)
+    clock.now = 1.0
+    assert not api.osusers.read(created['id'])['ready']
+    clock.now = 2.0
+    assert api.osusers.read(created['id'])['state'] == 'READY'
+    api.http_post_result('/osuser/delete/', [{'id': created['id']}])
+    assert api.osusers.read(created['id'])['state'] == 'DELETING'
+    clock.now = 4.0
+    assert api.osusers.list_all() == []
+    token = api.http_post_result('/token/create/', [{'name': 'token1'}])[0]
+    assert len(token['key']) == 40 and 'ready' not in token
+
+def test_injected_failures_are_retried(server, monkeypatch):
+    monkeypatch.setattr('opalstack.retry.time.sleep', lambda seconds: None)
+    api = fake_api(server, retry=RetryPolicy(retries=2, base=0))
+    server.inject(503, times=2, path='^/ip/list/')
+    assert len(api.ips.list_all()) == 2
+    assert server.call_count('GET', 'ip', 'list') == 3
+    server.inject(reset=True, method='GET')
+    api.domains.list_all()
+    assert api.metrics.total('retries', model='domain') == 1
+    server.inject(429, times=3, headers={'Retry-After': '0'})
+    with pytest.raises(opalstack.ApiError) as info:
+        api.domains.list_all()
+    assert info.value.status_code == 429
+    server.inject(reset=True)
+    with pytest.raises(requests.ConnectionError):
+        api.http_post_result('/domain/create/', [{'name': 'example.com'}])
+
+def test_random_errors_are_reproducible():
+    def failures(seed):
+        server = FakeServer(error_rate=0.5, seed=seed)
+        return [server.handle('GET', '/domain/list/')[0] for i in range(20)]
+    assert failures(1) == failures(1) and set(failures(1)) == {200, 503}
+
+def test_requests_carry_the_token(server):
+    api = fake_api(server, token='0123456789abcdef0123456789abcdef01234567')
+    api.domains.create_one({'name': 'example.com'})
+    assert [domain['name'] for domain in api.domains.list_all()] == ['example.com']
+    transport = FakeTransport(server)
+    url = 'https://my.opalstack.com/api/v1/domain/list/'
+    assert transport.get(url).status_code == 401
+    assert transport.get(url, headers={'Authorization': 'Token'}).status_code == 401
+    assert transport.get(url, headers=api.api_headers).status_code == 200
+    assert transport.post(url.replace('list', 'delete'), data=b'[]').status_code == 401
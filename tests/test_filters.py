@@ -0,0 +1,65 @@
+import itertools
+
+import pytest
+
+from opalstack.util import filt, laxfilt, ifilt, filt_one
+from opalstack.filters import Filter, In, Not, Regex, Gt, Ge, Lt, Le, Exists, AllOf, AnyOf
+
+ITEMS = [
+    {'name': 'foo', 'server': {'id': 1234, 'hostname': 'host1'}, 'loc': 4, 'yyy': 'zzz'},
+    {'name': 'bar', 'server': {'id': 2345, 'hostname': 'host2'}, 'loc': 3},
+    {'name': 'baz', 'server': {'id': 3456, 'hostname': 'host3'}, 'loc': 4, 'ttl': None},
+]
+
+def names(items):
+    return [item['name'] for item in items]
+
+def test_equality_keymaps():
+    assert names(filt(ITEMS, {'loc': 4})) == ['foo', 'baz']
+    assert names(filt(ITEMS, {'loc': 4, 'server.hostname': 'host1'})) == ['foo']
+    assert names(filt(ITEMS, {'name': 'bar', 'server.hostname': 'host3'})) == []
+    assert names(filt(ITEMS, {'server/id': 2345}, sep='/')) == ['bar']
+    # Matching items are returned as they are, not copied
+    assert filt_one(ITEMS, {'name': 'foo'}) is ITEMS[0]
+
+def test_missing_keys():
+    with pytest.raises(KeyError):
+        filt(ITEMS, {'yyy': 'zzz'})
+    assert names(laxfilt(ITEMS, {'yyy': 'zzz'})) == ['foo']
+    assert names(laxfilt(ITEMS, {'server.nope': 1})) == []
+
+@pytest.mark.parametrize('keymap, expected', [
+    ({'name': In(['foo', 'baz'])}, ['foo', 'baz']),
+    ({'server': In([{'id': 2345, 'hostname': 'host2'}])}, ['bar']),
+    ({'name': Not('foo')}, ['bar', 'baz']),
+    ({'server.hostname': Regex(r'[12]$')}, ['foo', 'bar']),
+    ({'loc': Gt(3)}, ['foo', 'baz']),
+    ({'loc': Ge(3)}, ['foo', 'bar', 'baz']),
+    ({'loc': Lt(4)}, ['bar']),
+    ({'loc': Le(3)}, ['bar']),
+    ({'loc': Ge(3) & Le(3)}, ['bar']),
+    ({'name': In(['foo']) | Regex('^ba')}, ['foo', 'bar', 'baz']),
+    ({'name': ~In(['foo', 'bar'])}, ['baz']),
+    ({'yyy': Exists()}, ['foo']),
+    ({'yyy': Exists(False)}, ['bar', 'baz']),
+    ({'yyy': ~Exists()}, ['bar', 'baz']),
+    ({'yyy': AnyOf(Exists(False), 'zzz')}, ['foo', 'bar', 'baz']),
+    ({'yyy': AllOf(Exists(), 'other')}, []),
+    ({'ttl': Gt(0)}, []),
+])
+def test_operators(keymap, expected):
+    assert names(laxfilt(ITEMS, keymap)) == expected
+
+def test_existence_tests_do_not_raise_in_strict_mode():
+    assert names(filt(ITEMS, {'yyy': Exists(), 'loc': 4})) == ['foo']
+    with pytest.raises(KeyError):
+        filt(ITEMS, {'yyy': Not('zzz')})
+
+def test_filters_stream_lazily():
+    rows = ({'name': f'row{i}', 'loc': i % 3} for i in itertools.count())
+    assert names(itertools.islice(ifilt(rows, {'loc': 0}), 3)) == ['row0', 'row3', 'row6']
+
+def test_compiled_filter_is_reusable():
+    match = Filter({'loc': 4, 'server.hostname': Not('host1')})
+    assert [match(item) for item in ITEMS] == [False, False, True]
+    assert names(match.all(ITEMS)) == ['baz']
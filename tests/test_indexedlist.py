@@ -0,0 +1,60 @@
+import pytest
+
+from opalstack.util import IndexedList, filt, laxfilt, filt_one, filt_one_or_none
+from opalstack.filters import Regex
+
+def make_items():
+    return [
+        {'name': 'foo', 'server': {'id': 1234, 'hostname': 'host1'}, 'loc': 4, 'tags': ['a']},
+        {'name': 'bar', 'server': {'id': 2345, 'hostname': 'host2'}, 'loc': 3, 'tags': ['b']},
+        {'name': 'baz', 'server': {'id': 3456, 'hostname': 'host1'}, 'loc': 4, 'tags': ['a']},
+        {'name': 'qux', 'server': {'id': 4567, 'hostname': 'host2'}, 'loc': 4, 'extra': True, 'tags': []},
+    ]
+
+@pytest.mark.parametrize('keymap', [
+    {'name': 'bar'},
+    {'loc': 4},
+    {'server.hostname': 'host1'},
+    {'server.hostname': 'host2', 'loc': 4},
+    {'server': {'id': 2345, 'hostname': 'host2'}},
+    {'tags': ['a']},
+    {'loc': 4, 'name': Regex('^b')},
+    {'name': 'nobody'},
+])
+def test_same_results_as_a_scan(keymap):
+    items = make_items()
+    assert filt(IndexedList(items), keymap) == filt(items, keymap)
+    assert laxfilt(IndexedList(items), keymap) == laxfilt(items, keymap)
+
+def test_indexes_are_built_once_per_keypath_set():
+    items = IndexedList(make_items())
+    for name in ('foo', 'bar', 'baz', 'qux'):
+        assert filt_one(items, {'name': name, 'server.hostname': items.filt_one({'name': name})['server']['hostname']})['name'] == name
+    assert sorted(keypaths for keypaths, sep in items.indexes) == [('name',), ('name', 'server.hostname')]
+
+def test_missing_keys():
+    items = IndexedList(make_items())
+    assert items.laxfilt_one({'extra': True})['name'] == 'qux'
+    with pytest.raises(KeyError):
+        items.filt({'extra': True})
+
+def test_still_a_list():
+    items = IndexedList(make_items())
+    assert items.index(make_items()[2]) == 2
+    assert items.index_by('name')[('baz',)] == [2]
+
+def test_changes_drop_the_indexes():
+    items = IndexedList(make_items())
+    assert filt_one_or_none(items, {'name': 'new'}) is None
+    items.append({'name': 'new', 'server': {'id': 1, 'hostname': 'host3'}, 'loc': 1, 'tags': []})
+    assert filt_one(items, {'name': 'new'})['loc'] == 1
+    del items[0]
+    assert filt_one_or_none(items, {'name': 'foo'}) is None
+
+def test_list_all_indexed(api, server):
+    server.add('domain', make_items())
+    items = api.domains.list_all(indexed=True)
+    assert isinstance(items, IndexedList)
+    assert items == server.items('domain')
+    assert items.filt_one({'name': 'baz'})['server']['hostname'] == 'host1'
+    assert type(api.domains.list_all()) is list
@@ -5,7 +5,7 @@ import pytest
 from testutil import *
 
 import opalstack
-opalapi = opalstack.Api(APIKEY)
+opalapi = make_api()
 
 @pytest.fixture
 def mailuser_server():
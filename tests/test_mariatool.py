@@ -1,8 +1,10 @@
 import pytest
 from testutil import *
 
+if not LIVE: pytest.skip('needs ssh access to a live server (tests/apikey.txt)', allow_module_level=True)
+
 import opalstack
-opalapi = opalstack.Api(APIKEY)
+opalapi = make_api()
 
 from opalstack.util import SshRunner, MariaTool
 
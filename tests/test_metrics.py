@@ -0,0 +1,114 @@
+import json
+
+import pytest
+import requests
+
+from opalstack.metrics import Metrics, Summary, endpoint
+from opalstack.retry import RetryPolicy
+from opalstack.fake import FakeServer
+
+def test_endpoint():
+    assert endpoint('/dnsrecord/read/8f7e6d5c?embed=domain') == ('dnsrecord', 'read')
+    assert endpoint('/osuser/list/') == ('osuser', 'list')
+
+def test_summary_quantiles():
+    summary = Summary(max_samples=10000)
+    for value in range(1, 1001): summary.observe(value)
+    snapshot = summary.snapshot()
+    assert (snapshot['count'], snapshot['sum'], snapshot['min'], snapshot['max']) == (1000, 500500, 1, 1000)
+    assert (snapshot['p50'], snapshot['p95'], snapshot['p99']) == (500, 950, 990)
+    assert Summary().snapshot()['p50'] is None
+
+def test_summary_samples_are_bounded():
+    summary = Summary(max_samples=100)
+    for value in range(10000): summary.observe(value)
+    assert len(summary.samples) == 100 and summary.count == 10000 and summary.max == 9999
+    assert 3000 < summary.quantile(0.5) < 7000
+
+def test_counters_sinks_and_export(tmp_path):
+    metrics = Metrics()
+    seen = []
+    metrics.add_sink(lambda *event: seen.append(event))
+    metrics.add_sink(lambda *event: 1 / 0)
+    metrics.count('requests', model='osuser', status=200)
+    metrics.count('requests', 2, model='osuser', status=500)
+    metrics.count('requests', model='app', status=200)
+    metrics.observe('request_seconds', 0.25, model='osuser')
+    assert seen[0] == ('counter', 'requests', 1, {'model': 'osuser', 'status': 200})
+    assert seen[-1] == ('summary', 'request_seconds', 0.25, {'model': 'osuser'})
+    assert metrics.total('requests') == 4
+    assert metrics.total('requests', model='osuser') == 3
+    assert metrics.total('requests', status=200) == 2
+    assert metrics.summary('request_seconds', model='osuser')['p99'] == 0.25
+    assert metrics.summary('request_seconds', model='app') is None
+
+    snapshot = metrics.snapshot()
+    assert json.loads(json.dumps(snapshot)) == snapshot
+    assert {'labels': {'model': 'osuser', 'status': '500'}, 'value': 2} in snapshot['counters']['requests']
+
+    path = tmp_path / 'opalstack.prom'
+    metrics.write_prometheus(str(path))
+    text = path.read_text()
+    assert '# TYPE opalstack_requests_total counter\n' in text
+    assert 'opalstack_requests_total{model="osuser",status="500"} 2\n' in text
+    assert 'opalstack_request_seconds{model="osuser",quantile="0.95"} 0.25\n' in text
+    assert 'opalstack_request_seconds_count{model="osuser"} 1\n' in text
+    assert [p.name for p in tmp_path.iterdir()] == ['opalstack.prom']
+
+def test_operation_errors_are_counted():
+    metrics = Metrics()
+    with pytest.raises(ValueError):
+        with metrics.operation('osuser', 'create', [{}, {}]):
+            raise ValueError()
+    assert metrics.total('operations') == 1 and metrics.total('operation_items') == 2 and metrics.total('operation_errors') == 1
+    assert metrics.summary('operation_seconds', model='osuser', op='create')['count'] == 1
+
+#
+# A FakeServer whose clock moves one second every time it is read, so a created osuser
+# is still pending at the first readiness check and ready at the second.
+#
+
+class Ticker():
+    def __init__(self):
+        self.now = -1
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+@pytest.fixture
+def server():
+    return FakeServer({'server': [{'id': 'web1', 'hostname': 'opal1.opalstack.com'}]}, ready_delay=1.5, clock=Ticker())
+
+def test_requests_waits_and_operations_are_recorded(server, new_api, monkeypatch):
+    monkeypatch.setattr('opalstack.retry.time.sleep', lambda seconds: None)
+    api = new_api(codec='json', retry=RetryPolicy(retries=2, base=0))
+    server.inject(reset=True, method='GET')
+    api.osusers.create([{'name': 'user1', 'server': 'web1'}])
+    metrics = api.metrics
+
+    assert metrics.total('requests', model='osuser', action='create', method='POST', status=200) == 1
+    assert metrics.total('requests', model='osuser', action='read', status=200) == 2
+    assert metrics.total('retries', model='osuser', action='read') == 1
+    body = metrics.summary('request_bytes', model='osuser', action='create', method='POST')
+    assert body['count'] == 1 and body['sum'] == len(b'[{"name":"user1","server":"web1"}]')
+    assert metrics.summary('response_bytes', model='osuser', action='read', method='GET')['count'] == 2
+    assert metrics.total('wait_rounds', model='osuser', state='ready') == 2
+    assert metrics.summary('wait_seconds', model='osuser', state='ready')['count'] == 1
+    assert metrics.total('operations', model='osuser', op='create') == 1
+    assert metrics.total('operation_items', model='osuser', op='create') == 1
+
+def test_failed_requests_and_waits_are_recorded(server, new_api, monkeypatch):
+    monkeypatch.setattr('opalstack.retry.time.sleep', lambda seconds: None)
+    shared = Metrics()
+    api = new_api(codec='json', retry=RetryPolicy(retries=0), metrics=shared)
+    assert api.metrics is shared
+    server.add('osuser', [{'id': 'osuser0', 'name': 'user0', 'server': 'web1', 'state': 'PENDING', 'ready': False}])
+    server.inject(reset=True, method='GET')
+    with pytest.raises(requests.ConnectionError):
+        api.osusers.read('osuser0')
+    assert shared.total('requests', model='osuser', action='read', status='error') == 1
+    with pytest.raises(RuntimeError):
+        api.wait_ready('osuser', ['osuser0'], delay=0, tries=3)
+    assert shared.total('wait_rounds', state='ready') == 3
+    assert shared.total('wait_failures', model='osuser', state='ready') == 1
@@ -1,7 +1,7 @@
 from testutil import *
 
 import opalstack
-opalapi = opalstack.Api(APIKEY)
+opalapi = make_api()
 
 def test_notices():
     # -- Create notices --
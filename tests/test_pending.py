@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import opalstack
+from opalstack import tracing
+from opalstack.fake import FakeServer
+from opalstack.pending import PendingItem, PendingResult
+
+@pytest.fixture
+def server():
+    return FakeServer(ready_delay=0.05)
+
+def test_single_item_calls_return_a_pending_item(api):
+    web = api.servers.list_all()['web_servers'][0]
+    osuser = api.osusers.create_one({'name': 'user1', 'server': web['id']}, wait=False)
+    assert isinstance(osuser, PendingItem) and isinstance(osuser, dict)
+    assert osuser['name'] == 'user1' and not osuser['ready']
+    assert osuser.result(timeout=5) is osuser
+    assert api.osusers.read(osuser['id'])['ready']
+
+    updated = api.osusers.update_one({'id': osuser['id']}, wait=False)
+    assert asyncio.run(asyncio.wait_for(awaiting(updated), 5)) is updated
+    deleted = api.osusers.delete_one(osuser, wait=False)
+    assert deleted.result(timeout=5)['id'] == osuser['id']
+    assert api.osusers.list_all() == []
+
+async def awaiting(pending):
+    return await pending
+
+def test_batches_resolve_once_the_server_reports_them_ready(api, server):
+    pending = api.domains.create([{'name': 'example.com'}, {'name': 'example.org'}], wait=False)
+    assert isinstance(pending, PendingResult) and [domain['name'] for domain in pending] == ['example.com', 'example.org']
+    assert not pending.done()
+    done = []
+    pending.add_done_callback(done.append)
+    assert pending.result(timeout=5) is pending and done == [pending]
+    assert all(domain['state'] == 'READY' for domain in server.items('domain'))
+
+def test_gather(api):
+    first = api.domains.create([{'name': 'example.com'}], wait=False)
+    second = api.domains.create([{'name': 'example.org'}], wait=False)
+    both = PendingResult.gather(first, second, PendingResult.completed([]))
+    assert [domain['name'] for domain in both] == ['example.com', 'example.org']
+    both.result(timeout=5)
+    assert first.done() and second.done()
+
+def test_handles_on_one_model_are_polled_together(api):
+    exporter = tracing.tracer.add_exporter(tracing.MemoryExporter())
+    try:
+        first = api.http_post_result('/domain/create/', [{'name': 'example.com'}])
+        second = api.http_post_result('/domain/create/', [{'name': 'example.org'}, {'name': 'example.net'}])
+        # Registered together, before the polling thread can take a round
+        with api.multiplexer.cond:
+            futures = [api.multiplexer.watch('domain', [domain['id'] for domain in created]) for created in (first, second)]
+        for future in futures: future.result(timeout=5)
+    finally:
+        tracing.tracer.remove_exporter(exporter)
+    rounds = [span for span in exporter.spans if span.name == 'wait_round']
+    assert (rounds[0].attributes['handles'], rounds[0].attributes['pending']) == (2, 3)
+
+def test_failures_and_stopping(api):
+    with pytest.raises(opalstack.ApiError):
+        api.multiplexer.watch('domain', ['no-such-domain']).result(timeout=5)
+    pending = api.http_post_result('/domain/create/', [{'name': 'example.com'}])
+    # Checked at once, then not again for a long while
+    api.readiness.record('slow', 60)
+    future = api.multiplexer.watch('domain', [pending[0]['id']], profile='slow')
+    api.multiplexer.stop()
+    assert future.cancelled()
+    with pytest.raises(RuntimeError):
+        api.multiplexer.watch('domain', [pending[0]['id']])
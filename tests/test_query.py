@@ -0,0 +1,69 @@
+import pytest
+
+import opalstack
+from opalstack.query import QueryPlan
+from opalstack.fake import FakeServer
+
+#
+# A small account with two web servers; the FakeServer embeds like the API does and records the GETs.
+#
+
+SERVERS = {'web_servers': [{'id': 'web1', 'hostname': 'opal1.opalstack.com'}, {'id': 'web2', 'hostname': 'opal2.opalstack.com'}],
+           'imap_servers': [], 'smtp_servers': []}
+
+COLLECTIONS = {
+    'server': SERVERS,
+    'ip': [{'id': 'ip1', 'ip': '10.0.0.1', 'primary': True, 'server': 'web1'},
+           {'id': 'ip2', 'ip': '10.0.0.2', 'primary': True, 'server': 'web2'}],
+    'osuser': [{'id': 'user1', 'name': 'alice', 'server': 'web1'}, {'id': 'user2', 'name': 'bob', 'server': 'web2'}],
+    'app': [{'id': 'app1', 'name': 'blog', 'osuser': 'user1'}, {'id': 'app2', 'name': 'shop', 'osuser': 'user2'}],
+    'domain': [{'id': 'dom1', 'name': 'example.com'}],
+    'site': [{'id': 'site1', 'name': 'web', 'server': 'web1', 'ip4': 'ip1', 'domains': ['dom1']}],
+}
+
+@pytest.fixture
+def server():
+    return FakeServer(COLLECTIONS)
+
+@pytest.fixture
+def api(new_api):
+    return new_api(cache=opalstack.Cache(ttl=60), reference_ttl=3600)
+
+def test_keymap_without_keypaths_fetches_plainly(api, server):
+    assert api.osusers.plan_query({'name': 'alice'}) == QueryPlan([], [])
+    assert api.osusers.query_one({'name': 'alice'})['id'] == 'user1'
+    assert server.requested('GET') == ['/osuser/list/']
+
+def test_embeds_what_is_not_at_hand(api, server):
+    osuser = api.osusers.query_one({'server.hostname': 'opal2.opalstack.com'})
+    assert osuser['name'] == 'bob'
+    assert server.requested('GET') == ['/osuser/list/?embed=server']
+
+def test_joins_what_is_at_hand(api, server):
+    api.reference.current()
+    server.reset_counts()
+    assert api.osusers.plan_query({'server.hostname': 'opal2.opalstack.com'}) == QueryPlan([], ['server'])
+    assert api.osusers.query_one({'server.hostname': 'opal2.opalstack.com'})['name'] == 'bob'
+    assert server.requested('GET') == ['/osuser/list/']
+
+def test_reuses_cached_superset(api, server):
+    api.sites.list_all(embed=['domains', 'server'])
+    server.reset_counts()
+    assert api.sites.plan_query({'server.hostname': 'opal1.opalstack.com'}) == QueryPlan(['domains', 'server'], [])
+    assert api.sites.query_one({'server.hostname': 'opal1.opalstack.com'})['id'] == 'site1'
+    assert server.requested('GET') == []
+
+def test_nested_relations_are_joined_within_embedded_objects(api, server):
+    api.reference.current()
+    server.reset_counts()
+    assert api.apps.plan_query({'osuser.server.hostname': 'opal1.opalstack.com'}) == QueryPlan(['osuser'], ['osuser.server'])
+    assert api.apps.query_one({'osuser.server.hostname': 'opal1.opalstack.com'})['name'] == 'blog'
+    # The osusers collection itself is never fetched
+    assert server.requested('GET') == ['/app/list/?embed=osuser']
+
+def test_current_primary_ip_with_extra_embeds(api, monkeypatch):
+    monkeypatch.setattr('socket.gethostname', lambda: 'opal2.opalstack.com')
+    api.reference.ttl = 0
+    ip = api.get_current_primary_ip(embed=['server'])
+    assert ip['id'] == 'ip2'
+    assert ip['server']['hostname'] == 'opal2.opalstack.com'
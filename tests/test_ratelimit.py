@@ -0,0 +1,80 @@
+import pytest
+
+import opalstack
+from opalstack.ratelimit import TokenBucket, RateLimiter
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr('opalstack.ratelimit.time.monotonic', clock.monotonic)
+    monkeypatch.setattr('opalstack.ratelimit.time.sleep', clock.sleep)
+    return clock
+
+def test_burst_then_steady_rate(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    for i in range(5): assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.1)
+    assert bucket.acquire() == pytest.approx(0.1)
+
+def test_waiting_callers_queue_up(clock):
+    bucket = TokenBucket(rate=10, burst=1)
+    bucket.acquire()
+    # Three callers arriving together are spaced one interval apart
+    assert [bucket.reserve() for i in range(3)] == pytest.approx([0.1, 0.2, 0.3])
+
+def test_hold_pauses_then_resumes_without_burst(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.hold(2.0)
+    assert bucket.acquire() == pytest.approx(2.0)
+    assert bucket.acquire() == pytest.approx(0.1)
+
+def test_read_and_mutate_are_limited_separately(clock):
+    limiter = RateLimiter(read_rate=10, read_burst=1, mutate_rate=1, mutate_burst=1)
+    assert limiter.acquire('GET') == 0
+    assert limiter.acquire('POST') == 0
+    assert limiter.acquire('GET') == pytest.approx(0.1)
+    # The GET above already waited 0.1s of the POST's interval
+    assert limiter.acquire('POST') == pytest.approx(0.9)
+    stats = limiter.snapshot()
+    assert stats['read:requests'] == 2 and stats['read:throttled'] == 1
+    assert stats['mutate:wait_seconds'] == pytest.approx(0.9)
+
+def test_unlimited_class(clock):
+    limiter = RateLimiter(mutate_rate=1)
+    assert all(limiter.acquire('GET') == 0 for i in range(100))
+
+#
+# Api objects sharing a limiter draw from the same buckets.
+#
+
+def test_limiter_is_shared_between_apis(clock, new_api):
+    limiter = RateLimiter(read_rate=10, read_burst=2)
+    apis = [new_api(rate_limiter=limiter) for i in range(2)]
+
+    for api in apis: api.domains.list_all()
+    assert clock.slept == []
+    apis[0].domains.list_all()
+    assert clock.slept == pytest.approx([0.1])
+
+def test_429_holds_every_sharer(clock, server, new_api):
+    limiter = RateLimiter(read_rate=10, read_burst=10)
+    first = new_api(rate_limiter=limiter, retry=opalstack.RetryPolicy(retries=0))
+    second = new_api(rate_limiter=limiter)
+    server.inject(429, headers={'Retry-After': '3'})
+
+    with pytest.raises(opalstack.ApiError):
+        first.domains.list_all()
+    second.domains.list_all()
+    assert clock.slept == pytest.approx([3.0])
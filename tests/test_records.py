@@ -0,0 +1,77 @@
+import copy
+import json
+import pickle
+
+import pytest
+
+from opalstack.records import Record, compact, record_name
+from opalstack.util import filt, filt_one, IndexedList
+
+def make_rows():
+    # As decoded from JSON: every row has its own copy of the embedded server
+    return json.loads(json.dumps([
+        {'id': f'user{i}', 'name': f'name{i}', 'state': 'READY', 'ready': True,
+         'server': {'id': 'web1', 'hostname': 'opal1.opalstack.com', 'type': 'web'}}
+        for i in range(4)
+    ] + [{'id': 'user9', 'name': 'name9', 'state': 'READY', 'ready': 1,
+          'server': {'id': 'web1', 'hostname': 'opal1.opalstack.com', 'type': 1}}]))
+
+def test_records_read_like_dicts():
+    rows = make_rows()
+    records = compact(rows)
+    assert records == rows
+    assert rows == records
+    record = records[0]
+    assert isinstance(record, Record)
+    assert record['name'] == 'name0' and record.get('nope') is None and 'state' in record
+    assert list(record) == ['id', 'name', 'state', 'ready', 'server']
+    assert dict(record)['server'] == rows[0]['server']
+    assert dict(record, name='other')['name'] == 'other'
+    with pytest.raises(KeyError):
+        record['nope']
+
+def test_records_can_be_changed():
+    record = compact(make_rows())[0]
+    record['name'] = 'renamed'
+    record['extra'] = 1
+    del record['state']
+    assert record == {'id': 'user0', 'name': 'renamed', 'ready': True, 'server': record['server'], 'extra': 1}
+    assert len(record) == 5
+    with pytest.raises(KeyError):
+        del record['state']
+
+def test_identical_embedded_objects_and_strings_are_shared():
+    records = compact(make_rows())
+    assert records[0]['server'] is records[3]['server']
+    assert records[0]['state'] is records[3]['state']
+    assert type(records[0]).__name__ == 'RecordRecord'
+    assert type(records[0]['server']).__name__ == 'ServerRecord'
+    assert (record_name('web_servers'), record_name('6c0f3a51-2b4e')) == ('WebServersRecord', 'EmbeddedRecord')
+    # Equal but not identical JSON values are kept apart
+    assert records[4]['server'] is not records[0]['server']
+    assert records[4]['server']['type'] == 1
+
+def test_copies_and_pickles():
+    records = compact(make_rows())
+    for clone in (copy.deepcopy(records), pickle.loads(pickle.dumps(records))):
+        assert clone == records
+        assert type(clone[0]) is type(records[0])
+        assert clone[0]['server'] is clone[1]['server']
+
+def test_filters_and_indexes_work_on_records():
+    records = compact(make_rows())
+    assert [r['id'] for r in filt(records, {'server.hostname': 'opal1.opalstack.com', 'ready': True})] == ['user0', 'user1', 'user2', 'user3', 'user9']
+    assert filt_one(IndexedList(records), {'server': {'id': 'web1', 'hostname': 'opal1.opalstack.com', 'type': 'web'}, 'name': 'name2'})['id'] == 'user2'
+
+def test_list_all_compact_and_writing_records_back(api, server):
+    web = api.servers.list_all()['web_servers'][0]
+    server.add('osuser', [{'id': f'user{i}', 'name': f'name{i}', 'state': 'READY', 'ready': True, 'server': web['id']} for i in range(3)])
+    osusers = api.osusers.list_all(compact=True, embed=['server'])
+    assert isinstance(osusers[0], Record) and osusers[0]['server'] is osusers[2]['server']
+    osuser = api.osusers.list_all(compact=True)[0]
+    assert isinstance(osuser, Record)
+    osuser['name'] = 'renamed'
+    api.osusers.update([osuser], wait=False)
+    expected = {'id': 'user0', 'name': 'renamed', 'state': 'READY', 'ready': True, 'server': web['id']}
+    assert [body for method, path, body in server.history if method == 'POST'] == [[expected]]
+    assert server.items('osuser')[0]['name'] == 'renamed'
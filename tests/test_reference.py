@@ -0,0 +1,65 @@
+import pytest
+
+from opalstack.fake import FakeServer
+
+#
+# Servers and ips on a FakeServer, which counts the GETs.
+#
+
+SERVERS = {
+    'web_servers': [{'id': 'web1', 'hostname': 'opal1.opalstack.com'}, {'id': 'web2', 'hostname': 'opal2.opalstack.com'}],
+    'imap_servers': [{'id': 'imap1', 'hostname': 'mail1.opalstack.com'}],
+    'smtp_servers': [{'id': 'smtp1', 'hostname': 'smtp1.opalstack.com'}],
+}
+IPS = [
+    {'id': 'ip1', 'ip': '10.0.0.1', 'type': 4, 'primary': True, 'server': 'web1'},
+    {'id': 'ip2', 'ip': '10.0.0.2', 'type': 4, 'primary': False, 'server': 'web1'},
+    {'id': 'ip3', 'ip': '10.0.0.3', 'type': 4, 'primary': True, 'server': 'web2'},
+]
+
+@pytest.fixture
+def server():
+    return FakeServer({'server': SERVERS, 'ip': IPS})
+
+def test_lookups_after_one_fetch(server, new_api):
+    api = new_api(reference_ttl=3600)
+    assert api.servers.by_hostname('opal2.opalstack.com')['id'] == 'web2'
+    assert api.servers.by_hostname('mail1.opalstack.com', kind='imap')['id'] == 'imap1'
+    assert api.servers.by_hostname('mail1.opalstack.com') is None
+    assert api.ips.primary_for('web1')['id'] == 'ip1'
+    assert [ip['id'] for ip in api.ips.for_server('web1')] == ['ip1', 'ip2']
+    assert api.servers.read('web1')['hostname'] == 'opal1.opalstack.com'
+    assert api.servers.list_all() == SERVERS
+    assert api.ips.list_all() == IPS
+    assert server.call_count('GET') == 2
+
+def test_refresh_refetches(server, new_api):
+    api = new_api(reference_ttl=3600)
+    api.servers.list_all()
+    api.servers.refresh()
+    api.servers.list_all()
+    assert server.call_count('GET') == 4
+
+def test_results_are_copies(new_api):
+    api = new_api(reference_ttl=3600)
+    api.servers.list_all()['web_servers'].clear()
+    assert len(api.servers.list_all()['web_servers']) == 2
+
+def test_the_tier_is_off_by_default(server, new_api):
+    api = new_api()
+    api.servers.list_all()
+    api.servers.list_all()
+    assert server.call_count('GET') == 2
+
+def test_embeds_bypass_the_tier(server, new_api):
+    api = new_api(reference_ttl=3600)
+    api.ips.list_all(embed=['server'])
+    assert server.requested('GET') == ['/ip/list/?embed=server']
+
+def test_current_server_and_primary_ip(monkeypatch, server, new_api):
+    monkeypatch.setattr('socket.gethostname', lambda: 'opal2.opalstack.com')
+    api = new_api(reference_ttl=3600)
+    assert api.get_current_server()['id'] == 'web2'
+    ip = api.get_current_primary_ip()
+    assert ip['id'] == 'ip3' and ip['server']['hostname'] == 'opal2.opalstack.com'
+    assert server.call_count('GET') == 2
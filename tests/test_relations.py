@@ -0,0 +1,58 @@
+import pytest
+
+from opalstack.util import filt
+from opalstack.fake import FakeServer
+
+#
+# A small account, resolved on the client without embed=...
+#
+
+COLLECTIONS = {
+    'server': {'web_servers': [{'id': 'web1', 'hostname': 'opal1.opalstack.com'}], 'imap_servers': [], 'smtp_servers': []},
+    'ip': [{'id': 'ip1', 'ip': '10.0.0.1', 'primary': True, 'server': 'web1'}],
+    'osuser': [{'id': 'user1', 'name': 'alice', 'server': 'web1'}, {'id': 'user2', 'name': 'bob', 'server': 'web1'}],
+    'app': [{'id': 'app1', 'name': 'blog', 'osuser': 'user1'}, {'id': 'app2', 'name': 'shop', 'osuser': 'gone'}],
+    'domain': [{'id': 'dom1', 'name': 'example.com'}, {'id': 'dom2', 'name': 'example.org'}],
+    'site': [{'id': 'site1', 'name': 'web', 'server': 'web1', 'ip4': 'ip1', 'domains': ['dom1', 'dom2']}],
+}
+
+@pytest.fixture
+def server():
+    return FakeServer(COLLECTIONS)
+
+@pytest.fixture(autouse=True)
+def no_embeds(server):
+    yield
+    assert not [path for path in server.requested('GET') if 'embed' in path]
+
+def test_resolved_keypaths_work_with_filt(api):
+    osusers = api.osusers.list_all(resolve=['server'])
+    assert [osuser['name'] for osuser in filt(osusers, {'server.hostname': 'opal1.opalstack.com'})] == ['alice', 'bob']
+    # Rows referring to the same server share it
+    assert osusers[0]['server'] is osusers[1]['server']
+
+def test_nested_and_missing_relations(api):
+    apps = api.apps.list_all(resolve=['osuser', 'osuser.server'])
+    assert apps[0]['osuser']['server']['hostname'] == 'opal1.opalstack.com'
+    assert apps[1]['osuser'] == 'gone'
+
+def test_list_relations(api):
+    site = api.sites.read('site1', resolve=['domains', 'ip4', 'server'])
+    assert [domain['name'] for domain in site['domains']] == ['example.com', 'example.org']
+    assert site['ip4']['ip'] == '10.0.0.1'
+    assert site['server']['hostname'] == 'opal1.opalstack.com'
+
+def test_reference_data_is_fetched_once(new_api, server):
+    api = new_api(reference_ttl=3600)
+    api.osusers.list_all(resolve=['server'])
+    api.ips.list_all(resolve=['server'])
+    assert server.call_count('GET', 'server') == 1
+
+def test_unknown_relation(api):
+    with pytest.raises(ValueError):
+        api.domains.list_all(resolve=['owner'])
+
+def test_current_osuser_without_embed(api, monkeypatch):
+    monkeypatch.setattr('socket.gethostname', lambda: 'opal1.opalstack.com')
+    monkeypatch.setenv('USER', 'bob')
+    assert api.get_current_osuser()['id'] == 'user2'
@@ -0,0 +1,126 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import opalstack
+from opalstack.errors import ApiError
+from opalstack.retry import RetryPolicy
+
+#
+# A local server which answers with the queued failures first, then succeeds.
+#
+
+class FaultyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def handle_any(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length: self.rfile.read(length)
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            status, headers = self.server.faults.pop(0) if self.server.faults else (200, {})
+        body = json.dumps([] if status == 200 else {'detail': 'failure'}).encode()
+        self.send_response(status)
+        for name, value in headers.items(): self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = handle_any
+    do_POST = handle_any
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FaultyHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.faults = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr('opalstack.retry.time.sleep', sleeps.append)
+    return sleeps
+
+def make_api(server, **policy):
+    host, port = server.server_address
+    return opalstack.Api(token='x', url=f'http://{host}:{port}/api/v1', retry=RetryPolicy(**policy))
+
+def test_transient_errors_on_get_are_retried(server, sleeps):
+    server.faults = [(502, {}), (503, {})]
+    api = make_api(server, jitter=0.0)
+
+    assert api.domains.list_all() == []
+    assert len(server.requests) == 3
+    assert sleeps == [0.5, 1.0]
+    stats = api.retry.snapshot()
+    assert stats['retries'] == 2
+    assert stats['retries:502'] == 1 and stats['retries:503'] == 1
+    assert stats['retried_requests'] == 1 and stats['recovered_requests'] == 1
+
+def test_retry_after_is_honored(server, sleeps):
+    server.faults = [(429, {'Retry-After': '7'})]
+    api = make_api(server, jitter=0.0)
+
+    api.domains.list_all()
+    assert sleeps == [7.0]
+
+def test_retry_after_beyond_budget_gives_up(server, sleeps):
+    server.faults = [(429, {'Retry-After': '600'})]
+    api = make_api(server, max_elapsed=60)
+
+    with pytest.raises(ApiError) as info:
+        api.domains.list_all()
+    assert info.value.status_code == 429
+    assert sleeps == []
+    assert api.retry.snapshot()['gave_up'] == 1
+
+def test_gives_up_after_retries(server, sleeps):
+    server.faults = [(500, {})] * 10
+    api = make_api(server, retries=3)
+
+    with pytest.raises(ApiError):
+        api.domains.list_all()
+    assert len(server.requests) == 4
+
+def test_create_is_only_retried_on_429(server, sleeps):
+    server.faults = [(502, {})]
+    api = make_api(server)
+    with pytest.raises(ApiError):
+        api.domains.create([{'name': 'example.com'}])
+    assert len(server.requests) == 1
+
+    server.faults = [(429, {})]
+    api.domains.create([{'name': 'example.com'}])
+    assert len(server.requests) == 3
+
+def test_update_is_retried(server, sleeps):
+    server.faults = [(502, {})]
+    api = make_api(server)
+    api.domains.update([{'id': 'domain1', 'name': 'example.com'}], wait=False)
+    assert len(server.requests) == 2
+
+def test_connection_errors_are_retried(sleeps):
+    api = opalstack.Api(token='x', url='http://127.0.0.1:9/api/v1', retry=RetryPolicy(retries=2))
+    with pytest.raises(Exception):
+        api.domains.list_all()
+    assert api.retry.snapshot()['retries:ConnectionError'] == 2
+
+def test_other_request_errors_are_not_retried(sleeps):
+    api = opalstack.Api(token='x', url='ftp://127.0.0.1:9/api/v1', retry=RetryPolicy(retries=2))
+    with pytest.raises(requests.exceptions.InvalidSchema):
+        api.domains.list_all()
+    assert api.retry.snapshot() == {}
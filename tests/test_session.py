@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+
+import pytest
+
+import opalstack
+
+# The HTTP stand-in the benchmarks use: a FakeServer served over keep-alive HTTP, counting connections
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'benchmarks'))
+from standin import StandinServer
+
+DOMAINS = [{'id': f'dom{i}', 'name': f'example{i}.com'} for i in range(3)]
+
+@pytest.fixture
+def standin():
+    with StandinServer({'domain': DOMAINS}, latency=0.02) as standin:
+        yield standin
+
+def make_api(standin, **kwargs):
+    return opalstack.Api('0123456789abcdef0123456789abcdef01234567', url=standin.url, coalesce=False, **kwargs)
+
+def in_threads(count, fn, together=True):
+    threads = [threading.Thread(target=fn) for i in range(count)]
+    for thread in threads:
+        thread.start()
+        if not together: thread.join()
+    for thread in threads: thread.join()
+
+def test_one_connection_is_reused_across_threads(standin):
+    api = make_api(standin)
+    results = []
+    in_threads(4, lambda: results.append(api.domains.list_all()), together=False)
+    api.close()
+    assert results == [DOMAINS] * 4
+    assert (standin.request_count, standin.connection_count) == (4, 1)
+
+def test_blocking_pool_caps_the_connections(standin):
+    api = make_api(standin, transport=opalstack.make_session(pool_maxsize=2, pool_block=True))
+    in_threads(8, lambda: api.domains.list_all())
+    api.close()
+    assert standin.request_count == 8 and standin.connection_count <= 2
+
+def test_managers_share_the_session(standin):
+    api = make_api(standin)
+    api.domains.list_all()
+    api.osusers.list_all()
+    api.close()
+    assert (standin.request_count, standin.connection_count) == (2, 1)
@@ -0,0 +1,108 @@
+import time
+import threading
+
+import pytest
+
+from opalstack.singleflight import SingleFlight
+from opalstack.fake import FakeServer
+
+def run_together(count, fn):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return results
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'value': 42}
+
+    results = run_together(16, lambda: flight.do('key', slow))
+    assert calls == [1]
+    assert all(result == {'value': 42} for result in results)
+    # Every caller gets its own copy
+    assert len({id(result) for result in results}) == 16
+    assert flight.snapshot() == {'calls': 1, 'coalesced': 15}
+
+def test_exceptions_are_shared():
+    flight = SingleFlight()
+    def failing():
+        time.sleep(0.2)
+        raise RuntimeError('boom')
+
+    results = run_together(4, lambda: flight.do('key', failing))
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_followers_never_see_the_leader_changing_its_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    def fetch():
+        started.set()
+        while flight.snapshot().get('coalesced', 0) < 4: time.sleep(0.001)
+        return [{'id': i, 'server': 'web1'} for i in range(2000)]
+    def lead():
+        # As relations.resolve() does, in place
+        for item in flight.do('key', fetch):
+            item['server'] = {'id': 'web1'}
+            item['resolved'] = True
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait(5)
+    results = run_together(4, lambda: flight.do('key', fetch))
+    leader.join()
+    assert all(result == [{'id': i, 'server': 'web1'} for i in range(2000)] for result in results)
+
+def test_calls_after_completion_start_afresh():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+
+@pytest.mark.parametrize('coalesce, expected_gets', [(True, 1), (False, 8)])
+def test_api_coalesces_identical_gets(new_api, coalesce, expected_gets):
+    server = FakeServer(latency=0.2)
+    api = new_api(on=server, coalesce=coalesce)
+    results = run_together(8, lambda: api.ips.list_all(embed=['server']))
+    assert all(result == results[0] and result[0]['server']['hostname'] for result in results)
+    assert server.call_count('GET', 'ip', 'list') == expected_gets
+
+class HeldServer(FakeServer):
+    """
+    Holds the answer to the first osuser list until released, as if it were slow.
+    """
+    def __init__(self):
+        super().__init__()
+        self.held = threading.Event()
+        self.release = threading.Event()
+
+    def handle(self, method, path, body=None, headers=None):
+        result = super().handle(method, path, body, headers=headers)
+        if '/osuser/list/' in path and not self.held.is_set():
+            self.held.set()
+            self.release.wait(5)
+        return result
+
+def test_reads_after_a_write_never_join_older_gets(new_api):
+    server = HeldServer()
+    api = new_api(on=server)
+    web = api.servers.list_all()['web_servers'][0]
+    early = []
+    thread = threading.Thread(target=lambda: early.append(api.osusers.list_all()))
+    thread.start()
+    assert server.held.wait(5)
+    api.osusers.create([{'name': 'user1', 'server': web['id']}])
+    assert [osuser['name'] for osuser in api.osusers.list_all()] == ['user1']
+    server.release.set()
+    thread.join()
+    assert early == [[]]
+    assert server.call_count('GET', 'osuser', 'list') == 2
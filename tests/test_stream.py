@@ -0,0 +1,101 @@
+import json
+import random
+import asyncio
+
+import pytest
+
+import opalstack
+from opalstack.stream import iter_array
+from opalstack.records import Record
+from opalstack.fake import FakeServer, FakeTransport
+
+ITEMS = [
+    {'id': f'rec{i}', 'content': f'10.0.0.{i}', 'ttl': 3600 + i, 'weight': i / 4, 'note': 'naïve ✓ "quoted"', 'tags': [i, None, True]}
+    for i in range(50)
+] + [12345678901234567890, -1.5e-7, 'str', [], {}, None]
+
+def chunked(data, sizes):
+    pos = 0
+    while pos < len(data):
+        size = next(sizes)
+        yield data[pos:pos + size]
+        pos += size
+
+@pytest.mark.parametrize('seed', range(20))
+def test_any_chunking_decodes_the_same(seed):
+    rng = random.Random(seed)
+    body = json.dumps(ITEMS, indent=rng.choice([None, 1])).encode()
+    sizes = iter(lambda: rng.randint(1, 40), None)
+    assert list(iter_array(chunked(body, sizes), compact_at=64)) == ITEMS
+
+@pytest.mark.parametrize('body, expected', [(b'[]', []), (b' \n[ ]\n', []), (b'[1]', [1]), (b'[1,2]', [1, 2])])
+def test_small_arrays(body, expected):
+    assert list(iter_array(chunked(body, iter(lambda: 1, None)))) == expected
+
+@pytest.mark.parametrize('body', [b'{"detail": "x"}', b'', b'[1, 2', b'[1, 2,]', b'[1 2]', b'[{"a": ]'])
+def test_invalid_bodies(body):
+    with pytest.raises(ValueError):
+        list(iter_array([body]))
+
+def test_elements_are_yielded_as_they_arrive():
+    def chunks():
+        yield b'[{"id": 1}, {"id": 2}, '
+        raise AssertionError('read too far')
+    elements = iter_array(chunks())
+    assert next(elements) == {'id': 1}
+
+#
+# Streaming from a FakeServer, keeping the responses to check they are closed.
+#
+
+class KeepingTransport(FakeTransport):
+    def __init__(self, server):
+        super().__init__(server)
+        self.responses = []
+
+    def get(self, url, headers=None, stream=False):
+        assert stream
+        self.responses.append(super().get(url, headers=headers, stream=stream))
+        return self.responses[-1]
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    server.add('dnsrecord', ITEMS[:50])
+    return server
+
+def make_api(server, **kwargs):
+    return opalstack.Api(token='x', transport=KeepingTransport(server), **kwargs)
+
+@pytest.fixture
+def api(server):
+    api = make_api(server)
+    yield api
+    api.close()
+
+def test_iter_all_streams_and_closes_the_response(api):
+    assert list(api.dnsrecords.iter_all()) == ITEMS[:50]
+    assert api.session.responses[0].closed
+    records = api.dnsrecords.iter_all(embed=['domain'], compact=True)
+    assert isinstance(next(records), Record)
+    records.close()
+    assert api.session.responses[1].closed
+
+def test_iter_all_error_status(api, server):
+    server.inject(403, path='^/dnsrecord/list/')
+    with pytest.raises(opalstack.ApiError) as info:
+        list(api.dnsrecords.iter_all())
+    assert info.value.status_code == 403 and info.value.result == {'detail': 'Injected failure.'}
+    assert api.session.responses[0].closed
+
+def test_iter_all_uses_a_fresh_cached_list(server):
+    api = make_api(server, cache=opalstack.Cache())
+    api.cache.set(api.cache_scope, 'dnsrecord', 'list:', [{'id': 'cached'}])
+    assert list(api.dnsrecords.iter_all()) == [{'id': 'cached'}]
+    assert api.session.responses == []
+
+def test_async_iter_all(server):
+    async def collect():
+        async with opalstack.AsyncApi(token='x', transport=FakeTransport(server)) as aapi:
+            return [item async for item in aapi.dnsrecords.iter_all(batch_size=8)]
+    assert asyncio.run(collect()) == ITEMS[:50]
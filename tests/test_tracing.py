@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from opalstack import tracing
+from opalstack.util import run, SshRunner
+from opalstack.fake import FakeServer
+
+@pytest.fixture
+def spans():
+    exporter = tracing.tracer.add_exporter(tracing.MemoryExporter())
+    yield exporter.spans
+    tracing.tracer.remove_exporter(exporter)
+
+def by_name(spans, name):
+    return [span for span in spans if span.name == name]
+
+def test_spans_nest_and_carry_attributes(spans):
+    with tracing.span('outer', model='osuser') as outer:
+        with tracing.span('inner') as inner:
+            inner.set(items=3)
+        with pytest.raises(ValueError):
+            with tracing.span('failing'):
+                raise ValueError()
+    assert [span.name for span in spans] == ['inner', 'failing', 'outer']
+    assert spans[0].parent_id == spans[1].parent_id == outer.span_id and outer.parent_id is None
+    assert spans[0].trace_id == outer.trace_id
+    assert spans[0].attributes == {'items': 3} and spans[2].attributes == {'model': 'osuser'}
+    assert spans[1].status == 'error' and spans[1].attributes['error'] == 'ValueError'
+    assert outer.duration >= inner.duration >= 0
+    assert tracing.current_span() is None
+
+def test_nothing_is_recorded_without_exporters():
+    with tracing.span('quiet') as span:
+        span.set(ignored=True)
+        assert tracing.current_span() is None
+    assert span is tracing.NULL_SPAN
+    fn = lambda: 1
+    assert tracing.wrap(fn) is fn
+
+def test_subprocess_spans(spans):
+    assert run(['true'])[2] == 0
+    with pytest.raises(RuntimeError):
+        run('false')
+    assert [(span.attributes['program'], span.attributes['returncode'], span.status) for span in spans] == [('true', 0, 'ok'), ('false', 1, 'error')]
+
+def test_ssh_spans(spans, monkeypatch):
+    monkeypatch.setattr('opalstack.util.subprocess.run', lambda cmd, **kwargs: type('P', (), {'returncode': 0, 'stdout': b'', 'stderr': b''})())
+    runner = SshRunner('user@opal1.opalstack.com', ssh_privkey_path='/tmp/key', ssh_pubkey_path='/tmp/key.pub')
+    runner.run_rsync('site/', 'user@opal1.opalstack.com:site/')
+    rsync, = by_name(spans, 'rsync')
+    assert rsync.attributes == {'userhost': 'user@opal1.opalstack.com', 'auth': 'key', 'src': 'site/', 'dst': 'user@opal1.opalstack.com:site/'}
+    assert by_name(spans, 'run')[0].parent_id == rsync.span_id
+    assert by_name(spans, 'run')[0].attributes['program'] == 'rsync'
+
+#
+# A FakeServer whose clock only moves when the Api sleeps between readiness checks:
+# created osusers are pending at the first check and ready at the second.
+#
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += 1
+
+def test_operations_requests_and_wait_rounds_nest(spans, new_api, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('opalstack.api.time.sleep', clock.sleep)
+    server = FakeServer({'server': [{'id': 'web1', 'hostname': 'opal1.opalstack.com'}],
+                         'osuser': [{'id': 'osuser9', 'name': 'old', 'server': 'web1', 'state': 'READY', 'ready': True}]},
+                        ready_delay=1.5, clock=clock)
+    api = new_api(on=server, codec='json', poll_workers=4)
+    api.osusers.ensure([{'name': 'user1', 'server': 'web1'}, {'name': 'user2', 'server': 'web1'}])
+
+    ensure, = by_name(spans, 'osuser.ensure')
+    plan, = by_name(spans, 'osuser.plan')
+    create, = by_name(spans, 'osuser.create')
+    wait, = by_name(spans, 'osuser.wait_ready')
+    assert ensure.attributes['items'] == 2 and plan.attributes['create'] == 2
+    assert plan.parent_id == create.parent_id == ensure.span_id
+    post, = by_name(spans, 'POST /osuser/create/')
+    assert post.parent_id == create.span_id and post.attributes['status'] == 200 and post.attributes['request_bytes'] > 0
+    assert wait.parent_id == create.span_id and wait.attributes['rounds'] == 2
+    rounds = by_name(spans, 'wait_round')
+    assert [r.attributes['remaining'] for r in rounds] == [2, 0]
+    reads = by_name(spans, 'GET /osuser/read/')
+    # Polled concurrently from the pool, yet still under the round which made them
+    assert len(reads) == 4 and {read.parent_id for read in reads} == {r.span_id for r in rounds}
+    assert len({span.trace_id for span in spans}) == 1
+
+def test_exporters(tmp_path):
+    with tracing.exporting(str(tmp_path / 'trace.jsonl')):
+        with tracing.span('outer', model='osuser'):
+            with tracing.span('inner'): pass
+    with tracing.exporting(str(tmp_path / 'trace.json'), format='chrome'):
+        with tracing.span('outer'): pass
+    with tracing.exporting(str(tmp_path / 'empty.json'), format='chrome'): pass
+    assert not tracing.tracer.enabled
+
+    lines = [json.loads(line) for line in (tmp_path / 'trace.jsonl').read_text().splitlines()]
+    assert [line['name'] for line in lines] == ['inner', 'outer']
+    assert lines[0]['parent_id'] == lines[1]['span_id'] and lines[1]['attributes'] == {'model': 'osuser'}
+    events = json.loads((tmp_path / 'trace.json').read_text())
+    assert len(events) == 1 and events[0]['ph'] == 'X' and events[0]['name'] == 'outer' and events[0]['dur'] >= 0
+    assert json.loads((tmp_path / 'empty.json').read_text()) == []
+    with pytest.raises(ValueError):
+        with tracing.exporting(str(tmp_path / 'trace.txt'), format='txt'): pass
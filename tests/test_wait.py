@@ -0,0 +1,57 @@
+import pytest
+
+from opalstack.fake import FakeServer
+
+#
+# Readiness is checked for the whole batch each round: by list/ above poll_list_threshold,
+# by concurrent read/ calls below it.
+#
+
+@pytest.fixture
+def server():
+    return FakeServer(ready_delay=0.05)
+
+def domains(count):
+    return [{'name': f'example{i}.com'} for i in range(count)]
+
+def test_large_batches_are_polled_by_list(server, new_api):
+    api = new_api(poll_list_threshold=3)
+    created = api.domains.create(domains(4))
+    assert all(domain['ready'] for domain in api.domains.list_all())
+    rounds = api.metrics.total('wait_rounds', model='domain', state='ready')
+    assert server.call_count('GET', 'domain', 'read') == 0
+    assert server.call_count('GET', 'domain', 'list') == rounds + 1
+    api.domains.delete(created)
+    assert server.call_count('GET', 'domain', 'read') == 0
+    assert server.items('domain') == []
+
+def test_small_batches_are_polled_by_read(server, new_api):
+    api = new_api(poll_list_threshold=3)
+    created = api.domains.create(domains(2))
+    rounds = api.metrics.total('wait_rounds', model='domain', state='ready')
+    assert server.call_count('GET', 'domain', 'list') == 0
+    assert server.call_count('GET', 'domain', 'read') == 2 * rounds
+    server.reset_counts()
+    api.domains.delete(created)
+    assert server.call_count('GET', 'domain', 'list') == 0
+    assert server.items('domain') == []
+
+def test_only_unready_items_are_checked_again(new_api):
+    server = FakeServer()
+    api = new_api(on=server)
+    ready = api.domains.create_one({'name': 'example.com'})
+    server.ready_delay = 0.05
+    pending = api.http_post_result('/domain/create/', domains(1))[0]
+    server.reset_counts()
+    api.wait_ready('domain', [ready['id'], pending['id']])
+    reads = [path for path in server.requested('GET') if '/domain/read/' in path]
+    assert reads.count(f'/domain/read/{ready["id"]}') == 1 and reads.count(f'/domain/read/{pending["id"]}') >= 2
+
+def test_giving_up(new_api):
+    server = FakeServer(ready_delay=60)
+    api = new_api(on=server, poll_list_threshold=1)
+    pending = api.http_post_result('/domain/create/', domains(2))
+    with pytest.raises(RuntimeError) as info:
+        api.wait_ready('domain', [domain['id'] for domain in pending], delay=0, tries=3)
+    assert pending[0]['id'] in str(info.value)
+    assert server.call_count('GET', 'domain', 'list') == 3
@@ -1,7 +1,9 @@
 import os
 import string
 import random
-import textwrap
+
+import opalstack
+from opalstack.fake import FakeServer, fake_api
 
 # Export pprint to tests
 from pprint import pprint
@@ -18,10 +20,14 @@ def read_file(fpath):
             return fp.read().strip()
     except FileNotFoundError: return None
 
+# To run the tests against the live API, place a test account API key into tests/apikey.txt
+# Important: Data will be deleted; use a separate test account for this.
+# Without a key, they run against an in-process fake of the API (see opalstack.fake),
+# and those which need ssh access to a real server are skipped.
 APIKEY = read_file(os.path.join(MYDIR, 'apikey.txt'))
-if not APIKEY:
-    raise RuntimeError(textwrap.dedent('''
-    Missing API Key.
-        You must place a test account API key into tests/apikey.txt
-        Important: Data will be deleted; use a separate test account for this.
-    ''').strip())
+LIVE = bool(APIKEY)
+FAKE_SERVER = None if LIVE else FakeServer()
+
+def make_api():
+    if LIVE: return opalstack.Api(APIKEY)
+    return fake_api(FAKE_SERVER)